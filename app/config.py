@@ -7,6 +7,115 @@ QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
 QDRANT_PORT = os.getenv("QDRANT_PORT", 6333)
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 OPENROUTER_MODEL = os.getenv("OPENROUTER_MODEL", "openai/gpt-oss-20b:free")
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
 
 COLLECTION_NAME = os.getenv("COLLECTION_NAME", "exam_documents")
-EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "BAAI/bge-small-en-v1.5")
\ No newline at end of file
+# Без EMBEDDING_MODEL - та же модель, что sentence-transformers загружает по имени all-MiniLM-L6-v2
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+
+# Бэкенд эмбеддингов: torch (sentence-transformers) или onnx (ONNX Runtime, int8)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", "models/onnx")
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", 0))  # 0 - по числу ядер
+EMBEDDING_POOLING = os.getenv("EMBEDDING_POOLING", "auto")  # auto - из конфигурации модели; cls (bge) или mean (MiniLM)
+EMBEDDING_MAX_LENGTH = int(os.getenv("EMBEDDING_MAX_LENGTH", 512))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 32))
+
+# Фрагменты файлов: при повторной загрузке файла эмбеддинги считаются только для изменённых фрагментов
+CHUNK_COLLECTION = os.getenv("CHUNK_COLLECTION", f"{COLLECTION_NAME}_chunks")
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 1000))  # символов на фрагмент в среднем
+
+# Переранжирование найденных фрагментов локальным cross-encoder (второй этап после векторного поиска)
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", 30))  # сколько кандидатов векторного поиска оценивать
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", 16))
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", 256))  # токенов на пару запрос-фрагмент
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", 300))  # дольше - исходный порядок векторного поиска
+RERANK_TOP_K = int(os.getenv("RERANK_TOP_K", 6))  # фрагментов в контексте модели после переранжирования
+
+# Бюджет промпта в токенах для OPENROUTER_MODEL
+LLM_CONTEXT_WINDOW = int(os.getenv("LLM_CONTEXT_WINDOW", 131072))
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 24000))  # вход: инструкции + контекст
+PROMPT_FILE_TOKEN_LIMIT = int(os.getenv("PROMPT_FILE_TOKEN_LIMIT", 12000))  # максимум на один файл
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", 2000))
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "o200k_base")
+
+# Допуск запросов к модели (лимиты провайдера и справедливость между пользователями)
+LLM_RATE_LIMIT_RPM = float(os.getenv("LLM_RATE_LIMIT_RPM", 20))  # лимит провайдера, 0 - без лимита
+LLM_RATE_LIMIT_BURST = int(os.getenv("LLM_RATE_LIMIT_BURST", 5))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))  # одновременных запросов к модели всего
+LLM_USER_CONCURRENCY = int(os.getenv("LLM_USER_CONCURRENCY", 4))  # и от одного пользователя
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", 32))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", 30))  # дольше ждать слот не имеет смысла - отказ
+LLM_RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", 2))  # повторов после 429 от провайдера
+LLM_RETRY_AFTER_MAX = float(os.getenv("LLM_RETRY_AFTER_MAX", 20))
+
+# Маршрутизация между провайдерами (OpenAI-совместимые эндпоинты).
+# LLM_BACKENDS - JSON-список [{"name", "url", "model", "api_key_env", "rate_limit_rpm"}],
+# пустой - один бэкенд из OPENROUTER_*.
+# LLM_POLICIES - JSON {"tests"|"teacher"|"analysis": {"backends": [...], "hedge": bool, "hedge_percentile": 95}}
+LLM_BACKENDS = os.getenv("LLM_BACKENDS", "")
+LLM_POLICIES = os.getenv("LLM_POLICIES", "")
+LLM_STATS_WINDOW = int(os.getenv("LLM_STATS_WINDOW", 50))  # последних запросов в статистике бэкенда
+LLM_ERROR_THRESHOLD = float(os.getenv("LLM_ERROR_THRESHOLD", 0.5))  # доля ошибок, с которой бэкенд нездоров
+LLM_UNHEALTHY_COOLDOWN = float(os.getenv("LLM_UNHEALTHY_COOLDOWN", 30))  # через сколько секунд пробовать снова
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 95))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 10))  # до этого числа замеров не дублируем
+
+# Генерация тестов
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "true").lower() == "true"
+TEST_DEFAULT_QUESTIONS = int(os.getenv("TEST_DEFAULT_QUESTIONS", 10))
+TEST_TOPUP_ROUNDS = int(os.getenv("TEST_TOPUP_ROUNDS", 2))  # сколько раз дозапрашивать недостающие вопросы
+TEST_FANOUT_THRESHOLD = int(os.getenv("TEST_FANOUT_THRESHOLD", 15))  # с какого числа вопросов делить запрос на части
+TEST_FANOUT_QUESTIONS_PER_CALL = int(os.getenv("TEST_FANOUT_QUESTIONS_PER_CALL", 8))
+TEST_FANOUT_CONCURRENCY = int(os.getenv("TEST_FANOUT_CONCURRENCY", 4))
+
+# Банк заранее сгенерированных вопросов
+QUESTION_BANK_ENABLED = os.getenv("QUESTION_BANK_ENABLED", "false").lower() == "true"
+QUESTION_BANK_COLLECTION = os.getenv("QUESTION_BANK_COLLECTION", f"{COLLECTION_NAME}_questions")
+QUESTION_BANK_SIZE = int(os.getenv("QUESTION_BANK_SIZE", 30))  # вопросов на файл
+QUESTION_BANK_MIN_SCORE = float(os.getenv("QUESTION_BANK_MIN_SCORE", 0.4))
+QUESTION_BANK_MIN_COVERAGE = float(os.getenv("QUESTION_BANK_MIN_COVERAGE", 0.5))  # ниже - генерация целиком
+
+# Состояние пользователей (тесты, результаты, фоновые задачи) - общее для всех воркеров
+STATE_BACKEND = os.getenv("STATE_BACKEND", "file")  # file - общая папка, redis - для нескольких машин
+STATE_DIR = os.getenv("STATE_DIR", ".")
+STATE_PREFIX = os.getenv("STATE_PREFIX", "examiner")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+STATE_FORMAT = os.getenv("STATE_FORMAT", "compact")  # compact - orjson + zstd, json - читаемый JSON с отступами
+STATE_ZSTD_LEVEL = int(os.getenv("STATE_ZSTD_LEVEL", 6))
+
+# История прохождения тестов: полные записи для последних попыток, для старых - только итоги
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "true").lower() == "true"
+HISTORY_MAX_PER_USER = int(os.getenv("HISTORY_MAX_PER_USER", 200))  # попыток на пользователя
+HISTORY_KEEP_FULL = int(os.getenv("HISTORY_KEEP_FULL", 20))  # последних попыток с ответами и разбором
+HISTORY_RETENTION_DAYS = float(os.getenv("HISTORY_RETENTION_DAYS", 365))  # 0 - хранить без срока
+
+# Запуск: число воркеров (лимиты допуска к модели делятся между ними) и предзагрузка моделей до fork
+APP_WORKERS = int(os.getenv("APP_WORKERS", 1))
+APP_PRELOAD = os.getenv("APP_PRELOAD", "true").lower() == "true"
+APP_RELOAD = os.getenv("APP_RELOAD", "true").lower() == "true"  # один процесс с автоперезагрузкой (разработка)
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"  # прогрев модели и пулов при старте, /ready
+
+# Пробы /live, /ready: зависимости проверяются в фоне, эндпоинты отдают последний результат
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", 5))  # секунд между проверками
+HEALTH_QDRANT_MAX_RTT_MS = float(os.getenv("HEALTH_QDRANT_MAX_RTT_MS", 500))  # дольше - воркер "degraded"
+HEALTH_LLM_MAX_P95 = float(os.getenv("HEALTH_LLM_MAX_P95", 60))  # секунд; p95 медленнее - "degraded"
+HEALTH_QUEUE_SATURATION = float(os.getenv("HEALTH_QUEUE_SATURATION", 0.8))  # доля очереди к модели: выше - 503 на /ready
+
+# Кеш отрендеренных страниц теста (/test, /test-json)
+PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", 512))  # страниц в памяти процесса
+PAGE_CACHE_MIN_COMPRESS = int(os.getenv("PAGE_CACHE_MIN_COMPRESS", 1024))  # меньше - не сжимаем
+
+# Кеш ответов /teacher/ask по смыслу вопроса (в памяти процесса)
+TEACHER_CACHE_ENABLED = os.getenv("TEACHER_CACHE_ENABLED", "true").lower() == "true"
+TEACHER_CACHE_SIZE = int(os.getenv("TEACHER_CACHE_SIZE", 1024))  # ответов
+TEACHER_CACHE_TTL = float(os.getenv("TEACHER_CACHE_TTL", 3600))  # секунд
+TEACHER_CACHE_THRESHOLD = float(os.getenv("TEACHER_CACHE_THRESHOLD", 0.92))  # косинусная близость вопросов
+
+# Наблюдаемость
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text или json
+OTEL_ENABLED = os.getenv("OTEL_ENABLED", "false").lower() == "true"
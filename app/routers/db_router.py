@@ -1,14 +1,22 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
+import logging
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, UploadFile, File
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from starlette.concurrency import run_in_threadpool
+from typing import List, Literal, Optional, Dict, Any
 import json
 
-from app.config import COLLECTION_NAME
-from app.services.user_db_service import UserDBService
+from app.config import QUESTION_BANK_ENABLED
+from app.services.answer_cache import answer_cache
+from app.services.health_service import prober
+from app.services.question_bank_service import QuestionBankService, get_question_bank_service
+from app.services.user_db_service import UserDBService, get_user_db_service
 import os
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
-db_service = UserDBService()
+# Запросов в одном /search-batch: все эмбеддинги считаются одним батчем
+MAX_BATCH_QUERIES = 64
 
 
 class FileAddRequest(BaseModel):
@@ -23,6 +31,17 @@ class FileSearchRequest(BaseModel):
     query_vector: Optional[List[float]] = None
     filters: Optional[Dict[str, Any]] = None
     limit: int = 10
+    rerank: bool = False  # переупорядочить найденное cross-encoder (если RERANK_ENABLED)
+
+
+class BatchSearchRequest(BaseModel):
+    user_id: str
+    queries: List[str]
+    filters: Optional[Dict[str, Any]] = None
+    limit: int = 10  # на каждый запрос
+    target: Literal["files", "chunks"] = "files"
+    group_by: Optional[str] = None  # например file_id: не больше group_size результатов из одного файла
+    group_size: int = 1
 
 
 class FileUpdateRequest(BaseModel):
@@ -37,9 +56,13 @@ class FileDeleteRequest(BaseModel):
 
 
 @router.post("/init")
-def init_db():
+def init_db(
+        db_service: UserDBService = Depends(get_user_db_service),
+        question_bank_service: QuestionBankService = Depends(get_question_bank_service)
+):
     try:
         db_service.init_collection()
+        question_bank_service.init_collection()
         return {"success": True, "message": "Коллекция пользовательских файлов инициализирована"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -47,9 +70,13 @@ def init_db():
 
 @router.post("/add")
 async def add_file(
+        background_tasks: BackgroundTasks,
         file: UploadFile = File(...),
         user_id: str = None,
-        metadata: str = "{}"
+        metadata: str = "{}",
+        replace: bool = False,
+        db_service: UserDBService = Depends(get_user_db_service),
+        question_bank_service: QuestionBankService = Depends(get_question_bank_service)
 ):
     try:
         if not user_id:
@@ -58,26 +85,43 @@ async def add_file(
         # Читаем файл
         content = await file.read()
 
-        print(metadata)
+        logger.debug(f"metadata: {metadata}")
         # Парсим метаданные
         try:
             metadata_dict = json.loads(metadata)
         except:
             metadata_dict = {}
 
-        # Добавляем файл
-        file_id = db_service.add_file(
+        # Добавляем файл; replace - замена файла с тем же именем, эмбеддинги только изменённых фрагментов.
+        # Эмбеддинги считаются в пуле потоков, чтобы не блокировать цикл событий
+        result = await run_in_threadpool(
+            db_service.upsert_file,
             user_id=user_id,
             file_content=content,
             filename=file.filename,
-            file_metadata=metadata_dict
+            file_metadata=metadata_dict,
+            replace=replace
         )
+        file_id = result["file_id"]
+
+        for duplicate_id in result["removed_duplicates"]:
+            question_bank_service.delete_for_file(user_id, duplicate_id)
+            answer_cache.invalidate(duplicate_id)
+        if result["changed"]:
+            answer_cache.invalidate(file_id)
+
+        # Пул вопросов по файлу генерируется в фоне, после ответа клиенту (при замене - если текст изменился)
+        if QUESTION_BANK_ENABLED and result["changed"]:
+            background_tasks.add_task(question_bank_service.build_for_file, user_id, file_id)
 
         return {
             "success": True,
-            "message": f"Файл {file.filename} успешно добавлен",
+            "message": f"Файл {file.filename} успешно {'обновлен' if result['replaced'] else 'добавлен'}",
             "file_id": file_id,
-            "user_id": user_id
+            "user_id": user_id,
+            "replaced": result["replaced"],
+            "changed": result["changed"],
+            "chunks": result["chunks"]
         }
 
     except Exception as e:
@@ -85,14 +129,15 @@ async def add_file(
 
 
 @router.post("/search")
-def search_files(req: FileSearchRequest):
+def search_files(req: FileSearchRequest, db_service: UserDBService = Depends(get_user_db_service)):
     try:
         results = db_service.search_files(
             user_id=req.user_id,
             query_text=req.query_text,
             query_vector=req.query_vector,
             filters=req.filters,
-            limit=req.limit
+            limit=req.limit,
+            rerank=req.rerank
         )
 
         return {
@@ -106,8 +151,36 @@ def search_files(req: FileSearchRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/search-batch")
+def search_batch(req: BatchSearchRequest, db_service: UserDBService = Depends(get_user_db_service)):
+    if len(req.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"Не больше {MAX_BATCH_QUERIES} запросов за раз")
+    try:
+        results = db_service.search_batch(
+            user_id=req.user_id,
+            queries=req.queries,
+            limit=req.limit,
+            filters=req.filters,
+            chunks=req.target == "chunks",
+            group_by=req.group_by,
+            group_size=req.group_size
+        )
+
+        return {
+            "success": True,
+            "results": [
+                {"query": query, "count": len(found), "results": found}
+                for query, found in zip(req.queries, results)
+            ],
+            "user_id": req.user_id
+        }
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.post("/list")
-def list_files(user_id: str, limit: int = 100):
+def list_files(user_id: str, limit: int = 100, db_service: UserDBService = Depends(get_user_db_service)):
     try:
         results = db_service.get_user_files(user_id=user_id, limit=limit)
 
@@ -123,7 +196,7 @@ def list_files(user_id: str, limit: int = 100):
 
 
 @router.post("/update")
-def update_file(req: FileUpdateRequest):
+def update_file(req: FileUpdateRequest, db_service: UserDBService = Depends(get_user_db_service)):
     try:
         success = db_service.update_file_metadata(
             user_id=req.user_id,
@@ -132,6 +205,7 @@ def update_file(req: FileUpdateRequest):
         )
 
         if success:
+            answer_cache.invalidate(req.file_id)
             return {
                 "success": True,
                 "message": f"Файл {req.file_id} обновлен",
@@ -148,7 +222,11 @@ def update_file(req: FileUpdateRequest):
 
 
 @router.delete("/delete")
-def delete_file(req: FileDeleteRequest):
+def delete_file(
+        req: FileDeleteRequest,
+        db_service: UserDBService = Depends(get_user_db_service),
+        question_bank_service: QuestionBankService = Depends(get_question_bank_service)
+):
     try:
         success = db_service.delete_file(
             user_id=req.user_id,
@@ -156,6 +234,8 @@ def delete_file(req: FileDeleteRequest):
         )
 
         if success:
+            question_bank_service.delete_for_file(req.user_id, req.file_id)
+            answer_cache.invalidate(req.file_id)
             return {
                 "success": True,
                 "message": f"Файл {req.file_id} удален",
@@ -178,11 +258,16 @@ def get_help():
 
     POST /db/init - Инициализировать коллекцию
     POST /db/add - Добавить файл (multipart/form-data)
-      Параметры: file (файл), user_id, metadata (JSON строка)
+      Параметры: file (файл), user_id, metadata (JSON строка),
+        replace=true - заменить файл с тем же именем (пересчитываются только изменённые фрагменты)
 
     POST /db/search - Поиск файлов
       Тело запроса: {"user_id": "...", "query_text": "...", "limit": 10}
 
+    POST /db/search-batch - Несколько поисковых запросов за один вызов
+      Тело запроса: {"user_id": "...", "queries": ["...", "..."], "limit": 10,
+                     "target": "files" | "chunks", "group_by": "file_id", "group_size": 1}
+
     POST /db/list - Список файлов пользователя
       Параметры: user_id, limit
 
@@ -198,37 +283,14 @@ def get_help():
 
 @router.get("/health")
 def db_health():
-    """Проверка состояния базы пользовательских файлов"""
-    try:
-        # Создаем простую проверку
-        from qdrant_client import QdrantClient
-        client = QdrantClient(host="localhost", port=6333)
-        collections = client.get_collections()
-
-        collection_exists = False
-        points_count = 0
-        collection_name = COLLECTION_NAME
-
-        for col in collections.collections:
-            if col.name == collection_name:
-                collection_exists = True
-                try:
-                    collection_info = client.get_collection(collection_name)
-                    points_count = collection_info.points_count
-                except:
-                    pass
-                break
-
-        return {
-            "success": True,
-            "collection_name": collection_name,
-            "collection_exists": collection_exists,
-            "points_count": points_count,
-            "status": "healthy" if collection_exists else "warning"
-        }
-    except Exception as e:
-        return {
-            "success": False,
-            "error": str(e),
-            "status": "error"
-        }
\ No newline at end of file
+    """Проверка состояния базы пользовательских файлов по последней фоновой пробе"""
+    qdrant = prober.snapshot().get("qdrant")
+    if qdrant is None:
+        return {"success": False, "status": "unknown", "error": "проба Qdrant ещё не выполнялась"}
+    if not qdrant["ok"]:
+        return {"success": False, "status": "error", "error": qdrant["error"]}
+    return {
+        "success": True,
+        **qdrant,
+        "status": "healthy" if qdrant["collection_exists"] else "warning"
+    }
\ No newline at end of file
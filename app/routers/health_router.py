@@ -0,0 +1,37 @@
+import time
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.config import HEALTH_PROBE_INTERVAL
+from app.services.health_service import prober, readiness_report
+
+router = APIRouter()
+
+_started_at = time.time()
+
+
+@router.get("/live")
+def live():
+    """Процесс жив: не трогает зависимости, 503 только если фоновые проверки зависли"""
+    stalled = prober.stalled
+    age = prober.age
+    return JSONResponse(status_code=503 if stalled else 200, content={
+        "alive": not stalled,
+        "uptime": round(time.time() - _started_at, 3),
+        "probe_age": round(age, 3) if age is not None else None,
+    })
+
+
+@router.get("/ready")
+def ready():
+    """Готовность к трафику: 200 после прогрева, 503 пока прогрев идёт, Qdrant недоступен или очередь к модели полна"""
+    report = readiness_report()
+    headers = {"Retry-After": str(max(1, round(HEALTH_PROBE_INTERVAL)))} if not report["ready"] else None
+    return JSONResponse(status_code=200 if report["ready"] else 503, content=report, headers=headers)
+
+
+@router.get("/health")
+def health():
+    """Подробности для людей и дашбордов: последние результаты всех проб и готовность"""
+    return {**readiness_report(), "probes": prober.snapshot()}
@@ -0,0 +1,31 @@
+from typing import Optional
+
+from fastapi import APIRouter, Query
+from fastapi.responses import StreamingResponse
+
+from app.services.history_service import history_service
+
+router = APIRouter()
+
+
+@router.get("")
+def get_history(user_id: str = Query(..., description="ID пользователя")):
+    """История попыток пользователя: последние - с ответами и разбором, старые - только итоги"""
+    entries = history_service.entries(user_id)
+    return {"user_id": user_id, "count": len(entries), "entries": entries}
+
+
+@router.get("/export")
+def export_history(user_id: Optional[str] = None, include_tests: bool = False):
+    """Выгрузка истории для аналитики в NDJSON (по строке на попытку), потоком"""
+    return StreamingResponse(
+        history_service.export(user_id=user_id, include_tests=include_tests),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="history.ndjson"'}
+    )
+
+
+@router.post("/compact")
+def compact_history():
+    """Политика хранения для всей истории и удаление тел тестов, на которые нет ссылок"""
+    return {"ok": True, **history_service.compact()}
@@ -1,10 +1,17 @@
+import logging
 from fastapi import APIRouter, HTTPException, Request, Response, Query
 from pydantic import BaseModel
+from typing import Any, Dict, List, Optional
+from app.config import LLM_MAX_TOKENS
+from app.services.admission_service import AdmissionRejected, llm_scope
+from app.services.answer_cache import answer_cache, context_fingerprint
 from app.services.model_service import model_request
-from app.services.user_db_service import UserDBService
+from app.services.prompt_service import collect_passages, prompt_builder
+from app.services.user_db_service import get_user_db_service
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
-user_db_service = UserDBService()
 
 
 class GenerateRequest(BaseModel):
@@ -24,101 +31,80 @@ def get_result_filename(user_id: str) -> str:
     return f"last_result_{user_id}.json"
 
 
-def get_context_from_user_files(user_id: str, max_chars: int = 120000, max_files: int = 10) -> str:
-    """Получает контекст из файлов пользователя"""
+def get_context_passages(user_id: str, query: Optional[str] = None, max_files: int = 10,
+                         query_vector: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+    """Получает фрагменты контекста из файлов пользователя, по убыванию релевантности запросу"""
     try:
-        # Получаем файлы пользователя
-        files = user_db_service.get_user_files(user_id=user_id, limit=max_files)
-
-        if not files:
-            return ""
-
-        context_parts = []
-        total_chars = 0
-
-        for file_data in files:
-            if total_chars >= max_chars:
-                break
-
-            payload = file_data.get("payload", {})
-
-            # Используем content_preview если есть, иначе другие метаданные
-            if "content_preview" in payload:
-                content = payload["content_preview"]
-            else:
-                # Собираем доступную информацию о файле
-                content_parts = []
-                if "filename" in payload:
-                    content_parts.append(f"Файл: {payload['filename']}")
-                if "file_type" in payload:
-                    content_parts.append(f"Тип: {payload['file_type']}")
-                if "uploaded_at" in payload:
-                    content_parts.append(f"Загружен: {payload['uploaded_at']}")
-
-                # Добавляем метаданные
-                for key, value in payload.items():
-                    if key not in ["filename", "file_type", "uploaded_at", "content_preview",
-                                   "file_hash", "file_size", "user_id"]:
-                        if isinstance(value, (str, int, float)):
-                            content_parts.append(f"{key}: {value}")
-
-                content = "\n".join(content_parts)
-
-            # Ограничиваем длину каждого файла
-            if len(content) > 50000:  # Максимум 50k символов на файл
-                content = content[:50000] + "... [обрезано]"
-
-            # Форматируем контекст для файла
-            file_context = f"\n--- Файл: {payload.get('filename', 'Без имени')} ---\n{content}\n"
-
-            if total_chars + len(file_context) <= max_chars:
-                context_parts.append(file_context)
-                total_chars += len(file_context)
-            else:
-                # Если не помещается целиком, обрезаем
-                remaining_chars = max_chars - total_chars
-                if remaining_chars > 100:  # Только если есть что добавить
-                    context_parts.append(file_context[:remaining_chars] + "... [обрезано]")
-                break
-
-        return "\n".join(context_parts)
+        return collect_passages(get_user_db_service(), user_id=user_id, query=query, max_files=max_files,
+                                query_vector=query_vector)
 
     except Exception as e:
-        print(f"Ошибка получения контекста из пользовательских файлов: {e}")
-        return ""
+        logger.error(f"Ошибка получения контекста из пользовательских файлов: {e}")
+        return []
 
 
 @router.post("/ask")
 def ask_teacher(req: GenerateRequest, request: Request):
         """Генерация тестов на основе файлов пользователя"""
-        # Получаем контекст из пользовательских файлов
-        ctx = get_context_from_user_files(
+        # Эмбеддинг вопроса считаем один раз: он нужен и для поиска контекста, и для кеша ответов
+        query_vector = None
+        try:
+            query_vector = get_user_db_service().embedding_backend.encode([req.query])[0]
+        except Exception as e:
+            logger.error(f"Ошибка эмбеддинга вопроса: {e}")
+
+        # Получаем контекст из пользовательских файлов, наиболее релевантные вопросу - первыми
+        passages = get_context_passages(
             user_id=req.user_id,
-            max_chars=120000,
-            max_files=req.max_files
+            query=req.query,
+            max_files=req.max_files,
+            query_vector=query_vector.tolist() if query_vector is not None else None
         )
 
-
+        # Близкий по смыслу вопрос по тому же контексту уже задавали - отвечаем без модели
+        fingerprint = context_fingerprint(passages)
+        if query_vector is not None and answer_cache.enabled and not req.force_recreate:
+            cached = answer_cache.lookup(fingerprint, query_vector)
+            if cached is not None:
+                entry, similarity = cached
+                logger.info(f"Ответ учителя из кеша (близость {similarity:.3f})")
+                return {
+                    "ok": True,
+                    "teacher_response": entry.answer,
+                    "cached": True
+                }
 
         # Подготавливаем промпт с контекстом
-        context_info = f"Используй следующую информацию из файлов пользователя для ответа на его вопрос:\n\n{ctx}\n\n" if ctx else ""
+        def render(ctx: str) -> str:
+            context_info = f"Используй следующую информацию из файлов пользователя для ответа на его вопрос:\n\n{ctx}\n\n" if ctx else ""
 
-        prompt = f"""
+            return f"""
     {context_info}ВОПРОС ПОЛЬЗОВАТЕЛЯ:
 
     {req.query}
     """
 
+        prompt = prompt_builder.build(render, passages, output_tokens=LLM_MAX_TOKENS)
+
         # Запрос к модели
         try:
-            resp = model_request(prompt)
+            with llm_scope(req.user_id):
+                resp = model_request(prompt, purpose="teacher")
             j = resp.json()
             answer = j['choices'][0]['message']['content'].strip()
 
+        except AdmissionRejected:
+            raise
+
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Ошибка модели: {e}")
 
+        if query_vector is not None:
+            answer_cache.store(fingerprint, req.query, query_vector, answer,
+                               file_ids=[passage["id"] for passage in passages])
+
         return {
             "ok": True,
-            "teacher_response": answer
+            "teacher_response": answer,
+            "cached": False
         }
@@ -1,15 +1,30 @@
-from fastapi import APIRouter, HTTPException, Request, Response, Query
+import logging
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request, Response, Query
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from app.config import LLM_MAX_TOKENS, QUESTION_BANK_ENABLED, QUESTION_BANK_MIN_COVERAGE
+from app.services.admission_service import AdmissionRejected, SingleFlight, llm_scope
+from app.services.grading_service import grade_reported, grade_submission, render_analysis_prompt, wrong_questions
+from app.services.history_service import history_service
 from app.services.model_service import model_request
-from app.services.user_db_service import UserDBService
-from app.utils.html_generator import render_test_page
+from app.services.page_cache import page_cache
+from app.services.prompt_service import collect_passages, collect_relevant_passages, prompt_builder
+from app.services.question_bank_service import get_question_bank_service
+from app.services.state_store import RESULTS, TESTS, get_state_store
+from app.services.test_generation_service import complete_test, generate_test
+from app.services.user_db_service import get_user_db_service
+from app.utils.html_generator import render_test_html
+from app.utils.metrics import record_cache
 import json
-import os
-from pathlib import Path
-from typing import List, Optional
+import uuid
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Literal, Optional, Tuple
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
-user_db_service = UserDBService()
+# Повторное нажатие "сгенерировать" с теми же параметрами ждёт уже идущую генерацию
+generation_flight = SingleFlight("generation_coalesce")
 
 
 class GenerateRequest(BaseModel):
@@ -17,279 +32,309 @@ class GenerateRequest(BaseModel):
     user_id: str
     force_recreate: bool = False
     max_files: int = 10  # Максимальное количество файлов для использования в контексте
+    questions_count: Optional[int] = None  # Если не задано - по запросу пользователя (по умолчанию 10)
+    generation_mode: Literal["single", "fanout", "auto"] = "auto"  # auto - fanout для больших тестов
+    use_bank: bool = True  # Собирать тест из банка заранее сгенерированных вопросов (если задан questions_count)
 
 
-def get_tests_filename(user_id: str) -> str:
-    """Генерирует имя файла для тестов пользователя"""
-    return f"generated_tests_{user_id}.json"
-
-
-def get_result_filename(user_id: str) -> str:
-    """Генерирует имя файла для результатов пользователя"""
-    return f"last_result_{user_id}.json"
-
-
-def get_context_from_user_files(user_id: str, max_chars: int = 120000, max_files: int = 10) -> str:
-    """Получает контекст из файлов пользователя"""
+def get_context_passages(user_id: str, query: Optional[str] = None, max_files: int = 10) -> List[Dict[str, Any]]:
+    """Получает фрагменты контекста из файлов пользователя, по убыванию релевантности запросу"""
     try:
-        # Получаем файлы пользователя
-        files = user_db_service.get_user_files(user_id=user_id, limit=max_files)
-
-        if not files:
-            return ""
-
-        context_parts = []
-        total_chars = 0
-
-        for file_data in files:
-            if total_chars >= max_chars:
-                break
-
-            payload = file_data.get("payload", {})
-
-            # Используем content_preview если есть, иначе другие метаданные
-            if "content_preview" in payload:
-                content = payload["content_preview"]
-            else:
-                # Собираем доступную информацию о файле
-                content_parts = []
-                if "filename" in payload:
-                    content_parts.append(f"Файл: {payload['filename']}")
-                if "file_type" in payload:
-                    content_parts.append(f"Тип: {payload['file_type']}")
-                if "uploaded_at" in payload:
-                    content_parts.append(f"Загружен: {payload['uploaded_at']}")
-
-                # Добавляем метаданные
-                for key, value in payload.items():
-                    if key not in ["filename", "file_type", "uploaded_at", "content_preview",
-                                   "file_hash", "file_size", "user_id"]:
-                        if isinstance(value, (str, int, float)):
-                            content_parts.append(f"{key}: {value}")
-
-                content = "\n".join(content_parts)
-
-            # Ограничиваем длину каждого файла
-            if len(content) > 50000:  # Максимум 50k символов на файл
-                content = content[:50000] + "... [обрезано]"
-
-            # Форматируем контекст для файла
-            file_context = f"\n--- Файл: {payload.get('filename', 'Без имени')} ---\n{content}\n"
-
-            if total_chars + len(file_context) <= max_chars:
-                context_parts.append(file_context)
-                total_chars += len(file_context)
-            else:
-                # Если не помещается целиком, обрезаем
-                remaining_chars = max_chars - total_chars
-                if remaining_chars > 100:  # Только если есть что добавить
-                    context_parts.append(file_context[:remaining_chars] + "... [обрезано]")
-                break
-
-        return "\n".join(context_parts)
+        return collect_passages(get_user_db_service(), user_id=user_id, query=query, max_files=max_files)
 
     except Exception as e:
-        print(f"Ошибка получения контекста из пользовательских файлов: {e}")
-        return ""
+        logger.error(f"Ошибка получения контекста из пользовательских файлов: {e}")
+        return []
+
+
+def build_test(req: GenerateRequest) -> Tuple[List[Dict[str, Any]], str]:
+    """Сборка теста: из банка вопросов, банк + дозапрос у модели или целиком генерацией"""
+    tests = None
+    source = "live"
+    count = req.questions_count
+
+    # Сначала пробуем собрать тест из банка вопросов - без обращения к модели.
+    # Без questions_count число вопросов может быть задано в самом запросе ("сделай 25 вопросов") -
+    # его понимает только модель, поэтому банк не используем
+    if QUESTION_BANK_ENABLED and req.use_bank and not req.force_recreate and count:
+        banked = get_question_bank_service().sample(user_id=req.user_id, query=req.query, count=count)
+        record_cache("question_bank", hit=len(banked) >= count)
+        if len(banked) >= count:
+            tests, source = banked, "bank"
+        elif banked and len(banked) >= count * QUESTION_BANK_MIN_COVERAGE:
+            # Покрытие частичное - дозапрашиваем у модели только недостающие вопросы
+            passages = get_context_passages(user_id=req.user_id, query=req.query, max_files=req.max_files)
+            try:
+                tests, source = complete_test(req.query, passages, banked, count), "mixed"
+            except Exception as e:
+                logger.warning(f"Не удалось дополнить тест из банка: {e}")
+                tests, source = banked, "bank"
+
+    if tests is None:
+        # Получаем контекст из пользовательских файлов, наиболее релевантные запросу - первыми
+        passages = get_context_passages(
+            user_id=req.user_id,
+            query=req.query,
+            max_files=req.max_files
+        )
+
+        # Запрос к модели: вопросы разбираются по мере генерации, недостающие дозапрашиваются
+        try:
+            tests = generate_test(req.query, passages, count=req.questions_count, mode=req.generation_mode)
+
+        except AdmissionRejected:
+            raise
+
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Ошибка модели: {e}")
+
+    return tests, source
 
 
 @router.post("/generate-tests")
 def generate_tests(req: GenerateRequest, request: Request):
     """Генерация тестов на основе файлов пользователя"""
-    # Получаем контекст из пользовательских файлов
-    ctx = get_context_from_user_files(
-        user_id=req.user_id,
-        max_chars=120000,
-        max_files=req.max_files
-    )
+    store = get_state_store()
 
-    # Определяем имена файлов для конкретного пользователя
-    tests_filename = get_tests_filename(req.user_id)
-    result_filename = get_result_filename(req.user_id)
-
-    # Удаляем старые файлы пользователя если существуют
-    if os.path.exists(tests_filename):
-        os.remove(tests_filename)
-    if os.path.exists(result_filename):
-        os.remove(result_filename)
-
-    # Подготавливаем промпт с контекстом
-    context_info = f"Используй следующую информацию из файлов пользователя для создания точных и релевантных вопросов:\n\n{ctx}\n\n" if ctx else ""
-
-    prompt = f"""
-{context_info}НА ОСНОВЕ ВЫШЕПРИВЕДЕННОЙ ИНФОРМАЦИИ:
-
-{req.query}
-
-Формат вопросов в json:
-[
-{{
-"question": "Текст вопроса?",
-"answers": [{{"Вариант 1": 0}}, {{"Вариант 2": 1}}, {{"Вариант 3": 0}}, {{"Вариант 4": 0}}]
-}}
-]
-
-ВАЖНО:
-1. Вопросы должны быть конкретными и проверять понимание материала.
-2. Варианты ответов должны быть чёткими и однозначными.
-3. Правильный ответ должен быть точно проверяемым.
-4. Вопросов должно быть 10, если не сказано иначе.
-5. На каждый вопрос должен быть 1 правильный ответ, ни больше, ни меньше.
-6. Если в контексте нет информации по заданной теме, сгенерируй вопросы без контекста.
-7. НЕ ПИШИ "Текст вопроса?" и "Вариант 1" из примера, придумай СВОИ вопросы и ответы.
-8. Помни, что ни изображений, ни примеров из исходных материалов испытуемый не видит.
-9. Тест должен быть на русском языке.
-
-В твоём ответе должен быть только json и ничего более.
-"""
-
-    # Запрос к модели
-    try:
-        resp = model_request(prompt)
-        j = resp.json()
-        answer = j['choices'][0]['message']['content'].strip()
-
-        # Убираем ```json
-        if answer.startswith("```"):
-            answer = answer.split("```")[1].replace("json", "").strip()
-
-        tests = json.loads(answer)
+    # Удаляем старый тест и результат пользователя
+    store.delete(TESTS, req.user_id)
+    store.delete(RESULTS, req.user_id)
+    page_cache.invalidate(req.user_id)
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ошибка модели: {e}")
+    key = (req.user_id, req.query, req.questions_count, req.generation_mode,
+           req.max_files, req.use_bank, req.force_recreate)
+    with llm_scope(req.user_id):
+        tests, source = generation_flight.do(key, lambda: build_test(req))
 
-    # Сохраняем JSON для конкретного пользователя
-    with open(tests_filename, "w", encoding="utf-8") as f:
-        json.dump(tests, f, ensure_ascii=False, indent=2)
+    # Сохраняем тест для конкретного пользователя - его увидит любой воркер
+    store.put(TESTS, req.user_id, tests)
+    page_cache.invalidate(req.user_id)
 
     # Отдаём информацию с указанием user_id
     return {
         "ok": True,
         "tests_count": len(tests),
+        "source": source,
         "html_url": f"/test?user_id={req.user_id}",
         "user_id": req.user_id
     }
 
-@router.get("/test-json")
-def get_test_json(request: Request, user_id: str = Query(..., description="ID пользователя")):
-    tests_filename = get_tests_filename(user_id)
-
-    if not os.path.exists(tests_filename):
+def _not_modified(request: Request, etag: str, modified_at: float) -> bool:
+    """Условный запрос браузера: версия у него уже есть"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # Сравнение слабое: сжатые и несжатые варианты - одна версия
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or etag.removeprefix("W/") in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(modified_at) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def cached_test_response(request: Request, user_id: str, kind: str) -> Response:
+    """Страница теста (html или json) из кеша: версия - из хранилища состояния, без чтения теста"""
+    store = get_state_store()
+    stored = store.version(TESTS, user_id)
+    if stored is None:
         raise HTTPException(status_code=404, detail=f"Тест для пользователя {user_id} не найден")
+    version, modified_at = stored
+
+    def render() -> bytes:
+        data = store.get(TESTS, user_id)
+        if data is None:
+            raise HTTPException(status_code=404, detail=f"Тест для пользователя {user_id} не найден")
+        if kind == "html":
+            return render_test_html(data, user_id=user_id).encode("utf-8")
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    page = page_cache.get(
+        kind, user_id,
+        version=version,
+        modified_at=modified_at,
+        media_type="text/html; charset=utf-8" if kind == "html" else "application/json",
+        render=render
+    )
+
+    headers = {
+        "ETag": page.etag,
+        "Last-Modified": page.last_modified,
+        # Браузер кеширует, но каждый раз сверяется: тест может быть перегенерирован
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding"
+    }
+    if _not_modified(request, page.etag, modified_at):
+        return Response(status_code=304, headers=headers)
 
-    with open(tests_filename, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    body, encoding = page.body(request.headers.get("accept-encoding", ""))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=page.media_type, headers=headers)
 
-    return data
+
+@router.get("/test-json")
+def get_test_json(request: Request, user_id: str = Query(..., description="ID пользователя")):
+    return cached_test_response(request, user_id, kind="json")
 
 
 @router.get("/test")
 def get_test_html(request: Request, user_id: str = Query(..., description="ID пользователя")):
     """Возвращает HTML страницу с тестом для конкретного пользователя"""
-    tests_filename = get_tests_filename(user_id)
-
-    if not os.path.exists(tests_filename):
-        raise HTTPException(status_code=404, detail=f"Тест для пользователя {user_id} не найден")
+    return cached_test_response(request, user_id, kind="html")
 
-    with open(tests_filename, "r", encoding="utf-8") as f:
-        data = json.load(f)
 
-    return render_test_page(request, data, user_id=user_id)
+def save_result(user_id: str, record: Dict[str, Any]):
+    """Записывает результат пользователя в общее хранилище состояния"""
+    get_state_store().put(RESULTS, user_id, record)
 
 
-@router.post("/result")
-async def receive_result(request: Request, user_id: str = Query(..., description="ID пользователя")):
-    """Приём результатов теста от пользователя"""
+def analyze_result(user_id: str, submission_id: str, grading: Dict[str, Any]):
+    """Фоновая задача: разбор ошибок моделью по вопросам с ошибками и релевантным им фрагментам"""
+    mistakes = wrong_questions(grading)
     try:
-        body = await request.json()
-    except Exception:
-        raise HTTPException(status_code=400, detail="Неверный JSON")
-
-    # Получаем контекст из пользовательских файлов для анализа
-    context = get_context_from_user_files(user_id=user_id, max_chars=50000)
-
-    context_info = f"Ты ассистент по подготовке к экзамену. Твоя задача - проверить мой тест. Вот информация из моих файлов:\n{context}\n\n" if context else "Ты ассистент по подготовке к экзамену. Твоя задача - проверить мой тест.\n\n"
-
-    prompt = f"""{context_info}Вот мои результаты теста:
-
-{json.dumps(body, ensure_ascii=False, indent=2)}
+        passages = collect_relevant_passages(
+            get_user_db_service(), user_id=user_id, queries=[q["question"] for q in mistakes]
+        )
+    except Exception as e:
+        logger.error(f"Ошибка получения контекста для анализа: {e}")
+        passages = []
 
-Кратко, но ёмко поясни:
-1. Над какими темами мне стоит поработать? Упомяни только вопросы, на которые я ответил неправильно.
-2. Готов ли я к экзамену?
-Не используй таблицы."""
+    prompt = prompt_builder.build(
+        lambda context: render_analysis_prompt(grading, context),
+        passages,
+        output_tokens=LLM_MAX_TOKENS
+    )
 
     try:
-        resp = model_request(prompt)
-        analysis = resp.json()["choices"][0]["message"]["content"]
+        with llm_scope(user_id):
+            resp = model_request(prompt, purpose="analysis")
+        update = {"analysis": resp.json()["choices"][0]["message"]["content"], "analysis_status": "done"}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ошибка модели: {e}")
+        logger.error(f"Ошибка анализа результата: {e}")
+        update = {"analysis": None, "analysis_status": "error", "analysis_error": str(e)}
+
+    # Пока шёл анализ, пользователь мог пройти тест заново или сгенерировать новый
+    def apply(record: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if not record or record.get("submission_id") != submission_id:
+            return None
+        return {**record, **update}
+
+    get_state_store().update(RESULTS, user_id, apply)
+    history_service.record_analysis(user_id, submission_id, update)
+
+
+def accept_result(user_id: str, body: Any, analyze: bool) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """Оценка и сохранение результата (хранилище и история); вторым - оценка для фонового разбора или None"""
+    # Проверяем ответы по сохранённому тесту, правильные ответы в нём уже есть
+    test = get_state_store().get(TESTS, user_id)
+    if test is not None:
+        grading = grade_submission(test, body)
+    else:
+        grading = grade_reported(body)
+
+    submission_id = uuid.uuid4().hex
+    analysis = None
+    if not analyze:
+        analysis_status = "skipped"
+    elif not wrong_questions(grading):
+        analysis_status = "done"
+        analysis = "Все ответы верные: материал усвоен, к экзамену по этим темам ты готов."
+    else:
+        analysis_status = "pending"
+
+    save_result(user_id, {
+        "user_id": user_id,
+        "submission_id": submission_id,
+        "result": body,
+        "grading": grading,
+        "analysis": analysis,
+        "analysis_status": analysis_status
+    })
+    history_service.record_submission(user_id, submission_id, test, body, grading, analysis, analysis_status)
+
+    response = {
+        "ok": True,
+        "user_id": user_id,
+        "submission_id": submission_id,
+        "score": grading["score"],
+        "total": grading["total"],
+        "percentage": grading["percentage"],
+        "per_topic": grading["per_topic"],
+        "questions": grading["questions"],
+        "analysis": analysis,
+        "analysis_status": analysis_status
+    }
+    return response, grading if analysis_status == "pending" else None
+
 
-    # Записываем результат локально для конкретного пользователя
-    result_filename = get_result_filename(user_id)
-    with open(result_filename, "w", encoding="utf-8") as f:
-        json.dump({"user_id": user_id, "result": body, "analysis": analysis}, f, ensure_ascii=False, indent=2)
+@router.post("/result")
+async def receive_result(
+        request: Request,
+        background_tasks: BackgroundTasks,
+        user_id: str = Query(..., description="ID пользователя"),
+        analyze: bool = Query(True, description="Запросить у модели разбор ошибок (асинхронно)")
+):
+    """Приём результатов теста от пользователя: оценка сразу, разбор ошибок моделью - в фоне"""
+    try:
+        body = await request.json()
+    except Exception:
+        raise HTTPException(status_code=400, detail="Неверный JSON")
 
-    return {"ok": True, "analysis": analysis, "user_id": user_id}
+    # Хранилище (Redis или файлы с flock) - блокирующий ввод-вывод, не держим им цикл событий
+    response, pending = await run_in_threadpool(accept_result, user_id, body, analyze)
+    if pending is not None:
+        background_tasks.add_task(analyze_result, user_id, response["submission_id"], pending)
+    return response
 
 
 @router.get("/result")
 def get_result(user_id: str = Query(..., description="ID пользователя")):
     """Получение результатов теста для конкретного пользователя"""
-    result_filename = get_result_filename(user_id)
-    file_path = Path(result_filename)
-
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail=f"Результаты для пользователя {user_id} недоступны")
-
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=500, detail="Ошибка чтения файла результатов")
+        record = get_state_store().get(RESULTS, user_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка: {e}")
 
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Результаты для пользователя {user_id} недоступны")
+    return record
+
 
 @router.get("/list-user-tests")
 def list_user_tests():
     """Список всех сгенерированных тестов по пользователям"""
+    store = get_state_store()
     test_files = []
     result_files = []
 
-    # Ищем все файлы тестов
-    for filename in os.listdir("."):
-        if filename.startswith("generated_tests_") and filename.endswith(".json"):
-            user_id = filename.replace("generated_tests_", "").replace(".json", "")
-            file_path = Path(filename)
-            if file_path.exists():
-                try:
-                    with open(file_path, "r", encoding="utf-8") as f:
-                        data = json.load(f)
-                        test_files.append({
-                            "user_id": user_id,
-                            "tests_count": len(data),
-                            "filename": filename,
-                            "created_at": file_path.stat().st_ctime
-                        })
-                except:
-                    pass
-
-    # Ищем все файлы результатов
-    for filename in os.listdir("."):
-        if filename.startswith("last_result_") and filename.endswith(".json"):
-            user_id = filename.replace("last_result_", "").replace(".json", "")
-            file_path = Path(filename)
-            if file_path.exists():
-                result_files.append({
-                    "user_id": user_id,
-                    "filename": filename,
-                    "created_at": file_path.stat().st_ctime
-                })
+    for user_id in store.keys(TESTS):
+        data = store.get(TESTS, user_id)
+        stored = store.version(TESTS, user_id)
+        if data is None or stored is None:
+            continue
+        test_files.append({
+            "user_id": user_id,
+            "tests_count": len(data),
+            "filename": store.location(TESTS, user_id),
+            "created_at": stored[1]
+        })
+
+    for user_id in store.keys(RESULTS):
+        stored = store.version(RESULTS, user_id)
+        if stored is None:
+            continue
+        result_files.append({
+            "user_id": user_id,
+            "filename": store.location(RESULTS, user_id),
+            "created_at": stored[1]
+        })
 
     return {
         "ok": True,
         "test_files": test_files,
         "result_files": result_files,
         "total_users_with_tests": len({f["user_id"] for f in test_files})
-    }
\ No newline at end of file
+    }
@@ -0,0 +1,230 @@
+import contextvars
+import logging
+import math
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from app.config import (
+    APP_WORKERS,
+    LLM_MAX_CONCURRENCY,
+    LLM_QUEUE_SIZE,
+    LLM_QUEUE_TIMEOUT,
+    LLM_RATE_LIMIT_BURST,
+    LLM_RATE_LIMIT_RPM,
+    LLM_USER_CONCURRENCY,
+)
+from app.utils.metrics import ADMISSION_QUEUE, ADMISSION_REJECTED, observe_stage, record_cache
+
+logger = logging.getLogger(__name__)
+
+# Пользователь и крайний срок текущего запроса: выставляются в эндпоинте, доходят до вызовов модели
+user_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("user_id", default=None)
+deadline_var: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("llm_deadline", default=None)
+
+
+def per_worker(value: float) -> float:
+    """Доля общего лимита на один воркер: лимиты провайдера общие на все процессы"""
+    return value / max(1, APP_WORKERS)
+
+
+class AdmissionRejected(Exception):
+    """Запрос к модели не допущен: очередь полна или дождаться слота до крайнего срока нельзя"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Запрос к модели отклонён ({reason}), повторите через {retry_after:.0f} с")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Глобальный лимит частоты запросов к провайдеру (rate токенов в секунду, запас burst)"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        if now > self._paused_until:
+            start = max(self._updated, self._paused_until)
+            self._tokens = min(self.burst, self._tokens + (now - start) * self.rate)
+        self._updated = now
+
+    def wait_time(self) -> float:
+        """Через сколько секунд будет доступен следующий токен"""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, self._paused_until - now)
+            return wait + max(0.0, 1 - self._tokens) / self.rate
+
+    def reserve(self) -> float:
+        """Бронирует токен (можно в долг) и возвращает, сколько ждать до его выдачи"""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            return max(0.0, self._paused_until - now) + max(0.0, -self._tokens) / self.rate
+
+    def refund(self):
+        if self.rate:
+            with self._lock:
+                self._tokens = min(self.burst, self._tokens + 1)
+
+    def pause(self, seconds: float):
+        """Провайдер ответил 429 - не выдаём токены seconds секунд всем вызывающим"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = min(self._tokens, 0.0)
+
+
+class AdmissionController:
+    """Допуск запросов к модели: общий лимит частоты и параллельности, лимит на пользователя, очередь"""
+
+    def __init__(self, rate_per_minute: float = per_worker(LLM_RATE_LIMIT_RPM), burst: int = LLM_RATE_LIMIT_BURST,
+                 max_concurrency: int = math.ceil(per_worker(LLM_MAX_CONCURRENCY)),
+                 user_concurrency: int = LLM_USER_CONCURRENCY,
+                 queue_size: int = LLM_QUEUE_SIZE, queue_timeout: float = LLM_QUEUE_TIMEOUT):
+        self.bucket = TokenBucket(rate_per_minute / 60.0, burst)
+        self.max_concurrency = max_concurrency
+        self.user_concurrency = user_concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self._user_active: Dict[str, int] = {}
+        self._cond = threading.Condition()
+
+    def _has_slot(self, user_id: Optional[str]) -> bool:
+        if self.max_concurrency and self.active >= self.max_concurrency:
+            return False
+        if user_id and self.user_concurrency and self._user_active.get(user_id, 0) >= self.user_concurrency:
+            return False
+        return True
+
+    def _reject(self, reason: str, retry_after: float):
+        ADMISSION_REJECTED.labels(reason).inc()
+        logger.warning(f"Запрос к модели отклонён: {reason}, retry_after={retry_after:.1f}s")
+        raise AdmissionRejected(reason, retry_after)
+
+    def _deadline(self, deadline: Optional[float]) -> float:
+        own = time.monotonic() + self.queue_timeout
+        request_deadline = deadline if deadline is not None else deadline_var.get()
+        return min(own, request_deadline) if request_deadline is not None else own
+
+    @contextmanager
+    def admit(self, user_id: Optional[str] = None, deadline: Optional[float] = None,
+              bucket: Optional[TokenBucket] = None):
+        """Слот на один вызов модели; AdmissionRejected, если его не получить до крайнего срока.
+
+        bucket - лимит частоты конкретного провайдера, по умолчанию общий.
+        """
+        bucket = bucket or self.bucket
+        user_id = user_id if user_id is not None else user_id_var.get()
+        deadline = self._deadline(deadline)
+        started = time.monotonic()
+
+        # Заведомо не успеем по лимиту частоты - отказываем сразу, не занимая очередь
+        bucket_wait = 0.0
+        if bucket.rate:
+            bucket_wait = bucket.wait_time() + self.waiting / bucket.rate
+        if time.monotonic() + bucket_wait > deadline:
+            self._reject("rate_limit", bucket_wait)
+
+        with self._cond:
+            if not self._has_slot(user_id):
+                if self.waiting >= self.queue_size:
+                    self._reject("queue_full", self.queue_timeout)
+                self.waiting += 1
+                ADMISSION_QUEUE.set(self.waiting)
+                try:
+                    while not self._has_slot(user_id):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._reject("deadline", self.queue_timeout)
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+                    ADMISSION_QUEUE.set(self.waiting)
+            self.active += 1
+            if user_id:
+                self._user_active[user_id] = self._user_active.get(user_id, 0) + 1
+
+        try:
+            wait = bucket.reserve()
+            if time.monotonic() + wait > deadline:
+                bucket.refund()
+                self._reject("rate_limit", wait)
+            if wait:
+                time.sleep(wait)
+            observe_stage("llm_admission", time.monotonic() - started)
+            yield
+        finally:
+            with self._cond:
+                self.active -= 1
+                if user_id:
+                    self._user_active[user_id] -= 1
+                    if not self._user_active[user_id]:
+                        del self._user_active[user_id]
+                self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"active": self.active, "waiting": self.waiting, "users": len(self._user_active)}
+
+
+class SingleFlight:
+    """Объединение одинаковых одновременных вызовов: выполняется первый, остальные ждут его результат"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        record_cache(self.name, hit=not leader)
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+@contextmanager
+def llm_scope(user_id: Optional[str], timeout: Optional[float] = None):
+    """Привязка вызовов модели внутри блока к пользователю и крайнему сроку запроса"""
+    user_token = user_id_var.set(user_id)
+    deadline_token = deadline_var.set(time.monotonic() + timeout if timeout else None)
+    try:
+        yield
+    finally:
+        deadline_var.reset(deadline_token)
+        user_id_var.reset(user_token)
+
+
+admission = AdmissionController()
@@ -0,0 +1,136 @@
+import hashlib
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+
+import numpy as np
+
+from app.config import (
+    OPENROUTER_MODEL,
+    TEACHER_CACHE_ENABLED,
+    TEACHER_CACHE_SIZE,
+    TEACHER_CACHE_THRESHOLD,
+    TEACHER_CACHE_TTL,
+)
+from app.utils.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+
+def context_fingerprint(passages: List[Dict[str, Any]], model: str = OPENROUTER_MODEL) -> str:
+    """Отпечаток контекста по содержимому фрагментов: одинаковые материалы у разных студентов совпадают"""
+    digest = hashlib.blake2b(model.encode("utf-8"), digest_size=16)
+    parts = sorted(
+        f"{passage.get('title', '')}\x00{hashlib.blake2b(passage.get('text', '').encode('utf-8'), digest_size=16).hexdigest()}"
+        for passage in passages
+    )
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x01")
+    return digest.hexdigest()
+
+
+@dataclass
+class CachedAnswer:
+    """Ответ модели на вопрос по конкретному контексту"""
+
+    fingerprint: str
+    query: str
+    vector: np.ndarray  # нормированный эмбеддинг вопроса
+    answer: str
+    file_ids: FrozenSet[str]
+    created_at: float
+
+
+class SemanticAnswerCache:
+    """Кеш ответов по смыслу вопроса: близкий вопрос по тому же контексту получает готовый ответ"""
+
+    def __init__(self, max_entries: int = TEACHER_CACHE_SIZE, ttl: float = TEACHER_CACHE_TTL,
+                 threshold: float = TEACHER_CACHE_THRESHOLD, enabled: bool = TEACHER_CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.enabled = enabled
+        self._entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        # Отпечаток контекста -> записи: сравниваем вопрос только с ответами по тому же контексту
+        self._buckets: Dict[str, Set[int]] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        bucket = self._buckets.get(entry.fingerprint)
+        if bucket is not None:
+            bucket.discard(entry_id)
+            if not bucket:
+                del self._buckets[entry.fingerprint]
+
+    def lookup(self, fingerprint: str, vector) -> Optional[Tuple[CachedAnswer, float]]:
+        """Самый близкий по смыслу ответ с тем же контекстом (не старше TTL) и его близость"""
+        if not self.enabled:
+            return None
+        query = self._normalize(vector)
+        now = time.time()
+        best: Optional[Tuple[int, float]] = None
+        with self._lock:
+            for entry_id in list(self._buckets.get(fingerprint, ())):
+                entry = self._entries[entry_id]
+                if now - entry.created_at > self.ttl:
+                    self._remove(entry_id)
+                    continue
+                similarity = float(np.dot(query, entry.vector))
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (entry_id, similarity)
+            if best is not None:
+                self._entries.move_to_end(best[0])
+                record_cache("teacher_answer", hit=True)
+                return self._entries[best[0]], best[1]
+        record_cache("teacher_answer", hit=False)
+        return None
+
+    def store(self, fingerprint: str, query: str, vector, answer: str, file_ids: List[str]):
+        if not self.enabled or not answer:
+            return
+        entry = CachedAnswer(
+            fingerprint=fingerprint,
+            query=query,
+            vector=self._normalize(vector),
+            answer=answer,
+            file_ids=frozenset(str(file_id) for file_id in file_ids),
+            created_at=time.time()
+        )
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = entry
+            self._buckets.setdefault(fingerprint, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, file_id: str) -> int:
+        """Сброс ответов, в контексте которых был файл (после замены, изменения или удаления)"""
+        file_id = str(file_id)
+        with self._lock:
+            stale = [entry_id for entry_id, entry in self._entries.items() if file_id in entry.file_ids]
+            for entry_id in stale:
+                self._remove(entry_id)
+        if stale:
+            logger.info(f"Кеш ответов: сброшено {len(stale)} по файлу {file_id}")
+        return len(stale)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+answer_cache = SemanticAnswerCache()
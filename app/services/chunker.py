@@ -0,0 +1,67 @@
+import hashlib
+import uuid
+from collections import Counter
+from dataclasses import dataclass
+from typing import List
+
+from app.config import CHUNK_SIZE
+
+# Пространство имён UUID точек фрагментов: ID зависит только от файла и содержимого фрагмента
+CHUNK_NAMESPACE = uuid.UUID("6f1d8a52-3c1e-4c47-9a57-5a0b3f1c2e90")
+# Граница по содержимому строки: в среднем каждая BOUNDARY_MOD-я строка после минимального размера
+BOUNDARY_MOD = 8
+
+
+@dataclass
+class Chunk:
+    """Фрагмент текста файла и его хеш (ключ для повторного использования эмбеддинга)"""
+
+    text: str
+    hash: str
+
+
+def _digest(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _split_long_line(line: str, size: int) -> List[str]:
+    return [line[start:start + size] for start in range(0, len(line), size)]
+
+
+def split_chunks(text: str, size: int = CHUNK_SIZE) -> List[Chunk]:
+    """Разбиение на фрагменты с границами по содержимому строк"""
+    # Граница - после строки, хеш которой делится на BOUNDARY_MOD (от size/2 до 1.5*size символов).
+    # Правка одной страницы меняет один-два фрагмента, а не сдвигает границы всех последующих,
+    # как при нарезке по фиксированной длине
+    min_size, max_size = size // 2, size * 3 // 2
+    chunks: List[Chunk] = []
+    current: List[str] = []
+    length = 0
+
+    def flush():
+        nonlocal current, length
+        chunk_text = "\n".join(current).strip()
+        if chunk_text:
+            chunks.append(Chunk(text=chunk_text, hash=_digest(chunk_text)))
+        current, length = [], 0
+
+    for raw_line in text.splitlines():
+        for line in _split_long_line(raw_line, max_size) or [""]:
+            if length and length + len(line) > max_size:
+                flush()
+            current.append(line)
+            length += len(line) + 1
+            if length >= min_size and int(_digest(line)[:8], 16) % BOUNDARY_MOD == 0:
+                flush()
+    flush()
+    return chunks
+
+
+def chunk_ids(file_id: str, hashes: List[str]) -> List[str]:
+    """ID точек фрагментов: одинаковый текст в том же файле - та же точка (повторы нумеруются)"""
+    seen: Counter = Counter()
+    ids = []
+    for chunk_hash in hashes:
+        ids.append(str(uuid.uuid5(CHUNK_NAMESPACE, f"{file_id}:{chunk_hash}:{seen[chunk_hash]}")))
+        seen[chunk_hash] += 1
+    return ids
@@ -0,0 +1,250 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import (
+    EMBEDDING_BACKEND,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_MAX_LENGTH,
+    EMBEDDING_ONNX_DIR,
+    EMBEDDING_POOLING,
+    EMBEDDING_THREADS,
+)
+from app.utils.metrics import track_stage
+
+logger = logging.getLogger(__name__)
+
+
+class TorchEmbeddingBackend:
+    """Эмбеддинги через sentence-transformers (PyTorch fp32)"""
+
+    name = "torch"
+
+    def __init__(self, model_name: str, threads: int = EMBEDDING_THREADS,
+                 batch_size: int = EMBEDDING_BATCH_SIZE):
+        self.model_name = model_name
+        self.threads = threads
+        self.batch_size = batch_size
+        self._model = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Загрузка модели (один раз на процесс)"""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+
+                    if self.threads:
+                        import torch
+                        torch.set_num_threads(self.threads)
+
+                    self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def preload(self):
+        """Загрузка весов до fork воркеров: страницы памяти с весами делятся между процессами"""
+        self.load()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Эмбеддинги для списка текстов, shape (n, dim)"""
+        model = self.load()
+        with track_stage("embedding"):
+            return np.asarray(model.encode(texts, batch_size=self.batch_size), dtype=np.float32)
+
+
+class OnnxEmbeddingBackend:
+    """Эмбеддинги через ONNX Runtime с int8-квантованной моделью"""
+
+    name = "onnx"
+    quantized_filename = "model_quantized.onnx"
+
+    def __init__(self, model_name: str, model_dir: str = EMBEDDING_ONNX_DIR,
+                 threads: int = EMBEDDING_THREADS, pooling: str = EMBEDDING_POOLING,
+                 max_length: int = EMBEDDING_MAX_LENGTH, batch_size: int = EMBEDDING_BATCH_SIZE):
+        self.model_name = model_name
+        # Для каждой модели своя папка: models/onnx/BAAI__bge-small-en-v1.5
+        self.model_dir = os.path.join(model_dir, model_name.replace("/", "__"))
+        self.threads = threads
+        self.pooling = pooling
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self._session = None
+        self._tokenizer = None
+        self._input_names: List[str] = []
+        self._lock = threading.Lock()
+
+    @property
+    def model_path(self) -> str:
+        return os.path.join(self.model_dir, self.quantized_filename)
+
+    @property
+    def pooling_path(self) -> str:
+        return os.path.join(self.model_dir, "pooling.json")
+
+    def _model_pooling(self) -> str:
+        """Пулинг из конфигурации sentence-transformers модели (1_Pooling/config.json); без неё - mean, как у них"""
+        path = os.path.join(self.model_name, "1_Pooling", "config.json")
+        if not os.path.exists(path):
+            try:
+                from huggingface_hub import hf_hub_download
+
+                path = hf_hub_download(self.model_name, "1_Pooling/config.json")
+            except Exception as e:
+                logger.warning(f"Нет конфигурации пулинга у {self.model_name} ({e}), используем mean")
+                return "mean"
+        with open(path) as f:
+            config = json.load(f)
+        if config.get("pooling_mode_cls_token"):
+            return "cls"
+        if not config.get("pooling_mode_mean_tokens"):
+            logger.warning(f"Пулинг {self.model_name} не поддерживается ONNX бэкендом, используем mean")
+        return "mean"
+
+    def _resolve_pooling(self):
+        """EMBEDDING_POOLING=auto: пулинг, сохранённый при экспорте (старый экспорт - из конфигурации модели)"""
+        if self.pooling != "auto":
+            return
+        try:
+            with open(self.pooling_path) as f:
+                self.pooling = json.load(f)["pooling"]
+        except (OSError, ValueError, KeyError):
+            self.pooling = self._model_pooling()
+
+    def export(self):
+        """Экспорт модели в ONNX и динамическая int8-квантизация весов"""
+        import torch
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        from transformers import AutoModel, AutoTokenizer
+
+        os.makedirs(self.model_dir, exist_ok=True)
+        fp32_path = os.path.join(self.model_dir, "model.onnx")
+
+        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        model = AutoModel.from_pretrained(self.model_name).eval()
+        dummy = tokenizer(["warm up"], return_tensors="pt")
+        input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+        dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                tuple(dummy[name] for name in input_names),
+                fp32_path,
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic_axes,
+                opset_version=17
+            )
+
+        quantize_dynamic(fp32_path, self.model_path, weight_type=QuantType.QInt8)
+        tokenizer.save_pretrained(self.model_dir)
+        with open(self.pooling_path, "w") as f:
+            json.dump({"pooling": self._model_pooling()}, f)
+        logger.info(f"ONNX модель {self.model_name} экспортирована в {self.model_path}")
+
+    def load(self):
+        """Загрузка сессии ONNX Runtime (при необходимости - с экспортом)"""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import onnxruntime as ort
+                    from transformers import AutoTokenizer
+
+                    if not os.path.exists(self.model_path):
+                        self.export()
+
+                    options = ort.SessionOptions()
+                    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                    if self.threads:
+                        options.intra_op_num_threads = self.threads
+                    options.inter_op_num_threads = 1
+
+                    self._resolve_pooling()
+                    self._tokenizer = AutoTokenizer.from_pretrained(self.model_dir)
+                    session = ort.InferenceSession(
+                        self.model_path, options, providers=["CPUExecutionProvider"]
+                    )
+                    self._input_names = [i.name for i in session.get_inputs()]
+                    self._session = session
+        return self._session
+
+    @property
+    def loaded(self) -> bool:
+        return self._session is not None
+
+    def preload(self):
+        """До fork только готовим файл модели: сессия ONNX Runtime со своими потоками создаётся в воркере"""
+        if not os.path.exists(self.model_path):
+            with self._lock:
+                if not os.path.exists(self.model_path):
+                    self.export()
+
+    def _pool(self, hidden: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        """Пулинг токенов в вектор предложения (как в sentence-transformers)"""
+        if self.pooling == "mean":
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        else:
+            pooled = hidden[:, 0]
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return pooled / np.clip(norms, 1e-12, None)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Эмбеддинги для списка текстов, shape (n, dim)"""
+        session = self.load()
+        batches = []
+        with track_stage("embedding"):
+            for start in range(0, len(texts), self.batch_size):
+                encoded = self._tokenizer(
+                    texts[start:start + self.batch_size],
+                    padding=True,
+                    truncation=True,
+                    max_length=self.max_length,
+                    return_tensors="np"
+                )
+                inputs = {name: encoded[name].astype(np.int64) for name in self._input_names if name in encoded}
+                if "token_type_ids" in self._input_names and "token_type_ids" not in inputs:
+                    inputs["token_type_ids"] = np.zeros_like(inputs["input_ids"])
+                hidden = session.run(None, inputs)[0]
+                batches.append(self._pool(hidden, encoded["attention_mask"]))
+        return np.concatenate(batches).astype(np.float32)
+
+
+_backends: Dict[Tuple[str, str], object] = {}
+_backends_lock = threading.Lock()
+
+
+def get_embedding_backend(model_name: str, backend: Optional[str] = None):
+    """Общий на процесс бэкенд эмбеддингов для модели"""
+    backend = (backend or EMBEDDING_BACKEND).lower()
+    key = (backend, model_name)
+
+    with _backends_lock:
+        if key not in _backends:
+            if backend == "onnx":
+                try:
+                    import onnxruntime  # noqa: F401
+                    _backends[key] = OnnxEmbeddingBackend(model_name)
+                except ImportError:
+                    logger.warning("onnxruntime не установлен, используем PyTorch бэкенд эмбеддингов")
+                    _backends[key] = TorchEmbeddingBackend(model_name)
+            else:
+                _backends[key] = TorchEmbeddingBackend(model_name)
+        return _backends[key]
+
+
+def preload_embeddings():
+    """Предзагрузка всех уже созданных бэкендов (вызывается в мастер-процессе перед fork)"""
+    for backend in list(_backends.values()):
+        logger.info(f"Предзагрузка модели эмбеддингов {backend.model_name} ({backend.name})")
+        backend.preload()
@@ -0,0 +1,140 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+NO_TOPIC = "Без темы"
+
+
+def _normalize_answer(text: str) -> str:
+    """Текст ответа для сравнения: пунктуацию не трогаем - в формулах она значима"""
+    return " ".join(str(text).split())
+
+
+def _answer_options(question: Dict[str, Any]) -> List[Tuple[str, int]]:
+    """Варианты ответа вопроса в порядке показа: [(текст, 0|1), ...]"""
+    return [(text, int(value)) for answer in question.get("answers", []) for text, value in answer.items()]
+
+
+def _find_detail(details: List[Dict[str, Any]], index: int, total: int) -> Optional[Dict[str, Any]]:
+    """Ответ пользователя на вопрос index: по questionIndex, иначе по порядку"""
+    for detail in details:
+        if isinstance(detail, dict) and detail.get("questionIndex") == index:
+            return detail
+    # Старый формат страницы теста: ответы идут в порядке вопросов
+    if len(details) == total and isinstance(details[index], dict):
+        return details[index]
+    return None
+
+
+def _selected_answer(detail: Optional[Dict[str, Any]], options: List[Tuple[str, int]]) -> Optional[str]:
+    if not detail:
+        return None
+    answer_index = detail.get("answerIndex")
+    if isinstance(answer_index, int) and 0 <= answer_index < len(options):
+        return options[answer_index][0]
+    selected = detail.get("selectedAnswer")
+    return str(selected).strip() if selected else None
+
+
+def grade_submission(test: List[Dict[str, Any]], submission: Dict[str, Any]) -> Dict[str, Any]:
+    """Проверка ответов по сохранённому тесту (ключи answers со значением 1 - правильные)"""
+    details = submission.get("details", []) if isinstance(submission, dict) else []
+    questions = []
+    topics: Dict[str, Dict[str, int]] = {}
+
+    for index, question in enumerate(test):
+        options = _answer_options(question)
+        correct_answer = next((text for text, value in options if value == 1), None)
+        selected = _selected_answer(_find_detail(details, index, len(test)), options)
+        is_correct = (
+            selected is not None and correct_answer is not None
+            and _normalize_answer(selected) == _normalize_answer(correct_answer)
+        )
+        topic = question.get("topic") or NO_TOPIC
+
+        questions.append({
+            "index": index,
+            "question": question.get("question", ""),
+            "topic": topic,
+            "selected_answer": selected,
+            "correct_answer": correct_answer,
+            "answered": selected is not None,
+            "is_correct": is_correct
+        })
+
+        stats = topics.setdefault(topic, {"correct": 0, "total": 0})
+        stats["total"] += 1
+        stats["correct"] += int(is_correct)
+
+    return _summary(questions, topics)
+
+
+def grade_reported(submission: Dict[str, Any]) -> Dict[str, Any]:
+    """Запасной вариант без сохранённого теста: доверяем отметкам isCorrect со страницы"""
+    details = submission.get("details", []) if isinstance(submission, dict) else []
+    questions = []
+    topics: Dict[str, Dict[str, int]] = {}
+
+    for index, detail in enumerate(d for d in details if isinstance(d, dict)):
+        is_correct = bool(detail.get("isCorrect"))
+        questions.append({
+            "index": index,
+            "question": str(detail.get("question", "")),
+            "topic": NO_TOPIC,
+            "selected_answer": detail.get("selectedAnswer") or None,
+            "correct_answer": None,
+            "answered": bool(detail.get("answered")),
+            "is_correct": is_correct
+        })
+        stats = topics.setdefault(NO_TOPIC, {"correct": 0, "total": 0})
+        stats["total"] += 1
+        stats["correct"] += int(is_correct)
+
+    return _summary(questions, topics)
+
+
+def _summary(questions: List[Dict[str, Any]], topics: Dict[str, Dict[str, int]]) -> Dict[str, Any]:
+    score = sum(1 for q in questions if q["is_correct"])
+    total = len(questions)
+    for stats in topics.values():
+        stats["percentage"] = round(stats["correct"] / stats["total"] * 100) if stats["total"] else 0
+
+    return {
+        "score": score,
+        "total": total,
+        "percentage": round(score / total * 100) if total else 0,
+        "per_topic": topics,
+        "questions": questions
+    }
+
+
+def wrong_questions(grading: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [q for q in grading["questions"] if not q["is_correct"]]
+
+
+def render_analysis_prompt(grading: Dict[str, Any], context: str) -> str:
+    """Промпт анализа: только вопросы с ошибками и итоговая статистика"""
+    context_info = f"Ты ассистент по подготовке к экзамену. Твоя задача - разобрать мои ошибки в тесте. Вот информация из моих файлов по этим вопросам:\n{context}\n\n" if context else "Ты ассистент по подготовке к экзамену. Твоя задача - разобрать мои ошибки в тесте.\n\n"
+
+    mistakes = []
+    for q in wrong_questions(grading):
+        selected = q["selected_answer"] or "нет ответа"
+        line = f"- [{q['topic']}] {q['question']}\n  Мой ответ: {selected}"
+        if q["correct_answer"]:
+            line += f"\n  Правильный ответ: {q['correct_answer']}"
+        mistakes.append(line)
+
+    topics = "\n".join(
+        f"- {topic}: {stats['correct']} из {stats['total']}" for topic, stats in grading["per_topic"].items()
+    )
+
+    return f"""{context_info}Мой результат: {grading['score']} из {grading['total']} ({grading['percentage']}%).
+
+Результаты по темам:
+{topics}
+
+Вопросы, на которые я ответил неправильно:
+{chr(10).join(mistakes)}
+
+Кратко, но ёмко поясни:
+1. Над какими темами мне стоит поработать?
+2. Готов ли я к экзамену?
+Не используй таблицы."""
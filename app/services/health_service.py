@@ -0,0 +1,200 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from app.config import (
+    COLLECTION_NAME,
+    HEALTH_LLM_MAX_P95,
+    HEALTH_PROBE_INTERVAL,
+    HEALTH_QDRANT_MAX_RTT_MS,
+    HEALTH_QUEUE_SATURATION,
+)
+from app.services.admission_service import admission
+from app.services.answer_cache import answer_cache
+from app.services.llm_router import llm_router
+from app.services.page_cache import page_cache
+from app.services.question_bank_service import get_question_bank_service
+from app.services.rerank_service import reranker
+from app.services.user_db_service import get_qdrant_client, get_user_db_service
+from app.services.warmup_service import readiness
+from app.utils.metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+
+def _probe_qdrant() -> Dict[str, Any]:
+    client = get_qdrant_client()
+    started = time.perf_counter()
+    names = {collection.name for collection in client.get_collections().collections}
+    rtt = time.perf_counter() - started
+    points_count = client.get_collection(COLLECTION_NAME).points_count if COLLECTION_NAME in names else 0
+    return {
+        "rtt_ms": round(rtt * 1000, 1),
+        "collection_name": COLLECTION_NAME,
+        "collection_exists": COLLECTION_NAME in names,
+        "points_count": points_count,
+    }
+
+
+def _probe_embedding() -> Dict[str, Any]:
+    service = get_user_db_service()
+    backend = service.embedding_backend
+    return {"model": service.embedding_model, "backend": backend.name, "loaded": backend.loaded}
+
+
+def _probe_llm() -> Dict[str, Any]:
+    backends = llm_router.stats()
+    healthy = [backend for backend in backends if backend["healthy"]]
+    # Медленнее всех из здоровых: по нему видно, сколько ждёт запрос в худшем случае
+    p95 = [backend["p95_complete"] for backend in healthy if backend["p95_complete"] is not None]
+    return {"healthy": len(healthy), "p95_complete": max(p95) if p95 else None, "backends": backends}
+
+
+def _probe_queues() -> Dict[str, Any]:
+    return {
+        "llm": {**admission.stats(), "queue_size": admission.queue_size},
+        "question_bank_jobs": get_question_bank_service().pending_jobs,
+    }
+
+
+def _probe_caches() -> Dict[str, Any]:
+    return {"pages": len(page_cache), "teacher_answers": len(answer_cache), "reranker_loaded": reranker.loaded,
+            "reranker_outcomes": dict(reranker.outcomes)}
+
+
+PROBES: Dict[str, Callable[[], Dict[str, Any]]] = {
+    "qdrant": _probe_qdrant,
+    "embedding": _probe_embedding,
+    "llm": _probe_llm,
+    "queues": _probe_queues,
+    "caches": _probe_caches,
+}
+
+
+class HealthProber:
+    """Фоновые проверки зависимостей: /live и /ready отдают последний результат и сами ничего не нагружают"""
+
+    def __init__(self, interval: float = HEALTH_PROBE_INTERVAL):
+        self.interval = interval
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.checked_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def refresh(self):
+        """Один проход всех проверок; ошибка одной не мешает остальным"""
+        results = {}
+        for name, probe in PROBES.items():
+            started = time.perf_counter()
+            # В лог только смена состояния, а не каждая неудачная проверка
+            was_ok = self.results.get(name, {}).get("ok", True)
+            try:
+                results[name] = {"ok": True, **probe()}
+                if not was_ok:
+                    logger.info(f"Проба {name} снова проходит")
+            except Exception as e:
+                error = str(e) or type(e).__name__
+                if was_ok:
+                    logger.warning(f"Проба {name} не прошла: {error}")
+                results[name] = {"ok": False, "error": error}
+            observe_stage(f"health_{name}", time.perf_counter() - started)
+        with self._lock:
+            self.results = results
+            self.checked_at = time.time()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.interval)
+
+    def start(self) -> Optional[threading.Thread]:
+        """Проверки в фоне каждые interval секунд (0 - выключены, пробы отвечают только по прогреву)"""
+        if self.interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return self._thread
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="health-probe", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def age(self) -> Optional[float]:
+        """Сколько секунд назад закончилась последняя проверка"""
+        with self._lock:
+            return time.time() - self.checked_at if self.checked_at else None
+
+    @property
+    def stalled(self) -> bool:
+        """Фоновые проверки остановились: поток завис или упал"""
+        if self.interval <= 0 or self._thread is None:
+            return False
+        age = self.age
+        limit = max(30.0, self.interval * 6)
+        if age is None:
+            return readiness.started_at is not None and time.time() - readiness.started_at > limit
+        return age > limit
+
+    def snapshot(self) -> Dict[str, Any]:
+        age = self.age
+        with self._lock:
+            return {
+                "checked_at": self.checked_at,
+                "age": round(age, 3) if age is not None else None,
+                **self.results,
+            }
+
+
+prober = HealthProber()
+
+
+def saturation() -> Dict[str, Any]:
+    """Заполненность очереди к модели - читается на каждый запрос: это поле процесса, а не вызов зависимости"""
+    waiting, queue_size = admission.waiting, admission.queue_size
+    fill = waiting / queue_size if queue_size else 0.0
+    return {"waiting": waiting, "queue_size": queue_size, "fill": round(fill, 3),
+            "saturated": bool(queue_size) and fill >= HEALTH_QUEUE_SATURATION}
+
+
+def _degraded(probes: Dict[str, Any]) -> List[str]:
+    """Работает, но медленно: балансировщику знать полезно, трафик не снимаем"""
+    reasons = []
+    qdrant = probes.get("qdrant") or {}
+    if qdrant.get("ok") and qdrant["rtt_ms"] > HEALTH_QDRANT_MAX_RTT_MS:
+        reasons.append("qdrant_slow")
+    llm = probes.get("llm") or {}
+    if llm.get("ok"):
+        if llm["backends"] and not llm["healthy"]:
+            reasons.append("llm_unhealthy")
+        elif llm["p95_complete"] is not None and llm["p95_complete"] > HEALTH_LLM_MAX_P95:
+            reasons.append("llm_slow")
+    return reasons
+
+
+def readiness_report() -> Dict[str, Any]:
+    """Готовность к трафику: прогрев, Qdrant по последней пробе и насыщение очереди к модели"""
+    report = readiness.snapshot()
+    probes = prober.snapshot()
+    load = saturation()
+
+    reasons = []
+    if not report["ready"]:
+        reasons.append("warmup")
+    if (probes.get("qdrant") or {}).get("ok") is False:
+        reasons.append("qdrant")
+    if load["saturated"]:
+        reasons.append("saturated")
+    if prober.stalled:
+        reasons.append("probe_stalled")
+
+    return {
+        **report,
+        "ready": not reasons,
+        "reasons": reasons,
+        "degraded": _degraded(probes),
+        "saturation": load,
+        "probe_age": probes["age"],
+    }
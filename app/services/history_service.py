@@ -0,0 +1,156 @@
+import hashlib
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.config import HISTORY_ENABLED, HISTORY_KEEP_FULL, HISTORY_MAX_PER_USER, HISTORY_RETENTION_DAYS
+from app.services.serialization import dumps_json
+from app.services.state_store import HISTORY, RESULTS, TEST_BODIES, TESTS, get_state_store
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд тело теста без ссылок из истории не удаляется компакцией
+BODY_GRACE_SECONDS = 3600
+# Итоги попытки, которые остаются и после сжатия истории
+SUMMARY_FIELDS = ["submission_id", "submitted_at", "score", "total", "percentage", "per_topic", "analysis_status"]
+
+
+def test_hash(test: List[Dict[str, Any]]) -> str:
+    """Ключ тела теста по содержимому: одно тело на все попытки по нему"""
+    return hashlib.blake2b(dumps_json(test), digest_size=16).hexdigest()
+
+
+class HistoryService:
+    """История попыток: тело теста хранится один раз, старые попытки сжимаются до итогов"""
+
+    def __init__(self, max_per_user: int = HISTORY_MAX_PER_USER, keep_full: int = HISTORY_KEEP_FULL,
+                 retention_days: float = HISTORY_RETENTION_DAYS, enabled: bool = HISTORY_ENABLED):
+        self.max_per_user = max_per_user
+        self.keep_full = keep_full
+        self.retention_days = retention_days
+        self.enabled = enabled
+
+    def _apply_retention(self, entries: List[Dict[str, Any]], now: float) -> List[Dict[str, Any]]:
+        """Политика хранения: срок, лимит попыток и сжатие всех, кроме последних keep_full"""
+        if self.retention_days > 0:
+            cutoff = now - self.retention_days * 86400
+            entries = [entry for entry in entries if entry.get("submitted_ts", now) >= cutoff]
+        entries = entries[-self.max_per_user:] if self.max_per_user > 0 else entries
+
+        compacted = []
+        full_from = len(entries) - self.keep_full
+        for index, entry in enumerate(entries):
+            if index < full_from and not entry.get("compacted"):
+                entry = {
+                    **{field: entry[field] for field in SUMMARY_FIELDS if field in entry},
+                    "submitted_ts": entry.get("submitted_ts"),
+                    "compacted": True
+                }
+            compacted.append(entry)
+        return compacted
+
+    def record_submission(self, user_id: str, submission_id: str, test: Optional[List[Dict[str, Any]]],
+                          answers: Any, grading: Dict[str, Any], analysis: Optional[str], analysis_status: str):
+        """Добавляет попытку в историю пользователя (ответы, итоги и ссылку на тело теста)"""
+        if not self.enabled:
+            return
+        store = get_state_store()
+        body_hash = None
+        if test is not None:
+            body_hash = test_hash(test)
+            # Перезапись того же тела обновляет время изменения - компакция не удалит его как свежее
+            store.put(TEST_BODIES, body_hash, test)
+
+        now = time.time()
+        entry = {
+            "submission_id": submission_id,
+            "submitted_at": datetime.fromtimestamp(now).isoformat(),
+            "submitted_ts": now,
+            "test_hash": body_hash,
+            "answers": answers,
+            "score": grading.get("score"),
+            "total": grading.get("total"),
+            "percentage": grading.get("percentage"),
+            "per_topic": grading.get("per_topic"),
+            "analysis": analysis,
+            "analysis_status": analysis_status
+        }
+        try:
+            store.update(HISTORY, user_id,
+                         lambda entries: self._apply_retention([*(entries or []), entry], now))
+        except Exception as e:
+            logger.error(f"Не удалось сохранить попытку в историю: {e}")
+
+    def record_analysis(self, user_id: str, submission_id: str, update: Dict[str, Any]):
+        """Разбор ошибок, пришедший после записи попытки"""
+        if not self.enabled:
+            return
+
+        def apply(entries: Optional[List[Dict[str, Any]]]) -> Optional[List[Dict[str, Any]]]:
+            for index, entry in enumerate(entries or []):
+                if entry.get("submission_id") == submission_id and not entry.get("compacted"):
+                    return [*entries[:index], {**entry, **update}, *entries[index + 1:]]
+            return None
+
+        try:
+            get_state_store().update(HISTORY, user_id, apply)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить разбор в историю: {e}")
+
+    def entries(self, user_id: str) -> List[Dict[str, Any]]:
+        return get_state_store().get(HISTORY, user_id) or []
+
+    def compact(self) -> Dict[str, int]:
+        """Применяет политику хранения ко всем пользователям и удаляет тела тестов без ссылок"""
+        store = get_state_store()
+        now = time.time()
+        stats = {"users": 0, "entries": 0, "test_bodies_deleted": 0}
+        referenced = set()
+
+        def retain(current: Optional[List[Dict[str, Any]]]) -> Optional[List[Dict[str, Any]]]:
+            retained = self._apply_retention(current or [], now)
+            return retained if retained != current else None
+
+        for user_id in store.keys(HISTORY):
+            entries = store.update(HISTORY, user_id, retain) or []
+            if not entries:
+                store.delete(HISTORY, user_id)
+                continue
+            stats["users"] += 1
+            stats["entries"] += len(entries)
+            referenced.update(entry["test_hash"] for entry in entries if entry.get("test_hash"))
+
+        # Свежие тела не трогаем: попытка с ними могла записаться уже после обхода истории
+        for body_hash in store.keys(TEST_BODIES):
+            stored = store.version(TEST_BODIES, body_hash)
+            if body_hash not in referenced and stored is not None and now - stored[1] > BODY_GRACE_SECONDS:
+                store.delete(TEST_BODIES, body_hash)
+                stats["test_bodies_deleted"] += 1
+
+        # Файлы блокировок записей, которых уже нет
+        stats["locks_removed"] = sum(store.prune_locks(namespace)
+                                     for namespace in (HISTORY, TEST_BODIES, TESTS, RESULTS))
+
+        logger.info(f"Компакция истории: {stats}")
+        return stats
+
+    def export(self, user_id: Optional[str] = None, include_tests: bool = False) -> Iterator[bytes]:
+        """История построчно в NDJSON: в памяти одновременно только история одного пользователя"""
+        store = get_state_store()
+        bodies: Dict[str, Any] = {}
+        for key in ([user_id] if user_id else sorted(store.keys(HISTORY))):
+            for entry in store.get(HISTORY, key) or []:
+                line = {"user_id": key, **entry}
+                body_hash = entry.get("test_hash")
+                if include_tests and body_hash:
+                    if body_hash not in bodies:
+                        # Небольшой кеш: попытки одного пользователя обычно идут по нескольким тестам
+                        if len(bodies) > 64:
+                            bodies.clear()
+                        bodies[body_hash] = store.get(TEST_BODIES, body_hash)
+                    line["test"] = bodies[body_hash]
+                yield dumps_json(line) + b"\n"
+
+
+history_service = HistoryService()
@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import (
+    LLM_BACKENDS,
+    LLM_ERROR_THRESHOLD,
+    LLM_HEDGE_ENABLED,
+    LLM_HEDGE_MIN_SAMPLES,
+    LLM_HEDGE_PERCENTILE,
+    LLM_POLICIES,
+    LLM_STATS_WINDOW,
+    LLM_UNHEALTHY_COOLDOWN,
+    OPENROUTER_MODEL,
+    OPENROUTER_URL,
+)
+from app.services.admission_service import TokenBucket, admission, per_worker
+from app.utils.metrics import LLM_BACKEND_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+PURPOSES = ("tests", "teacher", "analysis")
+# Метрики задержки: до первого токена (потоковые запросы) и до полного ответа
+FIRST_TOKEN = "first_token"
+COMPLETE = "complete"
+
+
+class LLMBackend:
+    """OpenAI-совместимый эндпоинт и скользящая статистика его задержек и ошибок"""
+
+    def __init__(self, name: str, url: str, model: str, api_key_env: Optional[str] = "OPENROUTER_API_KEY",
+                 bucket: Optional[TokenBucket] = None, window: int = LLM_STATS_WINDOW):
+        self.name = name
+        self.url = url
+        self.model = model
+        self.api_key_env = api_key_env
+        self.bucket = bucket
+        self._latency: Dict[str, Deque[float]] = {FIRST_TOKEN: deque(maxlen=window), COMPLETE: deque(maxlen=window)}
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._last_error = 0.0
+        self._trial_at: Optional[float] = None  # когда выдан пробный запрос нездоровому бэкенду
+        self._lock = threading.Lock()
+
+    @property
+    def api_key(self) -> Optional[str]:
+        return os.getenv(self.api_key_env) if self.api_key_env else None
+
+    def record(self, ok: bool, kind: str = COMPLETE, seconds: Optional[float] = None):
+        with self._lock:
+            if self._trial_at is not None:
+                # Ответ на пробный запрос: успех возвращает бэкенд в строй, ошибка - снова пауза
+                self._trial_at = None
+                if ok:
+                    self._outcomes.clear()
+            self._outcomes.append(ok)
+            if ok and seconds is not None:
+                self._latency[kind].append(seconds)
+            if not ok:
+                self._last_error = time.monotonic()
+        LLM_BACKEND_REQUESTS.labels(self.name, "ok" if ok else "error").inc()
+
+    def percentile(self, q: float, kind: str = COMPLETE) -> Optional[float]:
+        with self._lock:
+            samples = list(self._latency[kind])
+        return float(np.percentile(samples, q)) if samples else None
+
+    def samples(self, kind: str = COMPLETE) -> int:
+        return len(self._latency[kind])
+
+    @property
+    def error_rate(self) -> float:
+        with self._lock:
+            return (len(self._outcomes) - sum(self._outcomes)) / len(self._outcomes) if self._outcomes else 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return self.error_rate < LLM_ERROR_THRESHOLD
+
+    def try_trial(self) -> bool:
+        """Полуоткрытое состояние: после паузы нездоровый бэкенд получает один пробный запрос, а не весь трафик.
+
+        Пока ответа на пробный нет, следующий не выдаётся (до истечения ещё одной паузы - вдруг проба потерялась).
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_error <= LLM_UNHEALTHY_COOLDOWN:
+                return False
+            if self._trial_at is not None and now - self._trial_at <= LLM_UNHEALTHY_COOLDOWN:
+                return False
+            self._trial_at = now
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "model": self.model,
+            "healthy": self.healthy,
+            "error_rate": round(self.error_rate, 3),
+            "p50_first_token": self.percentile(50, FIRST_TOKEN),
+            "p50_complete": self.percentile(50, COMPLETE),
+            "p95_complete": self.percentile(95, COMPLETE),
+        }
+
+
+@dataclass
+class RoutingPolicy:
+    backends: List[str] = field(default_factory=list)  # пустой - все бэкенды
+    hedge: bool = LLM_HEDGE_ENABLED
+    hedge_percentile: float = LLM_HEDGE_PERCENTILE
+
+
+class LLMRouter:
+    """Выбор бэкенда под запрос: самый быстрый из здоровых, дублирование медленных запросов"""
+
+    def __init__(self, backends: List[LLMBackend], policies: Optional[Dict[str, RoutingPolicy]] = None):
+        self.backends = {backend.name: backend for backend in backends}
+        self.policies = policies or {}
+
+    def policy(self, purpose: str) -> RoutingPolicy:
+        return self.policies.get(purpose) or RoutingPolicy()
+
+    def candidates(self, purpose: str, kind: str = COMPLETE) -> List[LLMBackend]:
+        """Бэкенды в порядке попыток: здоровые по медианной задержке, затем нездоровые"""
+        names = self.policy(purpose).backends or list(self.backends)
+        backends = [self.backends[name] for name in names if name in self.backends]
+
+        def rank(backend: LLMBackend) -> Tuple[int, float]:
+            # Бэкенд без замеров пробуем первым, чтобы у него появилась статистика
+            median = backend.percentile(50, kind)
+            if median is None:
+                median = backend.percentile(50, COMPLETE if kind == FIRST_TOKEN else FIRST_TOKEN) or 0.0
+            return (0 if backend.healthy or backend.try_trial() else 1, median)
+
+        return sorted(backends, key=rank)
+
+    def hedge_delay(self, purpose: str, backend: LLMBackend, kind: str = COMPLETE) -> Optional[float]:
+        """Через сколько секунд дублировать запрос на следующий бэкенд (None - не дублировать)"""
+        policy = self.policy(purpose)
+        if not policy.hedge or backend.samples(kind) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return backend.percentile(policy.hedge_percentile, kind)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [backend.stats() for backend in self.backends.values()]
+
+
+def _load_backends() -> List[LLMBackend]:
+    if not LLM_BACKENDS:
+        # Общий лимит из LLM_RATE_LIMIT_RPM действует на OpenRouter по умолчанию
+        return [LLMBackend("openrouter", OPENROUTER_URL, OPENROUTER_MODEL, bucket=admission.bucket)]
+
+    backends = []
+    for item in json.loads(LLM_BACKENDS):
+        rpm = item.get("rate_limit_rpm")
+        bucket = admission.bucket if rpm is None else TokenBucket(per_worker(float(rpm)) / 60.0, int(item.get("burst", 5)))
+        backends.append(LLMBackend(
+            name=item["name"],
+            url=item["url"],
+            model=item.get("model", OPENROUTER_MODEL),
+            api_key_env=item.get("api_key_env"),
+            bucket=bucket
+        ))
+    return backends
+
+
+def _load_policies() -> Dict[str, RoutingPolicy]:
+    if not LLM_POLICIES:
+        return {}
+    return {purpose: RoutingPolicy(**policy) for purpose, policy in json.loads(LLM_POLICIES).items()}
+
+
+llm_router = LLMRouter(_load_backends(), _load_policies())
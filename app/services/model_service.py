@@ -1,24 +1,432 @@
+import logging
 import os
+import contextvars
 import json
+import queue
+import socket
+import threading
+import time
 import requests
-from app.config import OPENROUTER_API_KEY, OPENROUTER_MODEL
+import urllib3
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+from app.config import (
+    OPENROUTER_MODEL, LLM_MAX_TOKENS, LLM_MAX_CONCURRENCY,
+    LLM_RATE_LIMIT_RETRIES, LLM_RETRY_AFTER_MAX
+)
+from app.services.admission_service import AdmissionRejected, SingleFlight, admission
+from app.services.llm_router import COMPLETE, FIRST_TOKEN, LLMBackend, llm_router
+from app.utils.metrics import LLM_BACKEND_REQUESTS, observe_stage, record_error, record_tokens, track_stage
 
-OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+logger = logging.getLogger(__name__)
 
-def model_request(prompt: str, temperature: float = 0.3, max_tokens: int = 2000):
-    if not OPENROUTER_API_KEY:
-        raise RuntimeError("OPENROUTER_API_KEY is not set")
+# Одинаковые одновременные запросы (тот же промпт и параметры) идут к провайдеру один раз
+_inflight = SingleFlight("llm_coalesce")
+# Потоки для параллельных попыток на разных бэкендах (дублирование медленных запросов)
+_attempts_pool = ThreadPoolExecutor(max_workers=max(1, LLM_MAX_CONCURRENCY) * 4, thread_name_prefix="llm")
 
+_session: Optional[requests.Session] = None
+_session_pid: Optional[int] = None
+_session_lock = threading.Lock()
+
+
+# Соединение пула -> попытка, которая его сейчас использует; без этой проверки отмена могла бы
+# оборвать соединение, уже вернувшееся в пул и занятое другим запросом
+_binding_lock = threading.Lock()
+
+
+class _Attempt:
+    """Попытка запроса к бэкенду, которую можно прервать из другого потока (проигравший дубль)"""
+
+    def __init__(self):
+        self.cancelled = threading.Event()
+        self._connection = None
+
+    def cancel(self):
+        """Обрыв соединения: поток попытки сразу выходит из ожидания ответа и освобождает слот допуска,
+        провайдер видит разрыв и прекращает генерацию"""
+        self.cancelled.set()
+        with _binding_lock:
+            connection = self._connection
+            if connection is not None and getattr(connection, "_llm_attempt", None) is self:
+                sock = getattr(connection, "sock", None)
+                if sock is not None:
+                    try:
+                        sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+
+    def finish(self):
+        """Запрос попытки завершён: соединение принадлежит пулу, отмена его больше не трогает"""
+        with _binding_lock:
+            self._connection = None
+
+
+class AttemptCancelled(Exception):
+    """Попытка отменена: ответил другой бэкенд"""
+
+
+# Текущая попытка потока запроса: соединение пула привязывается к ней перед отправкой
+_attempt_var: contextvars.ContextVar[Optional[_Attempt]] = contextvars.ContextVar("llm_attempt", default=None)
+
+
+def _bind_connection(connection):
+    attempt = _attempt_var.get()
+    with _binding_lock:
+        connection._llm_attempt = attempt
+        if attempt is not None:
+            attempt._connection = connection
+    if attempt is not None and attempt.cancelled.is_set():
+        attempt.cancel()
+
+
+class _BindingHTTPConnection(urllib3.connection.HTTPConnection):
+    def request(self, *args, **kwargs):
+        _bind_connection(self)
+        return super().request(*args, **kwargs)
+
+
+class _BindingHTTPSConnection(urllib3.connection.HTTPSConnection):
+    def request(self, *args, **kwargs):
+        _bind_connection(self)
+        return super().request(*args, **kwargs)
+
+
+class _BindingHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = _BindingHTTPConnection
+
+
+class _BindingHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = _BindingHTTPSConnection
+
+
+class _CancellableAdapter(requests.adapters.HTTPAdapter):
+    """Пул соединений, в котором соединение запроса известно его попытке (см. _Attempt.cancel)"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _BindingHTTPConnectionPool,
+            "https": _BindingHTTPSConnectionPool,
+        }
+
+
+def get_http_session() -> requests.Session:
+    """Общий на процесс пул keep-alive соединений к провайдерам: без TLS-рукопожатия на каждый запрос"""
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            # Соединения родителя после fork не переиспользуем
+            if _session is None or _session_pid != os.getpid():
+                session = requests.Session()
+                adapter = _CancellableAdapter(pool_maxsize=max(1, LLM_MAX_CONCURRENCY) * 4)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session, _session_pid = session, os.getpid()
+    return _session
+
+
+def _build_payload(prompt: str, temperature: float, max_tokens: int,
+                   response_format: Optional[Dict[str, Any]] = None,
+                   model: str = OPENROUTER_MODEL) -> Dict[str, Any]:
     payload = {
-        "model": OPENROUTER_MODEL,
+        "model": model,
         "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
         "temperature": temperature,
         "max_tokens": max_tokens
     }
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    resp = requests.post(OPENROUTER_URL, headers=headers, data=json.dumps(payload), timeout=60)
-    resp.raise_for_status()
+    if response_format:
+        payload["response_format"] = response_format
+    return payload
+
+
+def _headers(backend: LLMBackend) -> Dict[str, str]:
+    headers = {"Content-Type": "application/json"}
+    if backend.api_key_env:
+        if not backend.api_key:
+            raise RuntimeError(f"{backend.api_key_env} is not set")
+        headers["Authorization"] = f"Bearer {backend.api_key}"
+    return headers
+
+
+def _is_client_error(error: Exception) -> bool:
+    """Ошибка в самом запросе (4xx, кроме 429) - на другом бэкенде повторять бессмысленно"""
+    response = getattr(error, "response", None)
+    return (isinstance(error, requests.HTTPError) and response is not None
+            and 400 <= response.status_code < 500 and response.status_code != 429)
+
+
+def _retry_after(resp: requests.Response, attempt: int) -> float:
+    """Пауза после 429: по заголовку Retry-After, иначе экспоненциально"""
+    try:
+        delay = float(resp.headers.get("Retry-After", ""))
+    except ValueError:
+        delay = 2.0 ** attempt
+    return min(max(delay, 0.0), LLM_RETRY_AFTER_MAX)
+
+
+@contextmanager
+def _upstream(backend: LLMBackend, payload: Dict[str, Any], stream: bool = False,
+              cancel: Optional[_Attempt] = None):
+    """Запрос к бэкенду после допуска; на 429 - пауза для всех его вызывающих и повтор"""
+    headers = _headers(backend)
+    data = json.dumps({**payload, "model": backend.model})
+    with admission.admit(bucket=backend.bucket):
+        token = _attempt_var.set(cancel)
+        try:
+            for attempt in range(LLM_RATE_LIMIT_RETRIES + 1):
+                # Пока ждали допуска или паузу после 429, ответил другой бэкенд - не отправляем
+                if cancel is not None and cancel.cancelled.is_set():
+                    raise AttemptCancelled(backend.name)
+                resp = get_http_session().post(backend.url, headers=headers, data=data, timeout=60, stream=stream)
+                if resp.status_code != 429 or attempt == LLM_RATE_LIMIT_RETRIES:
+                    break
+                delay = _retry_after(resp, attempt)
+                resp.close()
+                record_error("llm_rate_limited")
+                logger.warning(f"{backend.name} ответил 429, повтор через {delay:.1f} с")
+                if backend.bucket:
+                    backend.bucket.pause(delay)
+                if cancel is not None:
+                    cancel.cancelled.wait(delay)
+                else:
+                    time.sleep(delay)
+        finally:
+            _attempt_var.reset(token)
+        try:
+            resp.raise_for_status()
+            yield resp
+        finally:
+            resp.close()
+            if cancel is not None:
+                cancel.finish()
+
+
+def _request_backend(backend: LLMBackend, payload: Dict[str, Any],
+                     cancel: Optional[_Attempt] = None) -> requests.Response:
+    """Один непотоковый запрос к бэкенду с учётом в его статистике"""
+    started = time.perf_counter()
+    try:
+        with _upstream(backend, payload, cancel=cancel) as resp:
+            resp.content  # тело читаем до закрытия соединения
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        # Обрыв отменённой попытки - не ошибка бэкенда
+        if not _is_client_error(e) and not (cancel is not None and cancel.cancelled.is_set()):
+            backend.record(False)
+        raise
+    backend.record(True, COMPLETE, time.perf_counter() - started)
     return resp
+
+
+def _routed_request(payload: Dict[str, Any], purpose: Optional[str]) -> requests.Response:
+    """Запрос к самому быстрому здоровому бэкенду; медленный дублируется, упавший - на следующий"""
+    candidates = llm_router.candidates(purpose, COMPLETE)
+    if len(candidates) == 1:
+        return _request_backend(candidates[0], payload)
+
+    pending: Dict[Any, LLMBackend] = {}
+    launched: List[LLMBackend] = []
+    attempts: Dict[Any, _Attempt] = {}
+    last_error: Optional[Exception] = None
+
+    def launch():
+        backend = candidates[len(launched)]
+        launched.append(backend)
+        cancel = _Attempt()
+        future = _attempts_pool.submit(contextvars.copy_context().run, _request_backend, backend, payload, cancel)
+        pending[future] = backend
+        attempts[future] = cancel
+
+    launch()
+    try:
+        while pending:
+            delay = None
+            if len(launched) < len(candidates):
+                delay = llm_router.hedge_delay(purpose, launched[-1], COMPLETE)
+            done, _ = wait(list(pending), timeout=delay, return_when=FIRST_COMPLETED)
+            if not done:
+                logger.info(f"{launched[-1].name} отвечает дольше {delay:.1f} с, дублируем запрос")
+                LLM_BACKEND_REQUESTS.labels(launched[-1].name, "hedged").inc()
+                launch()
+                continue
+
+            for future in done:
+                backend = pending.pop(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    if _is_client_error(e):
+                        raise
+                    last_error = e
+                    logger.warning(f"Ошибка бэкенда {backend.name}: {e}")
+            if not pending and len(launched) < len(candidates):
+                launch()
+    finally:
+        # Проигравшие попытки обрываются сразу: не держат слот допуска и поток, не тратят токены
+        for future in pending:
+            attempts[future].cancel()
+
+    raise last_error
+
+
+def model_request(prompt: str, temperature: float = 0.3, max_tokens: int = LLM_MAX_TOKENS,
+                  response_format: Optional[Dict[str, Any]] = None, purpose: Optional[str] = None):
+    """Непотоковый запрос к модели; purpose выбирает политику маршрутизации (tests, teacher, analysis)"""
+    payload = _build_payload(prompt, temperature, max_tokens, response_format)
+
+    def call():
+        with track_stage("llm"):
+            resp = _routed_request(payload, purpose)
+        data = resp.json()
+        log_token_usage(data.get("usage"), data.get("model"))
+        return resp
+
+    return _inflight.do((purpose, json.dumps(payload, sort_keys=True)), call)
+
+
+def _stream_backend(backend: LLMBackend, payload: Dict[str, Any], attempt: int,
+                    events: "queue.Queue", cancel: _Attempt):
+    """Одна потоковая попытка: события SSE складываются в общую очередь с номером попытки"""
+    started = time.perf_counter()
+    first_token = None
+    try:
+        with _upstream(backend, payload, stream=True, cancel=cancel) as resp:
+            finish_reason = None
+            usage = None
+
+            for line in resp.iter_lines(decode_unicode=True):
+                if cancel.cancelled.is_set():
+                    return
+                # Пустые строки разделяют события, строки с ":" - комментарии провайдера
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                except ValueError:
+                    continue
+
+                usage = chunk.get("usage") or usage
+                for choice in chunk.get("choices") or []:
+                    content = (choice.get("delta") or {}).get("content")
+                    if content:
+                        if first_token is None:
+                            first_token = time.perf_counter() - started
+                        events.put(("content", attempt, content))
+                    finish_reason = choice.get("finish_reason") or finish_reason
+
+        backend.record(True, FIRST_TOKEN, first_token if first_token is not None else time.perf_counter() - started)
+        events.put(("done", attempt, {"finish_reason": finish_reason, "usage": usage}))
+
+    except Exception as e:
+        if not cancel.cancelled.is_set() and not isinstance(e, AdmissionRejected) and not _is_client_error(e):
+            backend.record(False)
+        events.put(("error", attempt, e))
+
+
+def model_stream_request(prompt: str, temperature: float = 0.3, max_tokens: int = LLM_MAX_TOKENS,
+                         response_format: Optional[Dict[str, Any]] = None,
+                         purpose: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Потоковый запрос к модели (SSE).
+
+    Отдаёт события {"content": str} по мере генерации и в конце {"finish_reason": str}.
+    Если первый токен задерживается дольше обычного, запрос дублируется на следующий бэкенд;
+    дальше читается тот поток, что начал отвечать первым.
+    """
+    payload = _build_payload(prompt, temperature, max_tokens, response_format)
+    payload["stream"] = True
+    payload["stream_options"] = {"include_usage": True}
+
+    candidates = llm_router.candidates(purpose, FIRST_TOKEN)
+    events: "queue.Queue" = queue.Queue()
+    attempts: List[_Attempt] = []
+    launched: List[LLMBackend] = []
+    active = set()
+    winner = None
+    last_error: Optional[Exception] = None
+
+    def launch():
+        backend = candidates[len(launched)]
+        cancel = _Attempt()
+        attempt = len(launched)
+        launched.append(backend)
+        attempts.append(cancel)
+        active.add(attempt)
+        _attempts_pool.submit(contextvars.copy_context().run, _stream_backend,
+                              backend, payload, attempt, events, cancel)
+
+    def choose(attempt: int):
+        # Остальные потоки обрываем сразу, а не на следующей строке ответа
+        for index, cancel in enumerate(attempts):
+            if index != attempt:
+                cancel.cancel()
+
+    started = time.perf_counter()
+    result: Dict[str, Any] = {}
+    try:
+        launch()
+        while True:
+            timeout = None
+            if winner is None and len(launched) < len(candidates):
+                timeout = llm_router.hedge_delay(purpose, launched[-1], FIRST_TOKEN)
+            try:
+                kind, attempt, value = events.get(timeout=timeout)
+            except queue.Empty:
+                logger.info(f"{launched[-1].name} молчит дольше {timeout:.1f} с, дублируем запрос")
+                LLM_BACKEND_REQUESTS.labels(launched[-1].name, "hedged").inc()
+                launch()
+                continue
+
+            if winner is not None and attempt != winner:
+                continue
+
+            if kind == "content":
+                if winner is None:
+                    winner = attempt
+                    choose(attempt)
+                    observe_stage("llm_first_token", time.perf_counter() - started)
+                yield {"content": value}
+
+            elif kind == "done":
+                if winner is None:
+                    winner = attempt
+                    choose(attempt)
+                result = value
+                break
+
+            else:
+                active.discard(attempt)
+                # Обрыв посреди ответа - как и раньше, решает вызывающий код
+                if attempt == winner or _is_client_error(value):
+                    raise value
+                last_error = value
+                logger.warning(f"Ошибка бэкенда {launched[attempt].name}: {value}")
+                if not active:
+                    if len(launched) >= len(candidates):
+                        raise last_error
+                    launch()
+
+    except Exception:
+        record_error("llm")
+        raise
+    finally:
+        # Вызывающий перестал читать поток - обрываем и его: генерация дальше никому не нужна
+        for cancel in attempts:
+            cancel.cancel()
+        observe_stage("llm", time.perf_counter() - started)
+
+    log_token_usage(result.get("usage"), launched[winner].model)
+    yield {"finish_reason": result.get("finish_reason")}
+
+
+def log_token_usage(usage: Optional[Dict[str, Any]], model: Optional[str] = None):
+    """Логирование числа токенов промпта и ответа по данным провайдера"""
+    usage = usage or {}
+    record_tokens(usage.get("prompt_tokens"), usage.get("completion_tokens"))
+    logger.info(f"LLM {model or OPENROUTER_MODEL}: prompt_tokens={usage.get('prompt_tokens')}, "
+                f"completion_tokens={usage.get('completion_tokens')}")
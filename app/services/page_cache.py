@@ -0,0 +1,114 @@
+import gzip
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from email.utils import formatdate
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+from app.config import PAGE_CACHE_MIN_COMPRESS, PAGE_CACHE_SIZE
+from app.services.admission_service import SingleFlight
+from app.utils.metrics import record_cache, track_stage
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+    logger.info("brotli не установлен, страницы сжимаются только gzip")
+
+
+@dataclass
+class CachedPage:
+    """Отрендеренная страница одной версии теста и её сжатые варианты"""
+
+    version: Hashable
+    media_type: str
+    etag: str
+    last_modified: str
+    bodies: Dict[str, bytes] = field(default_factory=dict)  # кодировка -> тело
+
+    def body(self, accept_encoding: str) -> Tuple[bytes, Optional[str]]:
+        """Тело под Accept-Encoding клиента: br, затем gzip, иначе без сжатия"""
+        accepted = set()
+        for part in accept_encoding.split(","):
+            encoding, *params = part.split(";")
+            # q=0 - явный отказ от кодировки
+            quality = 1.0
+            for param in params:
+                name, _, value = param.partition("=")
+                if name.strip().lower() == "q":
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            if quality > 0:
+                accepted.add(encoding.strip().lower())
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.bodies:
+                return self.bodies[encoding], encoding
+        return self.bodies["identity"], None
+
+
+class PageCache:
+    """LRU-кеш отрендеренных страниц по (вид, ID теста); запись устаревает при смене версии"""
+
+    def __init__(self, max_entries: int = PAGE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], CachedPage]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Класс одновременно открывает страницу - рендерим версию один раз
+        self._renders = SingleFlight("page_render")
+
+    def get(self, kind: str, test_id: str, version: Hashable, modified_at: float,
+            media_type: str, render: Callable[[], bytes]) -> CachedPage:
+        key = (kind, test_id)
+        with self._lock:
+            page = self._entries.get(key)
+            if page is not None and page.version == version:
+                self._entries.move_to_end(key)
+                record_cache("page", hit=True)
+                return page
+        record_cache("page", hit=False)
+
+        page = self._renders.do((kind, test_id, version),
+                                lambda: self._build(version, modified_at, media_type, render))
+        with self._lock:
+            self._entries[key] = page
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return page
+
+    def _build(self, version: Hashable, modified_at: float, media_type: str,
+               render: Callable[[], bytes]) -> CachedPage:
+        with track_stage("page_render"):
+            body = render()
+            bodies = {"identity": body}
+            # Сжимаем один раз на версию - поэтому уровень максимальный
+            if len(body) >= PAGE_CACHE_MIN_COMPRESS:
+                bodies["gzip"] = gzip.compress(body, compresslevel=9)
+                if brotli is not None:
+                    bodies["br"] = brotli.compress(body, quality=11)
+
+        return CachedPage(
+            version=version,
+            media_type=media_type,
+            etag=f'W/"{hashlib.blake2b(body, digest_size=12).hexdigest()}"',
+            last_modified=formatdate(modified_at, usegmt=True),
+            bodies=bodies
+        )
+
+    def invalidate(self, test_id: str):
+        """Сброс всех страниц теста (после перегенерации)"""
+        with self._lock:
+            for key in [key for key in self._entries if key[1] == test_id]:
+                del self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+page_cache = PageCache()
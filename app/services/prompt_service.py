@@ -0,0 +1,258 @@
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from app.config import (
+    LLM_CONTEXT_WINDOW,
+    OPENROUTER_MODEL,
+    PROMPT_FILE_TOKEN_LIMIT,
+    PROMPT_TOKEN_BUDGET,
+    RERANK_TOP_K,
+    TOKENIZER_ENCODING,
+)
+from app.services.rerank_service import reranker
+from app.utils.metrics import track_stage
+
+logger = logging.getLogger(__name__)
+
+TRUNCATED_MARK = "... [обрезано]"
+# Меньше этого остатка бюджета фрагмент в контекст не добавляем
+MIN_PASSAGE_TOKENS = 50
+# Служебные поля payload, которые не имеет смысла отправлять модели
+SERVICE_FIELDS = ["filename", "file_type", "uploaded_at", "content_preview",
+                  "file_hash", "file_size", "user_id"]
+
+
+class TokenCounter:
+    """Подсчёт токенов токенизатором модели (tiktoken) с грубой оценкой как запасным вариантом"""
+
+    # Для кириллицы в BPE-токенизаторах в среднем ~3 символа на токен
+    chars_per_token = 3
+
+    def __init__(self, model: str = OPENROUTER_MODEL, encoding: str = TOKENIZER_ENCODING):
+        self.model = model
+        self.encoding_name = encoding
+        self._encoding = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _get_encoding(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    try:
+                        import tiktoken
+
+                        # openai/gpt-oss-20b:free -> gpt-oss-20b
+                        model_name = self.model.split("/")[-1].split(":")[0]
+                        try:
+                            self._encoding = tiktoken.encoding_for_model(model_name)
+                        except KeyError:
+                            self._encoding = tiktoken.get_encoding(self.encoding_name)
+                    except Exception as e:
+                        logger.warning(f"Токенизатор недоступен, используем оценку по символам: {e}")
+                        self._encoding = None
+                    self._loaded = True
+        return self._encoding
+
+    def count(self, text: str) -> int:
+        """Количество токенов в тексте"""
+        if not text:
+            return 0
+        encoding = self._get_encoding()
+        if encoding is None:
+            return len(text) // self.chars_per_token + 1
+        return len(encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Обрезка текста до max_tokens токенов"""
+        if max_tokens <= 0:
+            return ""
+        encoding = self._get_encoding()
+        if encoding is None:
+            max_chars = max_tokens * self.chars_per_token
+            return text if len(text) <= max_chars else text[:max_chars]
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return encoding.decode(tokens[:max_tokens])
+
+
+token_counter = TokenCounter()
+
+
+def payload_to_text(payload: Dict[str, Any]) -> str:
+    """Текст файла для контекста: content_preview или доступные метаданные"""
+    if "content_preview" in payload:
+        return payload["content_preview"]
+
+    content_parts = []
+    if "filename" in payload:
+        content_parts.append(f"Файл: {payload['filename']}")
+    if "file_type" in payload:
+        content_parts.append(f"Тип: {payload['file_type']}")
+    if "uploaded_at" in payload:
+        content_parts.append(f"Загружен: {payload['uploaded_at']}")
+
+    for key, value in payload.items():
+        if key not in SERVICE_FIELDS and isinstance(value, (str, int, float)):
+            content_parts.append(f"{key}: {value}")
+
+    return "\n".join(content_parts)
+
+
+def reranked_passages(db_service, user_id: str, query: str, limit: int = RERANK_TOP_K,
+                      query_vector: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+    """Лучшие фрагменты файлов по запросу: кандидаты векторного поиска, переупорядоченные cross-encoder"""
+    hits = db_service.search_chunks(user_id=user_id, query_text=query, limit=reranker.max_candidates,
+                                    query_vector=query_vector)
+    passages = [
+        {
+            "id": hit["payload"].get("file_id", hit["id"]),
+            "chunk_id": hit["id"],
+            "vector_score": hit["score"],
+            "title": hit["payload"].get("filename", "Без имени"),
+            "text": hit["payload"].get("text", ""),
+        }
+        for hit in hits
+    ]
+    ranked = reranker.rerank(query, passages)[:limit]
+    # fit_context упорядочивает по score - задаём его по итоговому рангу
+    for rank, passage in enumerate(ranked):
+        passage["score"] = 1.0 - rank / len(ranked)
+    return ranked
+
+
+def collect_passages(db_service, user_id: str, query: Optional[str] = None, max_files: int = 10,
+                     query_vector: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+    """Фрагменты контекста из файлов пользователя, отсортированные по релевантности запросу.
+
+    query_vector - уже посчитанный эмбеддинг запроса, чтобы не считать его повторно.
+    """
+    # С переранжированием в контекст идут несколько лучших фрагментов вместо превью целых файлов
+    if query and reranker.enabled:
+        passages = reranked_passages(db_service, user_id=user_id, query=query, query_vector=query_vector)
+        if passages:
+            return passages
+
+    passages = []
+    seen_ids = set()
+
+    # Сначала файлы, найденные семантическим поиском по запросу
+    if query:
+        for result in db_service.search_files(user_id=user_id, query_text=query, query_vector=query_vector,
+                                              limit=max_files):
+            seen_ids.add(result["id"])
+            passages.append({"id": result["id"], "score": result["score"], "payload": result["payload"]})
+
+    # Затем остальные файлы пользователя (поиск отсекает всё ниже порога сходства)
+    if len(passages) < max_files:
+        for file_data in db_service.get_user_files(user_id=user_id, limit=max_files):
+            if file_data["id"] in seen_ids:
+                continue
+            passages.append({"id": file_data["id"], "score": 0.0, "payload": file_data.get("payload", {})})
+            if len(passages) >= max_files:
+                break
+
+    for passage in passages:
+        payload = passage["payload"]
+        passage["title"] = payload.get("filename", "Без имени")
+        passage["text"] = payload_to_text(payload)
+
+    return passages
+
+
+def collect_relevant_passages(db_service, user_id: str, queries: List[str],
+                              limit_per_query: int = 3) -> List[Dict[str, Any]]:
+    """Только фрагменты, релевантные хотя бы одному из запросов (лучшая оценка по всем запросам)"""
+    best: Dict[Any, Dict[str, Any]] = {}
+    for query in queries:
+        if not query:
+            continue
+        if reranker.enabled:
+            ranked = reranked_passages(db_service, user_id=user_id, query=query, limit=limit_per_query)
+            for passage in ranked:
+                current = best.get(passage["chunk_id"])
+                if current is None or passage["score"] > current["score"]:
+                    best[passage["chunk_id"]] = passage
+            if ranked:
+                continue
+        for result in db_service.search_files(user_id=user_id, query_text=query, limit=limit_per_query):
+            current = best.get(result["id"])
+            if current is None or result["score"] > current["score"]:
+                best[result["id"]] = {"id": result["id"], "score": result["score"], "payload": result["payload"]}
+
+    passages = list(best.values())
+    for passage in passages:
+        # У фрагментов после переранжирования заголовок и текст уже есть
+        payload = passage.get("payload")
+        if payload is not None:
+            passage["title"] = payload.get("filename", "Без имени")
+            passage["text"] = payload_to_text(payload)
+    return passages
+
+
+class PromptBuilder:
+    """Сборка промпта в пределах бюджета токенов модели"""
+
+    def __init__(self, budget_tokens: int = PROMPT_TOKEN_BUDGET,
+                 context_window: int = LLM_CONTEXT_WINDOW,
+                 file_token_limit: int = PROMPT_FILE_TOKEN_LIMIT,
+                 counter: TokenCounter = token_counter):
+        self.budget_tokens = budget_tokens
+        self.context_window = context_window
+        self.file_token_limit = file_token_limit
+        self.counter = counter
+
+    def context_budget(self, instructions: str, output_tokens: int,
+                       budget_tokens: Optional[int] = None) -> int:
+        """Сколько токенов остаётся на контекст после инструкций и ожидаемого ответа"""
+        budget = min(budget_tokens or self.budget_tokens, self.context_window - output_tokens)
+        return max(0, budget - self.counter.count(instructions))
+
+    def fit_context(self, passages: List[Dict[str, Any]], max_tokens: int) -> str:
+        """Контекст из наиболее релевантных фрагментов, не превышающий max_tokens"""
+        context_parts = []
+        used_tokens = 0
+        # Первый не поместившийся фрагмент: позиция в контексте и текст
+        skipped = None
+
+        for passage in sorted(passages, key=lambda p: p.get("score", 0.0), reverse=True):
+            if max_tokens - used_tokens < MIN_PASSAGE_TOKENS:
+                break
+            content = passage["text"]
+            if self.counter.count(content) > self.file_token_limit:
+                content = self.counter.truncate(content, self.file_token_limit) + TRUNCATED_MARK
+
+            file_context = f"\n--- Файл: {passage.get('title', 'Без имени')} ---\n{content}\n"
+            file_tokens = self.counter.count(file_context)
+
+            if used_tokens + file_tokens <= max_tokens:
+                context_parts.append(file_context)
+                used_tokens += file_tokens
+            elif skipped is None:
+                # Не помещается целиком - пробуем фрагменты ниже, они могут быть короче
+                skipped = (len(context_parts), file_context)
+
+        if skipped is not None:
+            # Остаток бюджета - обрезанному первому из не поместившихся, на его место по релевантности
+            remaining_tokens = max_tokens - used_tokens - self.counter.count(TRUNCATED_MARK) - 1
+            if remaining_tokens > MIN_PASSAGE_TOKENS:  # Только если есть что добавить
+                position, file_context = skipped
+                context_parts.insert(position, self.counter.truncate(file_context, remaining_tokens) + TRUNCATED_MARK)
+
+        return "\n".join(context_parts)
+
+    def build(self, render: Callable[[str], str], passages: List[Dict[str, Any]],
+              output_tokens: int, budget_tokens: Optional[int] = None) -> str:
+        """Промпт: render(context) с контекстом, подогнанным под бюджет"""
+        with track_stage("prompt_build"):
+            instructions = render("")
+            context = self.fit_context(passages, self.context_budget(instructions, output_tokens, budget_tokens))
+            prompt = render(context)
+        logger.info(f"Промпт: {self.counter.count(prompt)} токенов "
+                    f"(контекст: {self.counter.count(context)}, ожидаемый ответ: {output_tokens})")
+        return prompt
+
+
+prompt_builder = PromptBuilder()
@@ -0,0 +1,237 @@
+import logging
+import random
+import threading
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from qdrant_client.models import (
+    Distance,
+    FieldCondition,
+    Filter,
+    FilterSelector,
+    MatchAny,
+    MatchValue,
+    PointStruct,
+    VectorParams,
+)
+
+from app.config import QUESTION_BANK_COLLECTION, QUESTION_BANK_MIN_SCORE, QUESTION_BANK_SIZE
+from app.services.admission_service import llm_scope
+from app.services.prompt_service import payload_to_text
+from app.services.question_parser import QuestionStreamParser
+from app.services.state_store import JOBS, get_state_store
+from app.services.test_generation_service import generate_test
+from app.services.user_db_service import UserDBService, get_user_db_service
+from app.utils.metrics import track_stage
+
+logger = logging.getLogger(__name__)
+
+
+def _spread_order(count: int) -> List[int]:
+    """Ранг каждого из count элементов: порядок ван дер Корпута (0, 1/2, 1/4, 3/4, ...) по позиции"""
+    bits = max(1, (count - 1).bit_length())
+    positions = sorted(range(count), key=lambda index: int(format(index, f"0{bits}b")[::-1], 2))
+    ranks = [0] * count
+    for rank, index in enumerate(positions):
+        ranks[index] = rank
+    return ranks
+
+
+class QuestionBankService:
+    """Банк вопросов, заранее сгенерированных по каждому загруженному файлу"""
+
+    def __init__(self, db_service: UserDBService, collection_name: str = QUESTION_BANK_COLLECTION):
+        self.db_service = db_service
+        self.collection_name = collection_name
+        self.pending_jobs = 0
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        return self.db_service.client
+
+    @staticmethod
+    def job_key(user_id: str, file_id: str) -> str:
+        return f"question_bank:{user_id}:{file_id}"
+
+    def job_status(self, user_id: str, file_id: str) -> Optional[Dict[str, Any]]:
+        """Состояние фоновой сборки банка по файлу (видно из любого воркера)"""
+        return get_state_store().get(JOBS, self.job_key(user_id, file_id))
+
+    def _set_job(self, user_id: str, file_id: str, **fields):
+        try:
+            get_state_store().update(
+                JOBS, self.job_key(user_id, file_id),
+                lambda job: {**(job or {"type": "question_bank", "user_id": user_id, "file_id": file_id}),
+                             **fields, "updated_at": datetime.now().isoformat()}
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить состояние задачи банка вопросов: {e}")
+
+    def init_collection(self) -> Dict[str, Any]:
+        """Инициализация коллекции банка вопросов"""
+        try:
+            if not self.client.collection_exists(self.collection_name):
+                self.client.create_collection(
+                    collection_name=self.collection_name,
+                    vectors_config=VectorParams(
+                        size=self.db_service.embedding_dimension,
+                        distance=Distance.COSINE
+                    )
+                )
+                for field_name in ("user_id", "file_id"):
+                    self.client.create_payload_index(
+                        collection_name=self.collection_name,
+                        field_name=field_name,
+                        field_schema="keyword"
+                    )
+                logger.info(f"Коллекция '{self.collection_name}' создана")
+            return {"success": True, "message": f"Коллекция '{self.collection_name}' готова"}
+
+        except Exception as e:
+            logger.error(f"Ошибка инициализации банка вопросов: {e}")
+            return {"success": False, "error": str(e)}
+
+    def _file_passages(self, user_id: str, file_id: str, filename: str) -> List[Dict[str, Any]]:
+        """Фрагменты всего файла, а не только превью; без фрагментов (старая загрузка) - пустой список.
+
+        Вес задаёт порядок, в котором любой префикс равномерно покрывает файл: при разбиении на части
+        и обрезке контекста под бюджет каждая часть получает фрагменты из начала, середины и конца.
+        """
+        chunks = self.db_service.get_file_chunks(user_id, file_id)
+        order = _spread_order(len(chunks))
+        return [
+            {"id": chunk["id"], "score": 1.0 - rank / len(chunks),
+             "title": f"{filename} (фрагмент {chunk['index'] + 1} из {len(chunks)})", "text": chunk["text"]}
+            for rank, chunk in zip(order, chunks)
+        ]
+
+    def build_for_file(self, user_id: str, file_id: str) -> int:
+        """Фоновая задача: генерация и сохранение пула вопросов по файлу"""
+        with self._lock:
+            self.pending_jobs += 1
+        self._set_job(user_id, file_id, status="running")
+        try:
+            file_data = self.db_service.get_file_by_id(user_id=user_id, file_id=file_id)
+            if not file_data:
+                return 0
+
+            payload = file_data["payload"]
+            filename = payload.get("filename", "Без имени")
+            passages = self._file_passages(user_id, file_id, filename) or \
+                [{"id": file_id, "score": 1.0, "title": filename, "text": payload_to_text(payload)}]
+
+            with llm_scope(user_id):
+                questions = generate_test(
+                    f"Составь вопросы, покрывающие все основные темы материала из файла {filename}.",
+                    passages,
+                    count=QUESTION_BANK_SIZE
+                )
+
+            vectors = self.db_service.embedding_backend.encode([q["question"] for q in questions])
+            created_at = datetime.now().isoformat()
+            points = [
+                PointStruct(
+                    id=str(uuid.uuid4()),
+                    vector=vector.tolist(),
+                    payload={
+                        "user_id": user_id,
+                        "file_id": file_id,
+                        "filename": filename,
+                        "topic": question.get("topic"),
+                        "question": question,
+                        "created_at": created_at
+                    }
+                )
+                for question, vector in zip(questions, vectors)
+            ]
+
+            self.init_collection()
+            # Пул файла пересобирается целиком
+            self.delete_for_file(user_id, file_id)
+            with track_stage("qdrant_upsert"):
+                self.client.upsert(collection_name=self.collection_name, points=points)
+
+            logger.info(f"Банк вопросов для файла '{filename}': {len(points)} вопросов")
+            self._set_job(user_id, file_id, status="done", questions=len(points))
+            return len(points)
+
+        except Exception as e:
+            logger.error(f"Ошибка построения банка вопросов для файла {file_id}: {e}")
+            self._set_job(user_id, file_id, status="error", error=str(e))
+            return 0
+        finally:
+            with self._lock:
+                self.pending_jobs -= 1
+
+    def delete_for_file(self, user_id: str, file_id: str):
+        """Удаление вопросов файла из банка"""
+        try:
+            self.client.delete(
+                collection_name=self.collection_name,
+                points_selector=FilterSelector(filter=Filter(must=[
+                    FieldCondition(key="user_id", match=MatchValue(value=user_id)),
+                    FieldCondition(key="file_id", match=MatchValue(value=file_id))
+                ]))
+            )
+        except Exception as e:
+            logger.error(f"Ошибка удаления вопросов файла {file_id} из банка: {e}")
+
+    def sample(self, user_id: str, query: str, count: int,
+               file_ids: Optional[List[str]] = None, oversample: int = 3) -> List[Dict[str, Any]]:
+        """Тест из банка: векторный поиск по запросу и выборка без возвращения.
+
+        Кандидатов берётся в oversample раз больше, чем нужно, и выборка взвешивается по
+        сходству с запросом - так повторные тесты по одной теме получаются разными.
+        """
+        try:
+            if not self.client.collection_exists(self.collection_name):
+                return []
+
+            must = [FieldCondition(key="user_id", match=MatchValue(value=user_id))]
+            if file_ids:
+                must.append(FieldCondition(key="file_id", match=MatchAny(any=file_ids)))
+
+            query_vector = self.db_service._get_embedding(query)
+            with track_stage("qdrant_search"):
+                candidates = self.client.query_points(
+                    collection_name=self.collection_name,
+                    query=query_vector,
+                    query_filter=Filter(must=must),
+                    limit=count * oversample,
+                    with_payload=True,
+                    score_threshold=QUESTION_BANK_MIN_SCORE
+                ).points
+
+            # Взвешенная выборка без возвращения (Efraimidis-Spirakis): ключ u^(1/w)
+            keyed = sorted(
+                candidates,
+                key=lambda point: random.random() ** (1.0 / max(point.score, 1e-6)),
+                reverse=True
+            )
+            # Пулы разных файлов могут пересекаться - одинаковые вопросы отбрасываем
+            selected = QuestionStreamParser()
+            for point in keyed:
+                if len(selected.questions) >= count:
+                    break
+                selected.add(point.payload["question"])
+            return selected.questions
+
+        except Exception as e:
+            logger.error(f"Ошибка выборки из банка вопросов: {e}")
+            return []
+
+
+_service: Optional[QuestionBankService] = None
+_service_lock = threading.Lock()
+
+
+def get_question_bank_service() -> QuestionBankService:
+    """Общий на процесс банк вопросов поверх get_user_db_service()"""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = QuestionBankService(get_user_db_service())
+    return _service
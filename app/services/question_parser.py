@@ -0,0 +1,188 @@
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, ValidationError, field_validator, model_validator
+
+
+class Question(BaseModel):
+    """Вопрос теста в формате хранения: answers - список {"текст ответа": 0|1}"""
+    question: str
+    answers: List[Dict[str, int]]
+    topic: Optional[str] = None
+
+    @field_validator("answers", mode="before")
+    @classmethod
+    def normalize_answers(cls, value: Any) -> Any:
+        """Приводит ответы структурированного режима {"text": ..., "correct": ...} к формату хранения"""
+        if not isinstance(value, list):
+            return value
+        normalized = []
+        for answer in value:
+            if isinstance(answer, dict) and "text" in answer and "correct" in answer:
+                normalized.append({str(answer["text"]): int(bool(answer["correct"]))})
+            else:
+                normalized.append(answer)
+        return normalized
+
+    @model_validator(mode="after")
+    def check_answers(self) -> "Question":
+        if not self.question.strip():
+            raise ValueError("Пустой текст вопроса")
+        if len(self.answers) < 2:
+            raise ValueError("Меньше двух вариантов ответа")
+        if any(len(answer) != 1 for answer in self.answers):
+            raise ValueError("Каждый вариант ответа - ровно одна пара текст: 0|1")
+        correct = sum(value for answer in self.answers for value in answer.values())
+        if correct != 1 or any(value not in (0, 1) for answer in self.answers for value in answer.values()):
+            raise ValueError("Должен быть ровно один правильный ответ")
+        return self
+
+    def to_dict(self) -> Dict[str, Any]:
+        return self.model_dump(exclude_none=True)
+
+
+# JSON-схема для structured output (response_format). Ключи ответов в формате хранения
+# произвольные, поэтому модель отвечает в виде {"text", "correct"}, а Question приводит их к нему.
+QUESTIONS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "test_questions",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "questions": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "question": {"type": "string"},
+                            "topic": {"type": "string"},
+                            "answers": {
+                                "type": "array",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {
+                                        "text": {"type": "string"},
+                                        "correct": {"type": "boolean"}
+                                    },
+                                    "required": ["text", "correct"],
+                                    "additionalProperties": False
+                                }
+                            }
+                        },
+                        "required": ["question", "topic", "answers"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["questions"],
+            "additionalProperties": False
+        }
+    }
+}
+
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+def normalize_question_text(text: str) -> str:
+    """Ключ для сравнения вопросов: без регистра, пунктуации и лишних пробелов"""
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+class QuestionStreamParser:
+    """Инкрементальный разбор вопросов из потока (возможно, обрезанного или с мусором) текста модели.
+
+    Парсер не требует корректного JSON-документа целиком: он отслеживает сбалансированные
+    объекты {...} вне строк и пытается провалидировать каждый закрывшийся объект с ключом
+    "question". Поэтому markdown-ограждения, пояснения модели и обрыв на середине ответа
+    теряют только повреждённые вопросы.
+    """
+
+    def __init__(self):
+        self.questions: List[Dict[str, Any]] = []
+        self._seen = set()
+        self.reset_stream()
+
+    def reset_stream(self):
+        """Начало нового ответа модели: уже найденные вопросы сохраняются для дедупликации"""
+        self.buffer = ""
+        self.rejected = 0
+        self._pos = 0
+        self._stack: List[int] = []
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """Добавляет фрагмент текста, возвращает новые валидные вопросы"""
+        self.buffer += chunk
+        found = []
+
+        while self._pos < len(self.buffer):
+            char = self.buffer[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                # Строки учитываем только внутри объектов: кавычки в пояснениях модели не важны
+                self._in_string = bool(self._stack)
+            elif char == "{":
+                self._stack.append(self._pos)
+            elif char == "}" and self._stack:
+                start = self._stack.pop()
+                question = self._try_question(self.buffer[start:self._pos + 1])
+                if question is not None:
+                    found.append(question)
+            self._pos += 1
+
+        return found
+
+    @property
+    def incomplete(self) -> bool:
+        """Ответ оборван или содержал повреждённые вопросы"""
+        return bool(self._stack) or self.rejected > 0
+
+    def _try_question(self, raw: str) -> Optional[Dict[str, Any]]:
+        if '"question"' not in raw:
+            return None
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            try:
+                data = json.loads(_TRAILING_COMMA.sub(r"\1", raw))
+            except ValueError:
+                self.rejected += 1
+                return None
+
+        # Внешние объекты-обёртки ({"questions": [...]}) пропускаем - их вопросы уже разобраны
+        if not isinstance(data, dict) or "question" not in data:
+            return None
+
+        try:
+            question = Question.model_validate(data).to_dict()
+        except ValidationError:
+            self.rejected += 1
+            return None
+
+        return question if self.add(question) else None
+
+    def add(self, question: Dict[str, Any]) -> bool:
+        """Добавляет уже провалидированный вопрос, если такого ещё нет"""
+        key = normalize_question_text(question["question"])
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        self.questions.append(question)
+        return True
+
+
+def parse_questions(text: str) -> List[Dict[str, Any]]:
+    """Все валидные вопросы из текста ответа модели"""
+    parser = QuestionStreamParser()
+    parser.feed(text)
+    return parser.questions
@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Optional
+
+from app.config import (
+    RERANK_BATCH_SIZE,
+    RERANK_BUDGET_MS,
+    RERANK_CANDIDATES,
+    RERANK_ENABLED,
+    RERANK_MAX_LENGTH,
+    RERANK_MODEL,
+)
+from app.utils.metrics import RERANK_REQUESTS, observe_stage
+
+logger = logging.getLogger(__name__)
+
+
+class CrossEncoderReranker:
+    """Переранжирование кандидатов векторного поиска локальным cross-encoder в пределах бюджета времени"""
+
+    def __init__(self, model_name: str = RERANK_MODEL, enabled: bool = RERANK_ENABLED,
+                 max_candidates: int = RERANK_CANDIDATES, batch_size: int = RERANK_BATCH_SIZE,
+                 max_length: int = RERANK_MAX_LENGTH, budget_ms: float = RERANK_BUDGET_MS):
+        self.model_name = model_name
+        self.enabled = enabled
+        self.max_candidates = max_candidates
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.budget = budget_ms / 1000
+        self._model = None
+        self._lock = threading.Lock()
+        self._loading: Optional[Future] = None
+        # Исходы переранжирования в этом процессе - для /health (метрика считает то же по всем воркерам)
+        self.outcomes: Counter = Counter()
+        # Один поток инференса: модель сама использует все ядра, параллельные вызовы только мешают друг другу
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+
+    def load(self):
+        """Загрузка модели (один раз на процесс)"""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+
+                    self._model = CrossEncoder(self.model_name, max_length=self.max_length)
+                    logger.info(f"Модель переранжирования {self.model_name} загружена")
+        return self._model
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def _count(self, result: str):
+        self.outcomes[result] += 1
+        RERANK_REQUESTS.labels(result).inc()
+
+    def _load_in_background(self):
+        """Холодная модель: загрузка в потоке инференса, без ожидания запросом"""
+        with self._lock:
+            if self._loading is None or (self._loading.done() and self._model is None):
+                logger.warning(f"Модель переранжирования {self.model_name} не прогрета, загружаем в фоне")
+                self._loading = self._executor.submit(self.load)
+                self._loading.add_done_callback(self._log_load_error)
+
+    @staticmethod
+    def _log_load_error(future: Future):
+        if future.exception() is not None:
+            logger.error(f"Не удалось загрузить модель переранжирования: {future.exception()}")
+
+    def _score(self, query: str, texts: List[str], deadline: float) -> Optional[List[float]]:
+        """Оценки пар батчами; None - бюджет кончился раньше (результат уже никто не ждёт)"""
+        model = self.load()
+        scores: List[float] = []
+        for start in range(0, len(texts), self.batch_size):
+            if time.monotonic() > deadline:
+                return None
+            batch = [(query, text) for text in texts[start:start + self.batch_size]]
+            scores.extend(float(score) for score in model.predict(batch, batch_size=len(batch),
+                                                                  show_progress_bar=False))
+        return scores
+
+    def rerank(self, query: str, candidates: List[Dict[str, Any]],
+               text: Callable[[Dict[str, Any]], str] = lambda candidate: candidate["text"]) -> List[Dict[str, Any]]:
+        """Кандидаты по убыванию оценки cross-encoder (rerank_score); при ошибке или превышении бюджета - как были"""
+        if not self.enabled or not query or len(candidates) < 2:
+            return candidates
+
+        if not self.loaded:
+            # Загрузка весов заняла бы весь бюджет: первые запросы до загрузки идут в исходном порядке
+            self._load_in_background()
+            self._count("cold")
+            return candidates
+
+        head, tail = candidates[:self.max_candidates], candidates[self.max_candidates:]
+        started = time.monotonic()
+        deadline = started + self.budget
+        future = self._executor.submit(self._score, query, [text(candidate) for candidate in head], deadline)
+        try:
+            # Жёсткий бюджет: не дождались - отдаём порядок векторного поиска, оставшиеся батчи не считаются
+            scores = future.result(timeout=self.budget)
+        except FutureTimeoutError:
+            scores = None
+        except Exception as e:
+            logger.error(f"Ошибка переранжирования: {e}")
+            self._count("error")
+            return candidates
+        finally:
+            observe_stage("rerank", time.monotonic() - started)
+
+        if scores is None:
+            logger.warning(f"Переранжирование не уложилось в {self.budget * 1000:.0f} мс, исходный порядок")
+            self._count("timeout")
+            return candidates
+
+        self._count("ok")
+        for candidate, score in zip(head, scores):
+            candidate["rerank_score"] = score
+        return sorted(head, key=lambda candidate: candidate["rerank_score"], reverse=True) + tail
+
+
+reranker = CrossEncoderReranker()
@@ -0,0 +1,63 @@
+import json
+import logging
+import zlib
+from typing import Any, Union
+
+from app.config import STATE_FORMAT, STATE_ZSTD_LEVEL
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    logger.info("orjson не установлен, состояние сериализуется стандартным json")
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+    logger.info("zstandard не установлен, состояние сжимается zlib")
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# Первый байт потока zlib ('x'); JSON с него начинаться не может
+ZLIB_MARKER = 0x78
+
+
+def dumps_json(value: Any) -> bytes:
+    """Компактный JSON без отступов (UTF-8 без экранирования кириллицы)"""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads_json(data: Union[bytes, str]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def pack(value: Any, fmt: str = STATE_FORMAT) -> bytes:
+    """Значение состояния в байты: compact - JSON + zstd (или zlib), json - читаемый JSON"""
+    if fmt == "json":
+        return json.dumps(value, ensure_ascii=False, indent=2).encode("utf-8")
+    data = dumps_json(value)
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=STATE_ZSTD_LEVEL).compress(data)
+    return zlib.compress(data, 6)
+
+
+def unpack(data: Union[bytes, str]) -> Any:
+    """Обратно из любого формата: zstd, zlib или JSON (в том числе записанный до сжатия)"""
+    if isinstance(data, str):
+        return loads_json(data)
+    try:
+        if data[:4] == ZSTD_MAGIC:
+            if zstandard is None:
+                raise ValueError("запись сжата zstd, а zstandard не установлен")
+            data = zstandard.ZstdDecompressor().decompress(data)
+        elif data[:1] == bytes([ZLIB_MARKER]):
+            data = zlib.decompress(data)
+    except (zlib.error, getattr(zstandard, "ZstdError", zlib.error)) as e:
+        raise ValueError(f"повреждённые сжатые данные: {e}") from e
+    return loads_json(data)
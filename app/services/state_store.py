@@ -0,0 +1,305 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+from app.config import REDIS_URL, STATE_BACKEND, STATE_DIR, STATE_FORMAT, STATE_PREFIX
+from app.services.serialization import pack, unpack
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка только внутри процесса
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Пространства имён состояния пользователей
+TESTS = "tests"
+RESULTS = "results"
+JOBS = "jobs"
+HISTORY = "history"
+TEST_BODIES = "test_bodies"
+
+# Прежние имена файлов в рабочей папке - чтобы уже сохранённые тесты и результаты оставались доступны
+LEGACY_LAYOUT = {
+    TESTS: "generated_tests_{key}",
+    RESULTS: "last_result_{key}",
+}
+
+# Расширение по формату записи: сжатые данные не лежат под именем .json
+EXTENSIONS = {"json": ".json", "compact": ".zst"}
+
+
+class FileStateStore:
+    """Состояние в JSON-файлах: общее для воркеров на одной машине (или на общем томе)"""
+
+    name = "file"
+
+    def __init__(self, root: str = STATE_DIR, layout: Optional[Dict[str, str]] = None, fmt: str = STATE_FORMAT):
+        self.root = root
+        self.layout = LEGACY_LAYOUT if layout is None else layout
+        self.fmt = fmt
+        # Сначала файл текущего формата, затем записанный в другом (до смены STATE_FORMAT)
+        self.extensions = [EXTENSIONS[fmt]] + [ext for ext in EXTENSIONS.values() if ext != EXTENSIONS[fmt]]
+        self._local_lock = threading.Lock()
+
+    def _template(self, namespace: str) -> str:
+        return self.layout.get(namespace, f"{namespace}/{{key}}")
+
+    def _base(self, namespace: str, key: str) -> str:
+        return os.path.join(self.root, self._template(namespace).format(key=quote(key, safe="-_.@")))
+
+    def location(self, namespace: str, key: str) -> str:
+        return self._base(namespace, key) + self.extensions[0]
+
+    def _existing(self, namespace: str, key: str) -> Optional[str]:
+        base = self._base(namespace, key)
+        for ext in self.extensions:
+            if os.path.exists(base + ext):
+                return base + ext
+        return None
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        base = self._base(namespace, key)
+        for ext in self.extensions:
+            try:
+                with open(base + ext, "rb") as f:
+                    return unpack(f.read())
+            except FileNotFoundError:
+                continue
+            except ValueError:
+                logger.error(f"Повреждённая запись состояния {namespace}/{key}")
+                return None
+        return None
+
+    def put(self, namespace: str, key: str, value: Any):
+        """Атомарная запись: читатели в других процессах видят старую или новую версию целиком"""
+        path = self.location(namespace, key)
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(pack(value, self.fmt))
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        # Запись в другом формате больше не нужна: теперь читается эта
+        self._remove(*[self._base(namespace, key) + ext for ext in self.extensions[1:]])
+
+    @staticmethod
+    def _remove(*paths: str):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def delete(self, namespace: str, key: str):
+        base = self._base(namespace, key)
+        with self._exclusive(namespace, key, unlink=True):
+            self._remove(*[base + ext for ext in self.extensions])
+
+    def version(self, namespace: str, key: str) -> Optional[Tuple[Hashable, float]]:
+        """(версия, время изменения) без чтения самой записи; None - записи нет"""
+        path = self._existing(namespace, key)
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        # Inode меняется при каждой записи (os.replace): новая запись после delete не совпадёт со старой
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size), stat.st_mtime
+
+    def _scan(self, namespace: str, suffixes: List[str]) -> List[str]:
+        template = self._template(namespace)
+        directory = os.path.join(self.root, os.path.dirname(template))
+        prefix, tail = os.path.basename(template).split("{key}")
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        keys = set()
+        for name in names:
+            for suffix in suffixes:
+                suffix = tail + suffix
+                if name.startswith(prefix) and name.endswith(suffix) and len(name) > len(prefix) + len(suffix):
+                    keys.add(unquote(name[len(prefix):len(name) - len(suffix)]))
+        return sorted(keys)
+
+    def keys(self, namespace: str) -> List[str]:
+        return self._scan(namespace, self.extensions)
+
+    @contextmanager
+    def _exclusive(self, namespace: str, key: str, unlink: bool = False):
+        """Блокировка записи между процессами; unlink - удалить файл блокировки вместе с записью"""
+        path = f"{self._base(namespace, key)}.lock"
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._local_lock:
+            if fcntl is None:
+                yield
+                if unlink:
+                    self._remove(path)
+                return
+            while True:
+                with open(path, "a") as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    try:
+                        # Пока ждали, файл блокировки могли удалить: блокировка на старом inode ничего не защищает
+                        try:
+                            current = os.stat(path).st_ino
+                        except FileNotFoundError:
+                            current = None
+                        if current != os.fstat(lock_file.fileno()).st_ino:
+                            continue
+                        yield
+                        if unlink:
+                            self._remove(path)
+                        return
+                    finally:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def prune_locks(self, namespace: str) -> int:
+        """Удаляет файлы блокировок записей, которых уже нет (остались от delete до этой версии и т.п.)"""
+        removed = 0
+        for key in self._scan(namespace, [".lock"]):
+            if self._existing(namespace, key) is None:
+                with self._exclusive(namespace, key):
+                    if self._existing(namespace, key) is not None:
+                        continue
+                    self._remove(f"{self._base(namespace, key)}.lock")
+                removed += 1
+        return removed
+
+    def update(self, namespace: str, key: str, fn: Callable[[Optional[Any]], Optional[Any]]) -> Optional[Any]:
+        """Чтение-изменение-запись под блокировкой; fn возвращает новое значение или None (не менять)"""
+        with self._exclusive(namespace, key):
+            current = self.get(namespace, key)
+            value = fn(current)
+            if value is None:
+                return current
+            self.put(namespace, key, value)
+            return value
+
+    def incr(self, namespace: str, key: str, delta: int = 1) -> int:
+        return self.update(namespace, key, lambda current: int(current or 0) + delta)
+
+
+class RedisStateStore:
+    """Состояние в Redis: общее для воркеров на разных машинах"""
+
+    name = "redis"
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = STATE_PREFIX):
+        self.url = url
+        self.prefix = prefix
+        self._client = None
+        self._client_pid = None
+
+    @property
+    def client(self):
+        # Соединения не переживают fork: в каждом воркере свой клиент
+        if self._client is None or self._client_pid != os.getpid():
+            import redis
+
+            self._client = redis.Redis.from_url(self.url)
+            self._client_pid = os.getpid()
+        return self._client
+
+    def location(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}:{namespace}:{key}"
+
+    def _index(self, namespace: str) -> str:
+        return f"{self.prefix}:{namespace}:_keys"
+
+    def _counter(self, namespace: str, key: str) -> str:
+        # Счётчик версий отдельно от записи: delete его не удаляет, и запись после удаления
+        # не получает снова версию 1, которая уже может лежать в кеше страниц другого воркера
+        return f"{self.prefix}:{namespace}:_version:{key}"
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        data = self.client.hget(self.location(namespace, key), "data")
+        return unpack(data) if data is not None else None
+
+    def _write(self, pipe, namespace: str, key: str, value: Any):
+        location = self.location(namespace, key)
+        pipe.hset(location, mapping={"data": pack(value), "modified_at": time.time()})
+        pipe.incr(self._counter(namespace, key))
+        pipe.sadd(self._index(namespace), key)
+
+    def put(self, namespace: str, key: str, value: Any):
+        pipe = self.client.pipeline()
+        self._write(pipe, namespace, key, value)
+        pipe.execute()
+
+    def delete(self, namespace: str, key: str):
+        pipe = self.client.pipeline()
+        pipe.delete(self.location(namespace, key))
+        pipe.srem(self._index(namespace), key)
+        pipe.execute()
+
+    def version(self, namespace: str, key: str) -> Optional[Tuple[Hashable, float]]:
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hget(self.location(namespace, key), "modified_at")
+        pipe.get(self._counter(namespace, key))
+        modified_at, version = pipe.execute()
+        if modified_at is None:
+            return None
+        return int(version or 0), float(modified_at)
+
+    def keys(self, namespace: str) -> List[str]:
+        return sorted(key.decode() for key in self.client.smembers(self._index(namespace)))
+
+    def prune_locks(self, namespace: str) -> int:
+        # Блокировки в Redis - WATCH, файлов для уборки нет
+        return 0
+
+    def update(self, namespace: str, key: str, fn: Callable[[Optional[Any]], Optional[Any]]) -> Optional[Any]:
+        """Чтение-изменение-запись с оптимистичной блокировкой (WATCH), повтор при конфликте"""
+        import redis
+
+        location = self.location(namespace, key)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(location)
+                    data = pipe.hget(location, "data")
+                    current = unpack(data) if data is not None else None
+                    value = fn(current)
+                    if value is None:
+                        pipe.unwatch()
+                        return current
+                    pipe.multi()
+                    self._write(pipe, namespace, key, value)
+                    pipe.execute()
+                    return value
+                except redis.WatchError:
+                    continue
+
+    def incr(self, namespace: str, key: str, delta: int = 1) -> int:
+        return self.update(namespace, key, lambda current: int(current or 0) + delta)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_state_store():
+    """Общее на процесс хранилище состояния (STATE_BACKEND: file или redis)"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if STATE_BACKEND == "redis":
+                    _store = RedisStateStore()
+                else:
+                    _store = FileStateStore()
+                logger.info(f"Хранилище состояния: {_store.name}")
+    return _store
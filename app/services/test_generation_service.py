@@ -0,0 +1,256 @@
+import contextvars
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+
+import requests
+
+from app.config import (
+    LLM_MAX_TOKENS,
+    STRUCTURED_OUTPUT,
+    TEST_DEFAULT_QUESTIONS,
+    TEST_FANOUT_CONCURRENCY,
+    TEST_FANOUT_QUESTIONS_PER_CALL,
+    TEST_FANOUT_THRESHOLD,
+    TEST_TOPUP_ROUNDS,
+)
+from app.services.model_service import model_stream_request
+from app.services.prompt_service import prompt_builder
+from app.services.question_parser import QUESTIONS_RESPONSE_FORMAT, QuestionStreamParser
+from app.utils.metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+LEGACY_FORMAT = """Формат вопросов в json:
+[
+{
+"question": "Текст вопроса?",
+"topic": "Тема вопроса",
+"answers": [{"Вариант 1": 0}, {"Вариант 2": 1}, {"Вариант 3": 0}, {"Вариант 4": 0}]
+}
+]"""
+
+STRUCTURED_FORMAT = """Формат ответа в json:
+{
+"questions": [
+{
+"question": "Текст вопроса?",
+"topic": "Тема вопроса",
+"answers": [{"text": "Вариант 1", "correct": false}, {"text": "Вариант 2", "correct": true}, {"text": "Вариант 3", "correct": false}, {"text": "Вариант 4", "correct": false}]
+}
+]
+}"""
+
+
+def render_test_prompt(query: str, ctx: str, count: Optional[int] = None,
+                       exclude: Optional[List[str]] = None, focus: Optional[str] = None,
+                       structured: bool = STRUCTURED_OUTPUT) -> str:
+    """Промпт генерации теста"""
+    context_info = f"Используй следующую информацию из файлов пользователя для создания точных и релевантных вопросов:\n\n{ctx}\n\n" if ctx else ""
+    count_rule = f"Вопросов должно быть ровно {count}." if count else "Вопросов должно быть 10, если не сказано иначе."
+    exclude_info = ""
+    if exclude:
+        listed = "\n".join(f"- {question}" for question in exclude)
+        exclude_info = f"\nЭти вопросы уже есть в тесте, НЕ повторяй их и не задавай похожие:\n{listed}\n"
+    if focus:
+        exclude_info += f"\n{focus}\n"
+
+    return f"""
+{context_info}НА ОСНОВЕ ВЫШЕПРИВЕДЕННОЙ ИНФОРМАЦИИ:
+
+{query}
+{exclude_info}
+{STRUCTURED_FORMAT if structured else LEGACY_FORMAT}
+
+ВАЖНО:
+1. Вопросы должны быть конкретными и проверять понимание материала.
+2. Варианты ответов должны быть чёткими и однозначными.
+3. Правильный ответ должен быть точно проверяемым.
+4. {count_rule}
+5. На каждый вопрос должен быть 1 правильный ответ, ни больше, ни меньше.
+6. Если в контексте нет информации по заданной теме, сгенерируй вопросы без контекста.
+7. НЕ ПИШИ "Текст вопроса?" и "Вариант 1" из примера, придумай СВОИ вопросы и ответы.
+8. Помни, что ни изображений, ни примеров из исходных материалов испытуемый не видит.
+9. Тест должен быть на русском языке.
+
+В твоём ответе должен быть только json и ничего более.
+"""
+
+
+def _stream_questions(prompt: str, parser: QuestionStreamParser, structured: bool) -> bool:
+    """Потоковый запрос к модели с разбором вопросов на лету. Возвращает True, если ответ обрезан по длине"""
+    truncated = False
+    parse_seconds = 0.0
+    try:
+        for event in model_stream_request(
+                prompt,
+                max_tokens=LLM_MAX_TOKENS,
+                response_format=QUESTIONS_RESPONSE_FORMAT if structured else None,
+                purpose="tests"
+        ):
+            if "content" in event:
+                started = time.perf_counter()
+                parser.feed(event["content"])
+                parse_seconds += time.perf_counter() - started
+            elif event.get("finish_reason") == "length":
+                truncated = True
+
+    except requests.HTTPError as e:
+        # Провайдер не поддерживает response_format - повторяем в обычном режиме
+        if structured and e.response is not None and e.response.status_code == 400:
+            logger.warning("Structured output не поддерживается моделью, повтор без response_format")
+            return _stream_questions(prompt, parser, structured=False)
+        raise
+
+    except requests.RequestException as e:
+        # Обрыв соединения посреди ответа: уже разобранные вопросы сохраняем, остальные дозапросим
+        if not parser.questions:
+            raise
+        logger.warning(f"Поток ответа модели прерван: {e}")
+        truncated = True
+
+    finally:
+        observe_stage("json_parse", parse_seconds)
+
+    return truncated
+
+
+def generate_questions(query: str, passages: List[Dict[str, Any]], count: Optional[int] = None,
+                       parser: Optional[QuestionStreamParser] = None) -> List[Dict[str, Any]]:
+    """Генерация вопросов теста с дозапросом только недостающих вопросов.
+
+    В parser можно передать уже собранные вопросы - тогда дозапрашиваются только недостающие до count.
+    """
+    target = count or TEST_DEFAULT_QUESTIONS
+    parser = parser or QuestionStreamParser()
+
+    for attempt in range(TEST_TOPUP_ROUNDS + 1):
+        existing = [question["question"] for question in parser.questions]
+        request_count = count if attempt == 0 and not existing else target - len(existing)
+        if request_count is not None and request_count <= 0:
+            break
+
+        prompt = prompt_builder.build(
+            lambda ctx: render_test_prompt(query, ctx, count=request_count, exclude=existing),
+            passages,
+            output_tokens=LLM_MAX_TOKENS
+        )
+        parser.reset_stream()
+        truncated = _stream_questions(prompt, parser, structured=STRUCTURED_OUTPUT)
+
+        if len(parser.questions) >= target:
+            break
+        # Без явного количества дозапрашиваем, только если ответ модели оборван или повреждён
+        if count is None and not (truncated or parser.incomplete):
+            break
+        if attempt < TEST_TOPUP_ROUNDS:
+            logger.info(f"Получено {len(parser.questions)} из {target} вопросов, дозапрашиваем недостающие")
+
+    if not parser.questions:
+        raise RuntimeError("Модель не вернула ни одного корректного вопроса")
+
+    return parser.questions[:count] if count else parser.questions
+
+
+def _partition_passages(passages: List[Dict[str, Any]], parts: int) -> List[List[Dict[str, Any]]]:
+    """Делит контекст на части: по файлам (по кругу в порядке релевантности) или по фрагментам текста"""
+    if not passages:
+        return [[] for _ in range(parts)]
+
+    ranked = sorted(passages, key=lambda p: p.get("score", 0.0), reverse=True)
+    if len(ranked) < parts:
+        # Файлов меньше, чем частей - режем тексты файлов на последовательные фрагменты
+        slices_per_passage = math.ceil(parts / len(ranked))
+        pieces = []
+        for passage in ranked:
+            text = passage["text"]
+            step = max(1, math.ceil(len(text) / slices_per_passage))
+            for index, start in enumerate(range(0, len(text), step)):
+                pieces.append({**passage, "title": f"{passage['title']} (часть {index + 1})",
+                               "text": text[start:start + step]})
+        ranked = pieces
+
+    partitions = [[] for _ in range(min(parts, len(ranked)))]
+    for index, passage in enumerate(ranked):
+        partitions[index % len(partitions)].append(passage)
+    return partitions
+
+
+def _generate_part(query: str, passages: List[Dict[str, Any]], count: int, focus: Optional[str]) -> List[Dict[str, Any]]:
+    """Одна подзадача параллельной генерации: один запрос без дозапросов"""
+    parser = QuestionStreamParser()
+    prompt = prompt_builder.build(
+        lambda ctx: render_test_prompt(query, ctx, count=count, focus=focus),
+        passages,
+        output_tokens=LLM_MAX_TOKENS
+    )
+    _stream_questions(prompt, parser, structured=STRUCTURED_OUTPUT)
+    return parser.questions
+
+
+def generate_questions_fanout(query: str, passages: List[Dict[str, Any]], count: int) -> List[Dict[str, Any]]:
+    """Параллельная генерация большого теста: части по контексту, затем слияние и дедупликация"""
+    parts_count = math.ceil(count / TEST_FANOUT_QUESTIONS_PER_CALL)
+    partitions = _partition_passages(passages, parts_count)
+
+    # Распределяем вопросы между частями как можно равномернее
+    base, extra = divmod(count, len(partitions))
+    tasks = []
+    for index, part_passages in enumerate(partitions):
+        part_count = base + (1 if index < extra else 0)
+        if part_count <= 0:
+            continue
+        focus = None
+        if not part_passages:
+            # Без контекста разводим части по ходу изложения темы, чтобы вопросы меньше пересекались
+            focus = (f"Это часть {index + 1} из {len(partitions)} большого теста: задавай вопросы "
+                     f"преимущественно по {index + 1}-й из {len(partitions)} частей темы в логическом порядке изложения.")
+        tasks.append((part_passages, part_count, focus))
+
+    logger.info(f"Параллельная генерация: {count} вопросов в {len(tasks)} запросах")
+    merged = QuestionStreamParser()
+    results: List[List[Dict[str, Any]]] = [[] for _ in tasks]
+
+    with ThreadPoolExecutor(max_workers=TEST_FANOUT_CONCURRENCY) as pool:
+        # Каждой части - копия контекста, чтобы в логах частей был ID исходного запроса
+        futures = {
+            pool.submit(contextvars.copy_context().run, _generate_part, query, part_passages, part_count, focus): index
+            for index, (part_passages, part_count, focus) in enumerate(tasks)
+        }
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                # Упавшая часть не роняет весь тест - её вопросы будут дозапрошены
+                logger.error(f"Ошибка генерации части теста: {e}")
+
+    # Слияние в порядке частей, чтобы тест шёл по ходу материала
+    for questions in results:
+        for question in questions:
+            merged.add(question)
+
+    if len(merged.questions) < count:
+        return generate_questions(query, passages, count=count, parser=merged)
+    return merged.questions[:count]
+
+
+def generate_test(query: str, passages: List[Dict[str, Any]], count: Optional[int] = None,
+                  mode: str = "auto") -> List[Dict[str, Any]]:
+    """Генерация теста: одним запросом (single) или параллельными частями (fanout)"""
+    use_fanout = mode == "fanout" or (mode == "auto" and count is not None and count > TEST_FANOUT_THRESHOLD)
+    if use_fanout:
+        return generate_questions_fanout(query, passages, count or TEST_DEFAULT_QUESTIONS)
+    return generate_questions(query, passages, count=count)
+
+
+def complete_test(query: str, passages: List[Dict[str, Any]], questions: List[Dict[str, Any]],
+                  count: int) -> List[Dict[str, Any]]:
+    """Дополняет готовые вопросы (например, из банка) живой генерацией до count"""
+    parser = QuestionStreamParser()
+    for question in questions:
+        parser.add(question)
+    if len(parser.questions) >= count:
+        return parser.questions[:count]
+    return generate_questions(query, passages, count=count, parser=parser)
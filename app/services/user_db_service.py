@@ -1,4 +1,5 @@
-from typing import List, Optional, Dict, Any
+import logging
+from typing import List, Optional, Dict, Any, Tuple
 from qdrant_client import QdrantClient
 from qdrant_client.models import *
 import uuid
@@ -6,20 +7,75 @@ import hashlib
 from datetime import datetime
 import requests
 from app.config import *
+from app.services.chunker import chunk_ids, split_chunks
+from app.services.embedding_service import get_embedding_backend
+from app.services.rerank_service import reranker
+from app.utils.metrics import FILE_CHUNKS, track_stage
 import json
+import threading
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[QdrantClient] = None
+_client_pid: Optional[int] = None
+_client_lock = threading.Lock()
+
+
+class _SerializedClient:
+    """Встроенный Qdrant не потокобезопасен - вызовы из пула потоков FastAPI идут по одному"""
+
+    def __init__(self, client: QdrantClient):
+        self._client = client
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+        return call
+
+
+def get_qdrant_client() -> QdrantClient:
+    """Общий на процесс клиент Qdrant (QDRANT_HOST=:memory: - встроенный режим без сервера)"""
+    global _client, _client_pid
+    # После fork воркер создаёт свой клиент: пул соединений родителя не переиспользуем
+    if _client is None or _client_pid != os.getpid():
+        # Прогрев и фоновые пробы обращаются одновременно: второй встроенный клиент был бы пустой базой
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                if QDRANT_HOST == ":memory:":
+                    _client = _SerializedClient(QdrantClient(":memory:"))
+                else:
+                    _client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
+                _client_pid = os.getpid()
+    return _client
 
 
 class UserDBService:
-    def __init__(self, collection_name: str = COLLECTION_NAME):
+    def __init__(self, collection_name: str = COLLECTION_NAME, embedding_backend: Optional[str] = None,
+                 chunk_collection: str = CHUNK_COLLECTION):
         self.collection_name = collection_name
+        self.chunk_collection = chunk_collection
         self.embedding_dimension = 384
-        self.client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
 
-        self.embedding_model = os.getenv("EMBEDDING_MODEL",'all-MiniLM-L6-v2')
+        self.embedding_model = EMBEDDING_MODEL
+        self.embedding_backend = get_embedding_backend(self.embedding_model, embedding_backend)
+        # Процесс, в котором коллекция фрагментов уже проверена (после fork - свой клиент Qdrant)
+        self._chunks_ready_pid: Optional[int] = None
+        self._chunks_lock = threading.Lock()
+
+    @property
+    def client(self) -> QdrantClient:
+        return get_qdrant_client()
 
     def init_collection(self) -> Dict[str, Any]:
         """Инициализация коллекции пользовательских файлов"""
         try:
+            self.ensure_chunk_collection()
             collections = self.client.get_collections().collections
             collection_names = [col.name for col in collections]
 
@@ -39,13 +95,13 @@ class UserDBService:
                     field_schema="keyword"
                 )
 
-                print(f"Коллекция '{self.collection_name}' создана")
+                logger.info(f"Коллекция '{self.collection_name}' создана")
                 return {
                     "success": True,
                     "message": f"Коллекция '{self.collection_name}' создана"
                 }
             else:
-                print(f"Коллекция '{self.collection_name}' уже существует")
+                logger.info(f"Коллекция '{self.collection_name}' уже существует")
                 return {
                     "success": True,
                     "message": f"Коллекция '{self.collection_name}' уже существует"
@@ -53,13 +109,43 @@ class UserDBService:
 
         except Exception as e:
             error_msg = f"Ошибка инициализации коллекции: {e}"
-            print(f"{error_msg}")
+            logger.error(error_msg)
             return {
                 "success": False,
                 "error": str(e),
                 "message": error_msg
             }
 
+    def _init_chunk_collection(self):
+        """Коллекция фрагментов файлов: эмбеддинг каждого фрагмента переиспользуется при повторной загрузке"""
+        if not self.client.collection_exists(self.chunk_collection):
+            self.client.create_collection(
+                collection_name=self.chunk_collection,
+                vectors_config=VectorParams(size=self.embedding_dimension, distance=Distance.COSINE)
+            )
+            for field_name in ("user_id", "file_id"):
+                self.client.create_payload_index(
+                    collection_name=self.chunk_collection,
+                    field_name=field_name,
+                    field_schema="keyword"
+                )
+            logger.info(f"Коллекция '{self.chunk_collection}' создана")
+
+    def ensure_chunk_collection(self):
+        """Коллекция фрагментов создаётся при первом обращении: в развёртываниях до её появления /db/init уже не вызывают"""
+        if self._chunks_ready_pid == os.getpid():
+            return
+        with self._chunks_lock:
+            if self._chunks_ready_pid == os.getpid():
+                return
+            try:
+                self._init_chunk_collection()
+            except Exception:
+                # Коллекцию одновременно мог создать другой воркер
+                if not self.client.collection_exists(self.chunk_collection):
+                    raise
+            self._chunks_ready_pid = os.getpid()
+
     def _generate_file_hash(self, file_content: bytes) -> str:
         """Генерация хеша файла"""
         return hashlib.md5(file_content).hexdigest()
@@ -67,16 +153,15 @@ class UserDBService:
     def _get_embedding(self, text: str) -> List[float]:
         """Получение эмбеддинга для текста"""
         try:
-            from sentence_transformers import SentenceTransformer
-
-            embedding = SentenceTransformer(self.embedding_model).encode(text)
+            embedding = self.embedding_backend.encode([text])[0]
             return embedding.tolist()
 
         except Exception as e:
-            print(f"Ошибка получения эмбеддинга: {e}")
+            logger.error(f"Ошибка получения эмбеддинга: {e}")
             # Возвращаем нулевой вектор в случае ошибки
             return [0.0] * self.embedding_dimension
 
+    @track_stage("extraction")
     def _extract_text_from_file(self, file_content: bytes, filename: str) -> str:
         """Извлечение текста из файла в зависимости от типа"""
         file_ext = filename.split('.')[-1].lower() if '.' in filename else ""
@@ -102,7 +187,7 @@ class UserDBService:
                         text += page.extract_text() + "\n"
                     return text
                 except ImportError:
-                    print("PyPDF2 не установлен, невозможно прочитать PDF")
+                    logger.warning("PyPDF2 не установлен, невозможно прочитать PDF")
                     return f"[PDF файл: {filename}]"
 
             # Word документы
@@ -118,7 +203,7 @@ class UserDBService:
                         text += paragraph.text + "\n"
                     return text
                 except ImportError:
-                    print("python-docx не установлен, невозможно прочитать DOCX")
+                    logger.warning("python-docx не установлен, невозможно прочитать DOCX")
                     return f"[Word документ: {filename}]"
 
             # Excel файлы
@@ -137,7 +222,7 @@ class UserDBService:
                         text += df.to_string(index=False) + "\n\n"
                     return text
                 except ImportError:
-                    print("pandas не установлен, невозможно прочитать Excel")
+                    logger.warning("pandas не установлен, невозможно прочитать Excel")
                     return f"[Excel файл: {filename}]"
 
             # JSON файлы
@@ -153,108 +238,210 @@ class UserDBService:
                 return f"[Файл: {filename}, размер: {len(file_content)} байт]"
 
         except Exception as e:
-            print(f"Ошибка извлечения текста из файла {filename}: {e}")
+            logger.error(f"Ошибка извлечения текста из файла {filename}: {e}")
             return f"[Не удалось извлечь текст из файла: {filename}]"
 
-    def _content_to_vector(self, content: bytes, filename: str) -> List[float]:
-        """Конвертация содержимого файла в вектор через эмбеддинги"""
+    def _fit_dimension(self, vector: List[float]) -> List[float]:
+        """Приведение эмбеддинга к размерности коллекции"""
+        if len(vector) != self.embedding_dimension:
+            logger.warning(
+                f"Размерность эмбеддинга ({len(vector)}) не совпадает с ожидаемой ({self.embedding_dimension})")
+            # Обрезаем или дополняем до нужной размерности
+            if len(vector) > self.embedding_dimension:
+                return vector[:self.embedding_dimension]
+            return vector + [0.0] * (self.embedding_dimension - len(vector))
+        return vector
+
+    def _sync_chunks(self, user_id: str, file_id: str, filename: str, text: str,
+                     previous_hashes: List[str]) -> Tuple[List[str], Dict[str, int]]:
+        """Эмбеддинги только новых фрагментов, удаление исчезнувших"""
+        chunks = split_chunks(text)
+        hashes = [chunk.hash for chunk in chunks]
+        ids = chunk_ids(file_id, hashes)
+        previous_ids = set(chunk_ids(file_id, previous_hashes))
+        self.ensure_chunk_collection()
+
+        stored = set()
+        kept = sorted(set(ids) & previous_ids)
+        if kept:
+            with track_stage("qdrant_retrieve"):
+                for point in self.client.retrieve(collection_name=self.chunk_collection, ids=kept):
+                    stored.add(str(point.id))
+
+        # Фрагменты без сохранённой точки (новые или потерянные) считаем одним батчем
+        missing = [(point_id, chunk) for point_id, chunk in zip(ids, chunks) if point_id not in stored]
+        if missing:
+            try:
+                embeddings = self.embedding_backend.encode([chunk.text for _, chunk in missing])
+            except Exception as e:
+                logger.error(f"Ошибка получения эмбеддингов фрагментов: {e}")
+                raise
+            points = []
+            for (point_id, chunk), embedding in zip(missing, embeddings):
+                points.append(PointStruct(
+                    id=point_id,
+                    vector=self._fit_dimension(embedding.tolist()),
+                    payload={"user_id": user_id, "file_id": file_id, "filename": filename,
+                             "chunk_hash": chunk.hash, "text": chunk.text}
+                ))
+            with track_stage("qdrant_upsert"):
+                self.client.upsert(collection_name=self.chunk_collection, points=points)
+
+        removed = sorted(previous_ids - set(ids))
+        if removed:
+            with track_stage("qdrant_delete"):
+                self.client.delete(collection_name=self.chunk_collection, points_selector=PointIdsList(points=removed))
+
+        stats = {"embedded": len(missing), "reused": len(set(ids)) - len(missing), "deleted": len(removed)}
+        for result, count in stats.items():
+            FILE_CHUNKS.labels(result).inc(count)
+
+        return hashes, stats
+
+    def _file_vector(self, text: str) -> List[float]:
+        """Вектор файла целиком: эмбеддинг начала и конца текста (по нему настроен порог search_files)"""
+        # Ограничиваем длину текста для эмбеддинга (модели имеют ограничения)
+        max_text_length = 8000
+        if len(text) > max_text_length:
+            # Используем стратегию: первые N символов + последние N символов
+            text = text[:max_text_length // 2] + "\n\n[продолжение...]\n\n" + text[-max_text_length // 2:]
+        return self._fit_dimension(self._get_embedding(text))
+
+    def _delete_chunks(self, file_ids: List[str]):
+        """Удаление всех фрагментов файлов одним запросом (нет коллекции фрагментов - нечего удалять)"""
         try:
-            # Извлекаем текст из файла
-            text = self._extract_text_from_file(content, filename)
-
-            # Ограничиваем длину текста для эмбеддинга (модели имеют ограничения)
-            max_text_length = 8000  # Максимальная длина для большинства моделей эмбеддингов
-
-            if len(text) > max_text_length:
-                # Используем стратегию: первые N символов + последние N символов
-                first_part = text[:max_text_length // 2]
-                last_part = text[-max_text_length // 2:] if len(text) > max_text_length // 2 else ""
-                text = first_part + "\n\n[продолжение...]\n\n" + last_part
-
-            # Получаем эмбеддинг
-            embedding = self._get_embedding(text)
-
-            # Проверяем размерность
-            if len(embedding) != self.embedding_dimension:
-                print(
-                    f"Размерность эмбеддинга ({len(embedding)}) не совпадает с ожидаемой ({self.embedding_dimension})")
-                # Нормализуем или дополняем до нужной размерности
-                if len(embedding) > self.embedding_dimension:
-                    embedding = embedding[:self.embedding_dimension]
-                else:
-                    embedding = embedding + [0.0] * (self.embedding_dimension - len(embedding))
-
-            return embedding
-
-        except Exception as e:
-            print(f"Ошибка создания вектора из файла {filename}: {e}")
-            return [0.0] * self.embedding_dimension
+            with track_stage("qdrant_delete"):
+                self.client.delete(
+                    collection_name=self.chunk_collection,
+                    points_selector=FilterSelector(filter=Filter(must=[
+                        FieldCondition(key="file_id", match=MatchAny(any=file_ids))
+                    ]))
+                )
+        except Exception:
+            if self.client.collection_exists(self.chunk_collection):
+                raise
+
+    def _find_by_filename(self, user_id: str, filename: str) -> List[Any]:
+        """Все версии файла пользователя с таким именем (с прежних загрузок могли остаться дубликаты)"""
+        with track_stage("qdrant_scroll"):
+            points, _ = self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=Filter(must=[
+                    FieldCondition(key="user_id", match=MatchValue(value=user_id)),
+                    FieldCondition(key="filename", match=MatchValue(value=filename))
+                ]),
+                limit=100,
+                with_payload=True,
+                with_vectors=False
+            )
+        return points
 
     def add_file(self, user_id: str, file_content: bytes, filename: str,
                  file_metadata: Dict[str, Any] = None) -> str:
         """Добавление файла в базу данных"""
+        return self.upsert_file(user_id, file_content, filename, file_metadata, replace=False)["file_id"]
+
+    def upsert_file(self, user_id: str, file_content: bytes, filename: str,
+                    file_metadata: Dict[str, Any] = None, replace: bool = True) -> Dict[str, Any]:
+        """Загрузка файла; при replace - замена файла с тем же именем с пересчётом только изменённых фрагментов"""
         try:
-            # Создаем вектор из содержимого файла
-            vector = self._content_to_vector(file_content, filename)
             file_hash = self._generate_file_hash(file_content)
-            point_id = str(uuid.uuid4())
-
-            # Подготовка payload
-            payload = {
-                "user_id": user_id,
-                "filename": filename,
-                "file_hash": file_hash,
-                "file_size": len(file_content),
-                "uploaded_at": datetime.now().isoformat(),
-                "file_type": filename.split('.')[-1] if '.' in filename else "unknown"
+
+            existing = self._find_by_filename(user_id, filename) if replace else []
+            # Заменяем последнюю загрузку, остальные версии - устаревшие дубликаты
+            existing.sort(key=lambda point: point.payload.get("uploaded_at", ""))
+            target = existing[-1] if existing else None
+            duplicates = [str(point.id) for point in existing[:-1]]
+            point_id = str(target.id) if target else str(uuid.uuid4())
+            uploaded_at = datetime.now().isoformat()
+
+            result = {
+                "file_id": point_id,
+                "replaced": target is not None,
+                "changed": True,
+                "chunks": {"embedded": 0, "reused": 0, "deleted": 0},
+                "removed_duplicates": duplicates
             }
 
-            print("file_metadata:", file_metadata)
+            if target is not None and target.payload.get("file_hash") == file_hash \
+                    and "chunk_hashes" in target.payload:
+                # Содержимое не изменилось: обновляем только метаданные
+                with track_stage("qdrant_upsert"):
+                    self.client.set_payload(
+                        collection_name=self.collection_name,
+                        payload={**(file_metadata or {}), "uploaded_at": uploaded_at},
+                        points=[point_id]
+                    )
+                result["changed"] = False
+                result["chunks"]["reused"] = len(set(target.payload["chunk_hashes"]))
+            else:
+                # Текст извлекаем один раз: для фрагментов и для превью
+                text_content = self._extract_text_from_file(file_content, filename)
+                previous_hashes = target.payload.get("chunk_hashes", []) if target else []
+                chunk_hashes, result["chunks"] = self._sync_chunks(
+                    user_id, point_id, filename, text_content, previous_hashes
+                )
+                vector = self._file_vector(text_content)
+
+                # Подготовка payload
+                payload = {
+                    "user_id": user_id,
+                    "filename": filename,
+                    "file_hash": file_hash,
+                    "file_size": len(file_content),
+                    "uploaded_at": uploaded_at,
+                    "file_type": filename.split('.')[-1] if '.' in filename else "unknown"
+                }
 
-            if file_metadata:
-                payload.update(file_metadata)
+                logger.debug(f"file_metadata: {file_metadata}")
 
-            # Извлекаем текст для превью
-            try:
-                text_content = self._extract_text_from_file(file_content, filename)
-                # Сохраняем превью (первые 5000 символов)
+                if file_metadata:
+                    payload.update(file_metadata)
+
+                # Сохраняем превью (первые 5000 символов) и размер текста
                 if len(text_content) > 5000:
-                    content_preview = text_content[:5000] + "... [обрезано]"
+                    payload["content_preview"] = text_content[:5000] + "... [обрезано]"
                 else:
-                    content_preview = text_content
-                payload["content_preview"] = content_preview
-
-                # Также сохраняем размер текста
+                    payload["content_preview"] = text_content
                 payload["text_length"] = len(text_content)
-            except Exception as e:
-                print(f"Ошибка извлечения текста для превью: {e}")
-                payload["content_preview"] = f"[Не удалось извлечь текст из файла: {filename}]"
-
-            # Создание точки
-            point = PointStruct(
-                id=point_id,
-                vector=vector,
-                payload=payload
-            )
+                payload["chunk_hashes"] = chunk_hashes
 
-            # Сохранение в Qdrant
-            self.client.upsert(
-                collection_name=self.collection_name,
-                points=[point]
-            )
+                # Создание точки
+                point = PointStruct(
+                    id=point_id,
+                    vector=vector,
+                    payload=payload
+                )
+
+                # Сохранение в Qdrant
+                with track_stage("qdrant_upsert"):
+                    self.client.upsert(
+                        collection_name=self.collection_name,
+                        points=[point]
+                    )
+
+            if duplicates:
+                with track_stage("qdrant_delete"):
+                    self.client.delete(
+                        collection_name=self.collection_name,
+                        points_selector=PointIdsList(points=duplicates)
+                    )
+                self._delete_chunks(duplicates)
 
-            print(f"Файл '{filename}' добавлен для пользователя {user_id}, ID: {point_id}")
-            return point_id
+            action = "обновлён" if target is not None else "добавлен"
+            logger.info(f"Файл '{filename}' {action} для пользователя {user_id}, ID: {point_id}, "
+                        f"фрагменты: {result['chunks']}")
+            return result
 
         except Exception as e:
-            print(f"Ошибка добавления файла: {e}")
+            logger.error(f"Ошибка добавления файла: {e}")
             raise
 
     def search_files(self, user_id: str, query_text: Optional[str] = None,
                      query_vector: Optional[List[float]] = None,
                      filters: Optional[Dict[str, Any]] = None,
-                     limit: int = 10) -> List[Dict]:
-        """Поиск файлов по семантическому сходству"""
+                     limit: int = 10, rerank: bool = False) -> List[Dict]:
+        """Поиск файлов по семантическому сходству (rerank - второй этап cross-encoder по тексту файла)"""
         try:
             # Подготовка условий фильтрации
             must_conditions = [
@@ -272,24 +459,28 @@ class UserDBService:
             if query_vector is None and query_text:
                 # Получаем эмбеддинг для поискового запроса
                 query_vector = self._get_embedding(query_text)
-                print(f"Поиск по запросу: '{query_text}'")
+                logger.info(f"Поиск по запросу: '{query_text}'")
 
             if query_vector is None or len(query_vector) != self.embedding_dimension:
-                print("Вектор запроса пуст или неверной размерности, используем нулевой вектор")
+                logger.warning("Вектор запроса пуст или неверной размерности, используем нулевой вектор")
                 query_vector = [0.0] * self.embedding_dimension
 
+            # Для переранжирования берём больше кандидатов, чем нужно вернуть
+            rerank = rerank and bool(query_text) and reranker.enabled
+
             # Выполнение поиска
-            results = self.client.search(
-                collection_name=self.collection_name,
-                query_vector=query_vector,
-                query_filter=Filter(must=must_conditions) if must_conditions else None,
-                limit=limit,
-                with_payload=True,
-                score_threshold=0.3  # Минимальный порог сходства
-            )
+            with track_stage("qdrant_search"):
+                results = self.client.query_points(
+                    collection_name=self.collection_name,
+                    query=query_vector,
+                    query_filter=Filter(must=must_conditions) if must_conditions else None,
+                    limit=max(limit, reranker.max_candidates) if rerank else limit,
+                    with_payload=True,
+                    score_threshold=0.3  # Минимальный порог сходства
+                ).points
 
             # Форматирование результатов
-            return [
+            found = [
                 {
                     "id": result.id,
                     "score": result.score,
@@ -297,23 +488,118 @@ class UserDBService:
                 }
                 for result in results
             ]
+            if rerank:
+                found = reranker.rerank(query_text, found, text=lambda hit: hit["payload"].get("content_preview", ""))
+            return found[:limit]
 
         except Exception as e:
-            print(f"Ошибка поиска: {e}")
+            logger.error(f"Ошибка поиска: {e}")
             return []
 
+    def search_chunks(self, user_id: str, query_text: str, limit: int = 10,
+                      query_vector: Optional[List[float]] = None) -> List[Dict]:
+        """Поиск фрагментов файлов пользователя: payload содержит file_id, filename и text"""
+        try:
+            self.ensure_chunk_collection()
+            if query_vector is None:
+                query_vector = self._get_embedding(query_text)
+            with track_stage("qdrant_search"):
+                results = self.client.query_points(
+                    collection_name=self.chunk_collection,
+                    query=query_vector,
+                    query_filter=Filter(must=[FieldCondition(key="user_id", match=MatchValue(value=user_id))]),
+                    limit=limit,
+                    with_payload=True
+                ).points
+            return [{"id": result.id, "score": result.score, "payload": result.payload} for result in results]
+
+        except Exception as e:
+            logger.error(f"Ошибка поиска фрагментов: {e}")
+            return []
+
+    def search_batch(self, user_id: str, queries: List[str], limit: int = 10,
+                     filters: Optional[Dict[str, Any]] = None, chunks: bool = False,
+                     group_by: Optional[str] = None, group_size: int = 1) -> List[List[Dict]]:
+        """Несколько запросов за раз: эмбеддинги одним батчем, поиск одним запросом к Qdrant.
+
+        chunks - искать по фрагментам файлов; group_by - поле payload (например, file_id),
+        по значению которого в результат попадает не больше group_size точек.
+        """
+        try:
+            must_conditions = [FieldCondition(key="user_id", match=MatchValue(value=user_id))]
+            for key, value in (filters or {}).items():
+                must_conditions.append(FieldCondition(key=key, match=MatchValue(value=value)))
+            query_filter = Filter(must=must_conditions)
+
+            indexes = [index for index, query in enumerate(queries) if query]
+            if not indexes:
+                return [[] for _ in queries]
+            if chunks:
+                self.ensure_chunk_collection()
+            vectors = self.embedding_backend.encode([queries[index] for index in indexes])
+
+            # При группировке берём кандидатов с запасом: часть отсеется как повторы из того же файла.
+            # Если один файл забрал почти всю страницу, дочитываем следующую (вдвое больше) только
+            # для недобравших запросов - пока не наберётся limit или не кончатся кандидаты
+            page = limit * 4 if group_by else limit
+            vectors = {index: self._fit_dimension(vector.tolist()) for index, vector in zip(indexes, vectors)}
+            results: List[List[Dict]] = [[] for _ in queries]
+            taken: Dict[int, Dict[Any, int]] = {index: {} for index in indexes}
+            offset = 0
+            pending = indexes
+            while pending:
+                requests = [
+                    QueryRequest(
+                        query=vectors[index],
+                        filter=query_filter,
+                        limit=page,
+                        offset=offset,
+                        with_payload=True,
+                        score_threshold=None if chunks else 0.3
+                    )
+                    for index in pending
+                ]
+                with track_stage("qdrant_search"):
+                    responses = self.client.query_batch_points(
+                        collection_name=self.chunk_collection if chunks else self.collection_name,
+                        requests=requests
+                    )
+
+                unfinished = []
+                for index, response in zip(pending, responses):
+                    for point in response.points:
+                        if group_by:
+                            group = point.payload.get(group_by, point.id)
+                            if taken[index].get(group, 0) >= group_size:
+                                continue
+                            taken[index][group] = taken[index].get(group, 0) + 1
+                        results[index].append({"id": point.id, "score": point.score, "payload": point.payload})
+                        if len(results[index]) >= limit:
+                            break
+                    if group_by and len(results[index]) < limit and len(response.points) == page:
+                        unfinished.append(index)
+                offset += page
+                page *= 2
+                pending = unfinished
+            return results
+
+        except Exception as e:
+            logger.error(f"Ошибка пакетного поиска: {e}")
+            raise
+
     def get_user_files(self, user_id: str, limit: int = 100) -> List[Dict]:
         """Получение всех файлов пользователя"""
         try:
-            results = self.client.scroll(
-                collection_name=self.collection_name,
-                scroll_filter=Filter(
-                    must=[FieldCondition(key="user_id", match=MatchValue(value=user_id))]
-                ) if user_id else None,
-                limit=limit,
-                with_payload=True,
-                with_vectors=False
-            )
+            with track_stage("qdrant_scroll"):
+                results = self.client.scroll(
+                    collection_name=self.collection_name,
+                    scroll_filter=Filter(
+                        must=[FieldCondition(key="user_id", match=MatchValue(value=user_id))]
+                    ) if user_id else None,
+                    limit=limit,
+                    with_payload=True,
+                    with_vectors=False
+                )
 
             return [
                 {
@@ -324,7 +610,7 @@ class UserDBService:
             ]
 
         except Exception as e:
-            print(f"Ошибка получения файлов пользователя: {e}")
+            logger.error(f"Ошибка получения файлов пользователя: {e}")
             return []
 
     def update_file_metadata(self, user_id: str, file_id: str,
@@ -332,11 +618,12 @@ class UserDBService:
         """Обновление метаданных файла"""
         try:
             # Получение текущей точки
-            points = self.client.retrieve(
-                collection_name=self.collection_name,
-                ids=[file_id],
-                with_vectors=True
-            )
+            with track_stage("qdrant_retrieve"):
+                points = self.client.retrieve(
+                    collection_name=self.collection_name,
+                    ids=[file_id],
+                    with_vectors=True
+                )
 
             if not points:
                 return False
@@ -356,48 +643,53 @@ class UserDBService:
                 payload=updated_payload
             )
 
-            self.client.upsert(
-                collection_name=self.collection_name,
-                points=[updated_point]
-            )
+            with track_stage("qdrant_upsert"):
+                self.client.upsert(
+                    collection_name=self.collection_name,
+                    points=[updated_point]
+                )
 
-            print(f"Метаданные файла {file_id} обновлены")
+            logger.info(f"Метаданные файла {file_id} обновлены")
             return True
 
         except Exception as e:
-            print(f"Ошибка обновления файла: {e}")
+            logger.error(f"Ошибка обновления файла: {e}")
             return False
 
     def delete_file(self, user_id: str, file_id: str) -> bool:
         """Удаление файла"""
         try:
             # Проверка существования и принадлежности
-            points = self.client.retrieve(
-                collection_name=self.collection_name,
-                ids=[file_id]
-            )
-
-            if points and points[0].payload.get("user_id") == user_id:
-                self.client.delete(
+            with track_stage("qdrant_retrieve"):
+                points = self.client.retrieve(
                     collection_name=self.collection_name,
-                    points_selector=PointIdsList(points=[file_id])
+                    ids=[file_id]
                 )
-                print(f"Файл {file_id} удален")
+
+            if points and points[0].payload.get("user_id") == user_id:
+                with track_stage("qdrant_delete"):
+                    self.client.delete(
+                        collection_name=self.collection_name,
+                        points_selector=PointIdsList(points=[file_id])
+                    )
+                self._delete_chunks([file_id])
+                logger.info(f"Файл {file_id} удален")
                 return True
             return False
 
         except Exception as e:
-            print(f"Ошибка удаления файла: {e}")
+            logger.error(f"Ошибка удаления файла: {e}")
             return False
 
     def get_file_by_id(self, user_id: str, file_id: str) -> Optional[Dict]:
         """Получение информации о конкретном файле"""
         try:
-            points = self.client.retrieve(
-                collection_name=self.collection_name,
-                ids=[file_id],
-                with_payload=True
-            )
+            with track_stage("qdrant_retrieve"):
+                points = self.client.retrieve(
+                    collection_name=self.collection_name,
+                    ids=[file_id],
+                    with_payload=True
+                )
 
             if points and points[0].payload.get("user_id") == user_id:
                 return {
@@ -407,5 +699,32 @@ class UserDBService:
             return None
 
         except Exception as e:
-            print(f"Ошибка получения файла: {e}")
-            return None
\ No newline at end of file
+            logger.error(f"Ошибка получения файла: {e}")
+            return None
+
+    def get_file_chunks(self, user_id: str, file_id: str) -> List[Dict]:
+        """Все фрагменты файла в порядке текста: [{"id", "index", "text"}]"""
+        file_data = self.get_file_by_id(user_id, file_id)
+        if not file_data or not file_data["payload"].get("chunk_hashes"):
+            return []
+        self.ensure_chunk_collection()
+        ids = chunk_ids(file_id, file_data["payload"]["chunk_hashes"])
+        with track_stage("qdrant_retrieve"):
+            points = {str(point.id): point for point in self.client.retrieve(
+                collection_name=self.chunk_collection, ids=ids, with_payload=True)}
+        return [{"id": point_id, "index": index, "text": points[point_id].payload["text"]}
+                for index, point_id in enumerate(ids) if point_id in points]
+
+
+_service: Optional[UserDBService] = None
+_service_lock = threading.Lock()
+
+
+def get_user_db_service() -> UserDBService:
+    """Общий на процесс сервис файлов пользователей; создаётся при первом обращении, а не при импорте"""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = UserDBService()
+    return _service
@@ -0,0 +1,152 @@
+import importlib
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from app.services.embedding_service import preload_embeddings
+from app.services.model_service import get_http_session
+from app.services.prompt_service import token_counter
+from app.services.question_bank_service import get_question_bank_service
+from app.services.rerank_service import reranker
+from app.services.state_store import TESTS, get_state_store
+from app.services.user_db_service import get_qdrant_client, get_user_db_service
+from app.utils.html_generator import templates
+from app.utils.metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+# Библиотеки извлечения текста, которые иначе импортируются на первой загрузке файла
+EXTRACTOR_MODULES = ["PyPDF2", "docx", "pandas"]
+
+
+class Readiness:
+    """Состояние прогрева процесса: какие шаги готовы к первому запросу"""
+
+    def __init__(self):
+        self.enabled = True
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.steps: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            self.started_at = time.time()
+            self.finished_at = None
+            self.steps = {}
+
+    def record(self, name: str, required: bool, seconds: float, error: Optional[str] = None):
+        with self._lock:
+            self.steps[name] = {
+                "ok": error is None,
+                "required": required,
+                "seconds": round(seconds, 3),
+                **({"error": error} if error else {}),
+            }
+
+    def finish(self):
+        with self._lock:
+            self.finished_at = time.time()
+
+    def disable(self):
+        """Прогрев выключен: процесс готов сразу, модели загрузятся на первом запросе"""
+        with self._lock:
+            self.enabled = False
+            self.started_at = self.finished_at = time.time()
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            return self.finished_at is not None and all(
+                step["ok"] for step in self.steps.values() if step["required"]
+            )
+
+    def snapshot(self) -> Dict[str, Any]:
+        ready = self.ready
+        with self._lock:
+            return {
+                "ready": ready,
+                "warmup": "disabled" if not self.enabled else ("done" if self.finished_at else "running"),
+                "seconds": round((self.finished_at or time.time()) - self.started_at, 3) if self.started_at else None,
+                "steps": dict(self.steps),
+            }
+
+
+readiness = Readiness()
+
+
+def _step(name: str, fn: Callable[[], Any], required: bool = True):
+    started = time.perf_counter()
+    error = None
+    try:
+        fn()
+    except Exception as e:
+        error = str(e) or type(e).__name__
+        log = logger.error if required else logger.warning
+        log(f"Прогрев: шаг {name} не выполнен: {error}")
+    seconds = time.perf_counter() - started
+    observe_stage(f"warmup_{name}", seconds)
+    readiness.record(name, required, seconds, error)
+
+
+def _import_extractors():
+    missing = []
+    for module in EXTRACTOR_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            missing.append(module)
+    if missing:
+        # Не критично: без библиотеки файл этого типа просто не разбирается
+        raise RuntimeError(f"не установлены: {', '.join(missing)}")
+
+
+def _warm_embeddings():
+    backend = get_user_db_service().embedding_backend
+    backend.load()
+    # Первый инференс выделяет буферы и компилирует графы - делаем его до трафика
+    backend.encode(["warm up"])
+
+
+def _warm_reranker():
+    reranker.load().predict([("warm up", "warm up")], show_progress_bar=False)
+
+
+def _import_extractors_quietly():
+    try:
+        _import_extractors()
+    except RuntimeError as e:
+        logger.info(f"Библиотеки извлечения текста {e}")
+
+
+def preload_before_fork():
+    """Мастер gunicorn до fork: импорты и веса модели, которые воркеры получат через copy-on-write"""
+    _import_extractors_quietly()
+    get_question_bank_service()
+    preload_embeddings()
+
+
+def warm_up():
+    """Прогрев процесса до приёма трафика: модель, пулы соединений, тяжёлые импорты"""
+    readiness.start()
+    started = time.perf_counter()
+    _step("imports", _import_extractors, required=False)
+    _step("tokenizer", lambda: token_counter.count("warm up"), required=False)
+    _step("templates", lambda: templates.get_template("test_template.html"), required=False)
+    _step("embedding", _warm_embeddings)
+    if reranker.enabled:
+        _step("reranker", _warm_reranker, required=False)
+    _step("qdrant", lambda: get_qdrant_client().get_collections())
+    _step("state", lambda: get_state_store().keys(TESTS))
+    _step("llm_pool", get_http_session, required=False)
+    get_question_bank_service()
+    readiness.finish()
+    logger.info(f"Прогрев завершён за {time.perf_counter() - started:.2f} с, готовность: {readiness.ready}")
+
+
+def start_warm_up() -> threading.Thread:
+    """Прогрев в фоне: порт открывается сразу, /ready отвечает 503 до окончания"""
+    thread = threading.Thread(target=warm_up, name="warmup", daemon=True)
+    thread.start()
+    return thread
@@ -1,7 +1,10 @@
+import os
+
 from fastapi.templating import Jinja2Templates
 from fastapi import Request
 
-templates = Jinja2Templates(directory="app/templates")
+# Путь от модуля, а не от текущей папки: приложение можно запускать из любой
+templates = Jinja2Templates(directory=os.path.join(os.path.dirname(os.path.dirname(__file__)), "templates"))
 
 def render_test_page(request: Request, json_data, user_id: str = None):
     return templates.TemplateResponse(
@@ -11,4 +14,9 @@ def render_test_page(request: Request, json_data, user_id: str = None):
             "questions": json_data,
             "user_id": user_id
         }
-    )
\ No newline at end of file
+    )
+
+
+def render_test_html(json_data, user_id: str = None) -> str:
+    """HTML страницы теста без объекта запроса - для кеша отрендеренных страниц"""
+    return templates.get_template("test_template.html").render(questions=json_data, user_id=user_id)
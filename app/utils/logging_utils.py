@@ -0,0 +1,54 @@
+import json
+import logging
+import uuid
+from contextvars import ContextVar
+from typing import Optional
+
+from app.config import LOG_FORMAT, LOG_LEVEL
+
+# ID текущего HTTP-запроса: выставляется middleware и попадает в каждую строку лога
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+
+def new_request_id(incoming: Optional[str] = None) -> str:
+    """ID запроса: из заголовка X-Request-ID балансировщика или новый"""
+    return incoming[:64] if incoming else uuid.uuid4().hex[:16]
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись лога"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+def setup_logging():
+    """Настройка логирования приложения (вызывается один раз при старте)"""
+    handler = logging.StreamHandler()
+    handler.addFilter(RequestIdFilter())
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(
+            "%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"
+        ))
+
+    logger = logging.getLogger("app")
+    logger.handlers = [handler]
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
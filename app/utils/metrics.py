@@ -0,0 +1,98 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+from app.config import OTEL_ENABLED
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм: от быстрых операций Qdrant до долгих ответов модели
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+REQUEST_LATENCY = Histogram(
+    "examiner_request_seconds", "Время обработки HTTP-запроса",
+    ["method", "endpoint", "status"], buckets=LATENCY_BUCKETS
+)
+STAGE_LATENCY = Histogram(
+    "examiner_stage_seconds", "Время этапа обработки",
+    ["stage"], buckets=LATENCY_BUCKETS
+)
+LLM_TOKENS = Counter("examiner_llm_tokens_total", "Токены LLM по данным провайдера", ["kind"])
+ERRORS = Counter("examiner_errors_total", "Ошибки по этапам", ["stage"])
+CACHE_REQUESTS = Counter("examiner_cache_requests_total", "Обращения к кешам", ["cache", "result"])
+LLM_BACKEND_REQUESTS = Counter(
+    "examiner_llm_backend_requests_total", "Запросы к бэкендам LLM", ["backend", "result"]
+)
+FILE_CHUNKS = Counter(
+    "examiner_file_chunks_total", "Фрагменты файлов при загрузке: посчитаны, переиспользованы, удалены", ["result"]
+)
+RERANK_REQUESTS = Counter(
+    "examiner_rerank_requests_total", "Переранжирования: ok, timeout и cold (модель не загружена) - исходный порядок, error", ["result"]
+)
+ADMISSION_REJECTED = Counter("examiner_admission_rejected_total", "Отклонённые запросы к модели", ["reason"])
+ADMISSION_QUEUE = Gauge(
+    "examiner_admission_queue", "Запросы к модели в очереди на допуск", multiprocess_mode="livesum"
+)
+
+_tracer = None
+if OTEL_ENABLED:
+    try:
+        from opentelemetry import trace
+
+        _tracer = trace.get_tracer("examiner")
+    except ImportError:
+        logger.warning("opentelemetry не установлен, трассировка отключена")
+
+
+@contextmanager
+def track_stage(stage: str):
+    """Замер этапа: гистограмма, счётчик ошибок и (если включено) span OpenTelemetry"""
+    span_cm = _tracer.start_as_current_span(stage) if _tracer else None
+    if span_cm:
+        span_cm.__enter__()
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.labels(stage).inc()
+        raise
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - started)
+        if span_cm:
+            span_cm.__exit__(None, None, None)
+
+
+def observe_stage(stage: str, seconds: float):
+    """Запись длительности этапа, измеренной вручную (например, суммарно по потоку)"""
+    STAGE_LATENCY.labels(stage).observe(seconds)
+
+
+def record_tokens(prompt_tokens: Optional[int], completion_tokens: Optional[int]):
+    if prompt_tokens:
+        LLM_TOKENS.labels("prompt").inc(prompt_tokens)
+    if completion_tokens:
+        LLM_TOKENS.labels("completion").inc(completion_tokens)
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def record_error(stage: str):
+    ERRORS.labels(stage).inc()
+
+
+def render_metrics() -> tuple:
+    """Тело и content-type ответа /metrics"""
+    # Несколько воркеров gunicorn: метрики собираются из файлов всех процессов
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,117 @@
+"""Сравнение бэкендов эмбеддингов: пропускная способность, пиковый RSS и расхождение векторов.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_embeddings --texts 512 --threads 4
+
+Каждый бэкенд запускается в отдельном процессе, чтобы RSS не смешивался.
+Результат - JSON в stdout (или в файл через --output).
+"""
+import argparse
+import json
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+WORDS = (
+    "exam lecture theorem proof matrix vector integral derivative function limit series "
+    "probability distribution variance entropy algorithm complexity graph tree network "
+    "protocol database index transaction memory process thread kernel compiler grammar"
+).split()
+
+
+def make_texts(count: int, seed: int = 42) -> list:
+    """Синтетические тексты разной длины (от одного предложения до абзаца)"""
+    rnd = random.Random(seed)
+    return [" ".join(rnd.choices(WORDS, k=rnd.randint(8, 300))) for _ in range(count)]
+
+
+def run_backend(backend_name: str, model: str, texts_count: int, threads: int, vectors_path: str) -> dict:
+    """Замер одного бэкенда в текущем процессе"""
+    from app.services.embedding_service import get_embedding_backend
+
+    backend = get_embedding_backend(model, backend_name)
+    backend.threads = threads
+    texts = make_texts(texts_count)
+
+    started = time.perf_counter()
+    backend.load()
+    backend.encode(["warm up"])
+    load_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    vectors = backend.encode(texts)
+    encode_seconds = time.perf_counter() - started
+
+    np.save(vectors_path, vectors)
+    return {
+        "backend": backend.name,
+        "model": model,
+        "texts": texts_count,
+        "threads": threads,
+        "load_seconds": round(load_seconds, 3),
+        "encode_seconds": round(encode_seconds, 3),
+        "texts_per_second": round(texts_count / encode_seconds, 2),
+        # ru_maxrss в Linux - в килобайтах
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="BAAI/bge-small-en-v1.5")
+    parser.add_argument("--texts", type=int, default=512)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--backends", default="torch,onnx")
+    parser.add_argument("--tolerance", type=float, default=0.02,
+                        help="Допустимое отклонение косинусного сходства от PyTorch бэкенда")
+    parser.add_argument("--output")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--vectors", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_backend(args.worker, args.model, args.texts, args.threads, args.vectors)))
+        return
+
+    results = []
+    vectors = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend_name in args.backends.split(","):
+            vectors_path = f"{tmp}/{backend_name}.npy"
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_embeddings", "--worker", backend_name,
+                 "--model", args.model, "--texts", str(args.texts), "--threads", str(args.threads),
+                 "--vectors", vectors_path],
+                check=True, capture_output=True, text=True
+            )
+            results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+            vectors[backend_name] = np.load(vectors_path)
+
+    report = {"results": results}
+    if "torch" in vectors:
+        reference = vectors["torch"]
+        for backend_name, current in vectors.items():
+            if backend_name == "torch":
+                continue
+            # Оба бэкенда отдают нормированные векторы - скалярное произведение равно косинусу
+            cosine = np.sum(reference * current, axis=1)
+            report.setdefault("equivalence", {})[backend_name] = {
+                "min_cosine": round(float(cosine.min()), 5),
+                "mean_cosine": round(float(cosine.mean()), 5),
+                "within_tolerance": bool(1.0 - cosine.min() <= args.tolerance),
+            }
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
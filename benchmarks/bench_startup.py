@@ -0,0 +1,151 @@
+"""Холодный старт: время импорта приложения, открытия порта, готовности (/ready) и первых запросов.
+
+    python -m benchmarks.bench_startup --fake-embeddings
+
+Сервис поднимается отдельным процессом дважды - с прогревом (WARMUP_ENABLED=true) и без него,
+чтобы было видно, сколько стоил бы первый запрос без прогрева. Qdrant в памяти, банк вопросов
+выключен (модель не нужна). Результат - JSON.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict
+
+import httpx
+
+from benchmarks.run_bench import BENCH_MODEL, HashEmbeddingBackend
+
+IMPORT_PROBE = """
+import json, time
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+from app.services import question_bank_service, user_db_service
+print(json.dumps({
+    "seconds": elapsed,
+    # Импорт не должен создавать сервисы и подключаться к Qdrant
+    "services_created": user_db_service._service is not None or question_bank_service._service is not None,
+    "qdrant_connected": user_db_service._client is not None,
+}))
+"""
+
+SAMPLE_TEXT = ("Предел функции в точке. Определение по Коши и по Гейне. Теорема о единственности предела. "
+               "Непрерывность функции и точки разрыва. ") * 40
+
+
+def serve(args):
+    """Дочерний процесс: приложение на uvicorn (с хеш-эмбеддингами при --fake-embeddings)"""
+    if args.fake_embeddings:
+        from app.services import embedding_service
+        embedding_service._backends[("hash", BENCH_MODEL)] = HashEmbeddingBackend()
+
+    import uvicorn
+
+    sys.path.insert(0, os.getcwd())
+    uvicorn.run("main:app", host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def child_env(args, warmup: bool) -> Dict[str, str]:
+    env = {
+        **os.environ,
+        "QDRANT_HOST": ":memory:",
+        "QUESTION_BANK_ENABLED": "false",
+        "STATE_DIR": tempfile.mkdtemp(prefix="examiner_startup_"),
+        "WARMUP_ENABLED": str(warmup).lower(),
+        "LOG_LEVEL": "WARNING",
+    }
+    if args.fake_embeddings:
+        env["EMBEDDING_BACKEND"] = "hash"
+        env["EMBEDDING_MODEL"] = BENCH_MODEL
+    return env
+
+
+def measure_import(args) -> Dict[str, Any]:
+    runs = []
+    for _ in range(args.import_runs):
+        out = subprocess.run([sys.executable, "-c", IMPORT_PROBE], env=child_env(args, warmup=True),
+                             capture_output=True, text=True, check=True)
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {
+        "median_seconds": round(statistics.median(run["seconds"] for run in runs), 3),
+        "runs": [round(run["seconds"], 3) for run in runs],
+        "services_created": any(run["services_created"] for run in runs),
+        "qdrant_connected": any(run["qdrant_connected"] for run in runs),
+    }
+
+
+def timed(call) -> Dict[str, Any]:
+    started = time.perf_counter()
+    resp = call()
+    return {"status": resp.status_code, "ms": round((time.perf_counter() - started) * 1000, 1)}
+
+
+def measure_server(args, warmup: bool) -> Dict[str, Any]:
+    command = [sys.executable, "-m", "benchmarks.bench_startup", "--serve", "--port", str(args.port)]
+    if args.fake_embeddings:
+        command.append("--fake-embeddings")
+
+    started = time.perf_counter()
+    server = subprocess.Popen(command, env=child_env(args, warmup))
+    report: Dict[str, Any] = {"warmup": warmup}
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{args.port}", timeout=300) as client:
+            while time.perf_counter() - started < args.timeout:
+                try:
+                    ready = client.get("/ready")
+                except httpx.HTTPError:
+                    time.sleep(0.02)
+                    continue
+                report.setdefault("listening_seconds", round(time.perf_counter() - started, 3))
+                if ready.status_code == 200:
+                    report["ready_seconds"] = round(time.perf_counter() - started, 3)
+                    report["readiness"] = ready.json()
+                    break
+                time.sleep(0.02)
+            else:
+                raise RuntimeError(f"Сервис не готов за {args.timeout} с")
+
+            user_id = "startup_user"
+            search = {"user_id": user_id, "query_text": "определение предела функции", "limit": 5}
+            report["first_requests"] = {
+                "init": timed(lambda: client.post("/db/init")),
+                "add": timed(lambda: client.post("/db/add", params={"user_id": user_id},
+                                                 files={"file": ("limits.txt", SAMPLE_TEXT.encode("utf-8"))})),
+                "search_first": timed(lambda: client.post("/db/search", json=search)),
+                "search_second": timed(lambda: client.post("/db/search", json=search)),
+            }
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fake-embeddings", action="store_true",
+                        help="Хеш-эмбеддинги вместо модели (замер без загрузки весов)")
+    parser.add_argument("--import-runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8520)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    report = {
+        "fake_embeddings": args.fake_embeddings,
+        "import": measure_import(args),
+        "servers": [measure_server(args, warmup=True), measure_server(args, warmup=False)],
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
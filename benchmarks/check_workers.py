@@ -0,0 +1,184 @@
+"""Проверка запуска с несколькими воркерами за одним портом.
+
+Поднимает gunicorn (gunicorn.conf.py) с N воркерами, фейковую модель и общее файловое
+хранилище состояния. Затем генерирует тесты и многократно читает /test, /test-json и /result:
+каждый ответ любого воркера должен видеть одно и то же состояние, в том числе после перегенерации.
+До запуска сервиса проверяет, что два кеша страниц (как в двух воркерах) видят новую версию
+теста, пересозданного через delete + put.
+
+    python -m benchmarks.check_workers --workers 4 --users 3 --reads 40
+
+Для проверки с Redis: --state redis --redis-url redis://localhost:6379/0
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.fake_llm_server import FakeLLMSettings, start_in_thread
+
+
+def check_page_versions(store) -> list:
+    """Два кеша страниц над одним хранилищем: после delete + put оба отдают новую версию, а не свою старую"""
+    from app.services.page_cache import PageCache
+    from app.services.state_store import TESTS
+
+    user_id = f"versions_{os.getpid()}"
+    caches = [PageCache(), PageCache()]
+    failures = []
+
+    def read(cache):
+        version, modified_at = store.version(TESTS, user_id)
+        page = cache.get("json", user_id, version, modified_at, "application/json",
+                         lambda: json.dumps(store.get(TESTS, user_id)).encode("utf-8"))
+        return page.etag
+
+    try:
+        store.put(TESTS, user_id, [{"question": "Старый вопрос?"}])
+        old = [read(cache) for cache in caches]
+        # Как /generate-tests: запись удаляется и создаётся заново, кеш сбрасывается только в одном воркере
+        store.delete(TESTS, user_id)
+        store.put(TESTS, user_id, [{"question": "Новый вопрос?"}])
+        caches[0].invalidate(user_id)
+        new = [read(cache) for cache in caches]
+        if new[0] != new[1] or new[1] == old[1]:
+            failures.append(f"кеш страниц отдаёт старую версию после перегенерации: {old} -> {new}")
+    finally:
+        store.delete(TESTS, user_id)
+    return failures
+
+
+def worker_pids(master_pid: int) -> list:
+    """PID дочерних процессов мастера gunicorn (Linux /proc)"""
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/status") as f:
+                if any(line.split()[1:] == [str(master_pid)] for line in f if line.startswith("PPid:")):
+                    pids.append(int(entry))
+        except OSError:
+            continue
+    return sorted(pids)
+
+
+def wait_ready(client: httpx.Client, timeout: float = 60.0):
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        try:
+            if client.get("/metrics").status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.3)
+    raise RuntimeError("Сервис не поднялся")
+
+
+def check_user(client: httpx.Client, user_id: str, reads: int) -> dict:
+    failures = []
+    resp = client.post("/generate-tests", json={"user_id": user_id, "query": "Тест из 5 вопросов",
+                                                "questions_count": 5, "use_bank": False})
+    if resp.status_code != 200:
+        return {"user_id": user_id, "failures": [f"generate-tests: {resp.status_code} {resp.text[:200]}"]}
+
+    etags = set()
+    for _ in range(reads):
+        for path in ("/test-json", "/test"):
+            page = client.get(path, params={"user_id": user_id})
+            if page.status_code != 200:
+                failures.append(f"{path}: {page.status_code}")
+            elif path == "/test-json":
+                etags.add(page.headers.get("etag"))
+    if len(etags) > 1:
+        failures.append(f"разные версии теста у воркеров: {sorted(etags)}")
+
+    # Перегенерация: ни один воркер не должен отдавать страницу прежнего теста
+    resp = client.post("/generate-tests", json={"user_id": user_id, "query": "Тест из 4 вопросов",
+                                                "questions_count": 4, "use_bank": False})
+    if resp.status_code != 200:
+        failures.append(f"повторный generate-tests: {resp.status_code}")
+    else:
+        regenerated = {client.get("/test-json", params={"user_id": user_id}).headers.get("etag")
+                       for _ in range(reads)}
+        if len(regenerated) > 1 or regenerated & etags:
+            failures.append(f"после перегенерации воркеры отдают старую версию: {sorted(etags)} -> {sorted(regenerated)}")
+
+    test = client.get("/test-json", params={"user_id": user_id}).json()
+    details = [{"questionIndex": index, "answerIndex": 0} for index in range(len(test))]
+    submitted = client.post("/result", params={"user_id": user_id, "analyze": False}, json={"details": details})
+    if submitted.status_code != 200:
+        failures.append(f"POST /result: {submitted.status_code}")
+    else:
+        submission_id = submitted.json()["submission_id"]
+        for _ in range(reads):
+            result = client.get("/result", params={"user_id": user_id})
+            if result.status_code != 200 or result.json().get("submission_id") != submission_id:
+                failures.append(f"GET /result: {result.status_code}")
+
+    return {"user_id": user_id, "versions": len(etags), "failures": failures}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--users", type=int, default=3)
+    parser.add_argument("--reads", type=int, default=40)
+    parser.add_argument("--port", type=int, default=8510)
+    parser.add_argument("--llm-port", type=int, default=8601)
+    parser.add_argument("--state", default="file", choices=["file", "redis"])
+    parser.add_argument("--redis-url", default="redis://localhost:6379/0")
+    parser.add_argument("--preload", action="store_true", help="Загрузить модель эмбеддингов до fork")
+    args = parser.parse_args()
+
+    start_in_thread(FakeLLMSettings(latency=0.05, tokens_per_second=5000), port=args.llm_port)
+    state_dir = tempfile.mkdtemp(prefix="examiner_state_")
+    env = {
+        **os.environ,
+        "APP_WORKERS": str(args.workers),
+        "APP_PRELOAD": str(args.preload).lower(),
+        "PORT": str(args.port),
+        "STATE_BACKEND": args.state,
+        "STATE_DIR": state_dir,
+        "REDIS_URL": args.redis_url,
+        "STATE_PREFIX": f"check_{os.getpid()}",
+        "OPENROUTER_URL": f"http://127.0.0.1:{args.llm_port}/v1/chat/completions",
+        "OPENROUTER_API_KEY": os.getenv("OPENROUTER_API_KEY", "check"),
+        "QDRANT_HOST": os.getenv("QDRANT_HOST", ":memory:"),
+        "LLM_RATE_LIMIT_RPM": "0",
+        "LOG_LEVEL": "WARNING",
+    }
+    os.environ.update({key: env[key] for key in ("STATE_BACKEND", "STATE_DIR", "REDIS_URL", "STATE_PREFIX")})
+    from app.services.state_store import get_state_store
+
+    page_failures = check_page_versions(get_state_store())
+
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "main:app"], env=env)
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{args.port}", timeout=120) as client:
+            wait_ready(client)
+            pids = worker_pids(server.pid)
+            users = [check_user(client, f"check_user_{i}", args.reads) for i in range(args.users)]
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    report = {
+        "workers_requested": args.workers,
+        "workers_running": len(pids),
+        "state_backend": args.state,
+        "page_versions": page_failures,
+        "users": users,
+        "ok": len(pids) == args.workers and not page_failures and not any(user["failures"] for user in users),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    sys.exit(0 if report["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Синтетический корпус учебных материалов (TXT, DOCX, PDF) заданного размера."""
+import io
+import random
+from typing import List, Tuple
+
+TOPICS = [
+    "линейная алгебра", "математический анализ", "теория вероятностей", "базы данных",
+    "операционные системы", "компьютерные сети", "алгоритмы", "теория графов",
+]
+WORDS = (
+    "определение теорема доказательство матрица вектор интеграл производная функция предел ряд "
+    "вероятность распределение дисперсия энтропия алгоритм сложность граф дерево сеть протокол "
+    "индекс транзакция память процесс поток ядро компилятор грамматика множество отображение"
+).split()
+
+
+def make_text(size_chars: int, seed: int = 0) -> str:
+    """Текст лекции примерно size_chars символов: абзацы с заголовками тем"""
+    rnd = random.Random(seed)
+    parts: List[str] = []
+    total = 0
+    while total < size_chars:
+        topic = rnd.choice(TOPICS)
+        paragraph = f"Тема: {topic}.\n" + " ".join(rnd.choices(WORDS, k=rnd.randint(40, 120))) + ".\n\n"
+        parts.append(paragraph)
+        total += len(paragraph)
+    return "".join(parts)[:size_chars]
+
+
+def make_txt(size_chars: int, seed: int = 0) -> bytes:
+    return make_text(size_chars, seed).encode("utf-8")
+
+
+def make_docx(size_chars: int, seed: int = 0) -> bytes:
+    import docx
+
+    document = docx.Document()
+    for paragraph in make_text(size_chars, seed).split("\n\n"):
+        if paragraph.strip():
+            document.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def make_pdf(size_chars: int, seed: int = 0) -> bytes:
+    """Минимальный PDF без сторонних библиотек: текст латиницей (стандартный шрифт Helvetica)"""
+    rnd = random.Random(seed)
+    latin = "lecture theorem proof matrix vector integral derivative function limit series graph tree".split()
+    text = " ".join(rnd.choices(latin, k=size_chars // 7 + 1))[:size_chars]
+    lines = [text[i:i + 90] for i in range(0, len(text), 90)]
+    pages = [lines[i:i + 50] for i in range(0, len(lines), 50)] or [[""]]
+
+    objects: List[bytes] = []
+    page_ids = [4 + 2 * i for i in range(len(pages))]
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids)
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for index, page_lines in enumerate(pages):
+        stream = "BT /F1 10 Tf 40 800 Td 12 TL " + " ".join(
+            "(" + line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ") '" for line in page_lines
+        ) + " ET"
+        content_id = page_ids[index] + 1
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> "
+            f"/Contents {content_id} 0 R >>".encode()
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream".encode())
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+GENERATORS = {"txt": make_txt, "docx": make_docx, "pdf": make_pdf}
+
+
+def make_corpus(kinds: List[str], sizes: List[int], seed: int = 0) -> List[Tuple[str, bytes]]:
+    """Список (имя файла, содержимое) для всех сочетаний типа и размера"""
+    files = []
+    for kind in kinds:
+        for size in sizes:
+            files.append((f"lecture_{size}_{seed}.{kind}", GENERATORS[kind](size, seed)))
+    return files
@@ -0,0 +1,155 @@
+"""Локальная замена OpenRouter: OpenAI-совместимый /chat/completions с настраиваемой задержкой.
+
+Запуск отдельно:
+    python -m benchmarks.fake_llm_server --port 8600 --latency 0.5 --tokens-per-second 80
+
+Затем OPENROUTER_URL=http://127.0.0.1:8600/v1/chat/completions в окружении приложения.
+Ответ зависит от промпта: на запрос теста возвращаются валидные вопросы в запрошенном
+формате (structured или обычный json), на остальные - текст заданной длины.
+"""
+import argparse
+import asyncio
+import json
+import re
+import threading
+import time
+import uuid
+from typing import Any, Dict, List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Для оценки usage: ~4 символа на токен, как у BPE-токенизаторов на латинице
+CHARS_PER_TOKEN = 4
+
+
+class FakeLLMSettings:
+    def __init__(self, latency: float = 0.5, tokens_per_second: float = 80.0,
+                 answer_tokens: int = 300, error_rate: float = 0.0):
+        self.latency = latency  # задержка до первого токена, секунд
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.error_rate = error_rate
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def next_request(self) -> int:
+        with self._lock:
+            self.requests += 1
+            return self.requests
+
+
+def _prompt_text(body: Dict[str, Any]) -> str:
+    parts = []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list):
+            parts.extend(item.get("text", "") for item in content if isinstance(item, dict))
+        elif isinstance(content, str):
+            parts.append(content)
+    return "\n".join(parts)
+
+
+def _questions(count: int, structured: bool, seed: str) -> str:
+    questions: List[Dict[str, Any]] = []
+    for index in range(count):
+        text = f"Вопрос {seed}-{index + 1}: что верно для понятия номер {index + 1}?"
+        if structured:
+            answers = [{"text": f"Вариант {a + 1}", "correct": a == index % 4} for a in range(4)]
+            questions.append({"question": text, "topic": f"Тема {index % 3 + 1}", "answers": answers})
+        else:
+            answers = [{f"Вариант {a + 1}": int(a == index % 4)} for a in range(4)]
+            questions.append({"question": text, "topic": f"Тема {index % 3 + 1}", "answers": answers})
+    return json.dumps({"questions": questions} if structured else questions, ensure_ascii=False)
+
+
+def build_answer(body: Dict[str, Any], settings: FakeLLMSettings) -> str:
+    prompt = _prompt_text(body)
+    if '"question"' in prompt:
+        match = re.search(r"ровно (\d+)", prompt)
+        count = int(match.group(1)) if match else 10
+        return _questions(count, structured=bool(body.get("response_format")), seed=uuid.uuid4().hex[:6])
+    return ("Это ответ тестовой модели. " * (settings.answer_tokens * CHARS_PER_TOKEN // 27 + 1))[
+        :settings.answer_tokens * CHARS_PER_TOKEN]
+
+
+def create_app(settings: FakeLLMSettings) -> FastAPI:
+    app = FastAPI(title="Fake OpenAI-compatible LLM")
+
+    @app.post("/v1/chat/completions")
+    @app.post("/api/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        number = settings.next_request()
+        if settings.error_rate and (number * 7919 % 1000) / 1000 < settings.error_rate:
+            return JSONResponse({"error": {"message": "fake upstream error"}}, status_code=503)
+
+        answer = build_answer(body, settings)
+        max_chars = int(body.get("max_tokens") or 10 ** 9) * CHARS_PER_TOKEN
+        finish_reason = "length" if len(answer) > max_chars else "stop"
+        answer = answer[:max_chars]
+        usage = {
+            "prompt_tokens": len(_prompt_text(body)) // CHARS_PER_TOKEN,
+            "completion_tokens": len(answer) // CHARS_PER_TOKEN,
+        }
+        model = body.get("model", "fake")
+
+        if not body.get("stream"):
+            await asyncio.sleep(settings.latency + usage["completion_tokens"] / settings.tokens_per_second)
+            return {
+                "id": f"fake-{number}",
+                "object": "chat.completion",
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer},
+                             "finish_reason": finish_reason}],
+                "usage": usage,
+            }
+
+        async def events():
+            await asyncio.sleep(settings.latency)
+            chunk_chars = CHARS_PER_TOKEN * 4
+            delay = 4 / settings.tokens_per_second
+            for start in range(0, len(answer), chunk_chars):
+                chunk = {"choices": [{"index": 0, "delta": {"content": answer[start:start + chunk_chars]}}]}
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                await asyncio.sleep(delay)
+            final = {"choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}], "usage": usage}
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    def stats():
+        return {"requests": settings.requests}
+
+    return app
+
+
+def start_in_thread(settings: FakeLLMSettings, host: str = "127.0.0.1", port: int = 8600) -> uvicorn.Server:
+    """Запуск сервера в фоновом потоке (для бенчмарков в одном процессе с приложением)"""
+    server = uvicorn.Server(uvicorn.Config(create_app(settings), host=host, port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--latency", type=float, default=0.5, help="Задержка до первого токена, с")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--answer-tokens", type=int, default=300)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    settings = FakeLLMSettings(args.latency, args.tokens_per_second, args.answer_tokens, args.error_rate)
+    uvicorn.run(create_app(settings), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
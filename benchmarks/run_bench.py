@@ -0,0 +1,256 @@
+"""Нагрузочные сценарии API без живого Qdrant и OpenRouter.
+
+Зависимости: pip install -r benchmarks/requirements.txt
+
+Запуск из корня репозитория (всё в одном процессе: Qdrant в памяти, фейковая модель):
+    python -m benchmarks.run_bench --requests 50 --concurrency 8 --fake-embeddings
+
+Против уже запущенного сервиса (например, с Qdrant в контейнере):
+    python -m benchmarks.run_bench --target http://127.0.0.1:8500 --pid <pid uvicorn>
+
+Сценарии: add (/db/add), search (/db/search), search_batch (/db/search-batch, 12 запросов),
+generate (/generate-tests), result (/result).
+Результат - JSON: пропускная способность, p50/p95/p99, ошибки и RSS по каждому сценарию.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import resource
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+from benchmarks.corpus import make_corpus
+from benchmarks.fake_llm_server import FakeLLMSettings, start_in_thread
+
+SCENARIOS = ["add", "search", "search_batch", "generate", "result"]
+QUERIES = [
+    "теорема о ранге матрицы", "определение предела функции", "дисперсия распределения",
+    "сложность алгоритма на графе", "транзакции в базах данных", "процессы и потоки ядра",
+]
+BENCH_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+class HashEmbeddingBackend:
+    """Детерминированные эмбеддинги из хешей слов: без загрузки модели, для замеров остального пути"""
+
+    name = "hash"
+    loaded = True
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+
+    def load(self):
+        return self
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                digest = hashlib.blake2b(word.encode("utf-8"), digest_size=4).digest()
+                vectors[row, int.from_bytes(digest, "little") % self.dimension] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.clip(norms, 1e-12, None)
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    return round(float(np.percentile(values, q)) * 1000, 1)
+
+
+def rss_mb(pid: Optional[int] = None) -> Dict[str, Optional[float]]:
+    """Текущий и пиковый RSS процесса (Linux /proc), МБ"""
+    values: Dict[str, Optional[float]] = {"rss_mb": None, "peak_rss_mb": None}
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    values["rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+                elif line.startswith("VmHWM:"):
+                    values["peak_rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        if pid is None:
+            # ru_maxrss в Linux - в килобайтах
+            values["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return values
+
+
+def run_scenario(name: str, call: Callable[[int], httpx.Response], requests_count: int,
+                 concurrency: int, pid: Optional[int]) -> Dict[str, Any]:
+    """N запросов с параллельностью C, задержка каждого - от отправки до полного ответа"""
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def one(index: int):
+        started = time.perf_counter()
+        try:
+            status = str(call(index).status_code)
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - started
+        with lock:
+            if status.startswith("2"):
+                latencies.append(elapsed)
+            else:
+                errors[status] = errors.get(status, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(requests_count)))
+    wall = time.perf_counter() - started
+
+    return {
+        "scenario": name,
+        "requests": requests_count,
+        "concurrency": concurrency,
+        "ok": len(latencies),
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        **rss_mb(pid),
+    }
+
+
+def build_calls(client: httpx.Client, args, users: List[str]) -> Dict[str, Callable[[int], httpx.Response]]:
+    corpus = make_corpus(args.kinds.split(","), [int(s) for s in args.sizes.split(",")], seed=args.seed)
+    rnd = random.Random(args.seed)
+
+    def add(index: int) -> httpx.Response:
+        filename, content = corpus[index % len(corpus)]
+        return client.post("/db/add", params={"user_id": users[index % len(users)]},
+                           files={"file": (f"{index}_{filename}", content)})
+
+    def search(index: int) -> httpx.Response:
+        return client.post("/db/search", json={
+            "user_id": users[index % len(users)], "query_text": rnd.choice(QUERIES), "limit": 10
+        })
+
+    def search_batch(index: int) -> httpx.Response:
+        # Как на странице теста: десяток тематических запросов за раз
+        return client.post("/db/search-batch", json={
+            "user_id": users[index % len(users)], "queries": [rnd.choice(QUERIES) for _ in range(12)],
+            "target": "chunks", "group_by": "file_id", "limit": 5
+        })
+
+    def generate(index: int) -> httpx.Response:
+        return client.post("/generate-tests", json={
+            "user_id": users[index % len(users)],
+            "query": f"Сделай тест из {args.questions} вопросов: {rnd.choice(QUERIES)}",
+            "questions_count": args.questions,
+            "use_bank": not args.no_bank,
+        })
+
+    def result(index: int) -> httpx.Response:
+        user_id = users[index % len(users)]
+        test = client.get("/test-json", params={"user_id": user_id}).json()
+        details = [{"questionIndex": q_index, "answerIndex": rnd.randrange(len(q.get("answers", [])) or 1)}
+                   for q_index, q in enumerate(test)]
+        return client.post("/result", params={"user_id": user_id, "analyze": not args.no_analyze},
+                           json={"details": details})
+
+    return {"add": add, "search": search, "search_batch": search_batch, "generate": generate, "result": result}
+
+
+def prepare_in_process(args) -> str:
+    """Окружение до импорта приложения: Qdrant в памяти, фейковая модель, отдельная рабочая папка"""
+    llm_settings = FakeLLMSettings(args.llm_latency, args.llm_tokens_per_second)
+    start_in_thread(llm_settings, port=args.llm_port)
+    os.environ["OPENROUTER_URL"] = f"http://127.0.0.1:{args.llm_port}/v1/chat/completions"
+    os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+    os.environ["QDRANT_HOST"] = args.qdrant
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # Фейковая модель лимитов не имеет; чтобы замерить допуск запросов, задайте LLM_RATE_LIMIT_RPM явно
+    os.environ.setdefault("LLM_RATE_LIMIT_RPM", "0")
+    # Банк вопросов по умолчанию выключен; сценарий generate замеряет его, если не передан --no-bank
+    os.environ.setdefault("QUESTION_BANK_ENABLED", "false" if args.no_bank else "true")
+    # Тесты и результаты сохраняются в рабочую папку - не смешиваем с данными разработчика
+    workdir = os.path.abspath(args.workdir)
+    os.makedirs(workdir, exist_ok=True)
+    os.environ["STATE_DIR"] = workdir
+    if args.fake_embeddings:
+        os.environ["EMBEDDING_BACKEND"] = "hash"
+        os.environ["EMBEDDING_MODEL"] = BENCH_MODEL
+
+    # app.config читает окружение при импорте - все переменные выше должны быть заданы до него
+    if args.fake_embeddings:
+        from app.services import embedding_service
+        embedding_service._backends[("hash", BENCH_MODEL)] = HashEmbeddingBackend()
+
+    import uvicorn
+    from main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.app_port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{args.app_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", help="URL запущенного сервиса; без него приложение поднимается в процессе")
+    parser.add_argument("--pid", type=int, help="PID сервиса для замера RSS при --target")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--kinds", default="txt,docx,pdf")
+    parser.add_argument("--sizes", default="5000,50000", help="Размеры файлов корпуса, символов")
+    parser.add_argument("--questions", type=int, default=10)
+    parser.add_argument("--no-bank", action="store_true", help="Генерировать тесты без банка вопросов")
+    parser.add_argument("--no-analyze", action="store_true", help="Не запрашивать разбор ошибок в /result")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--qdrant", default=":memory:", help="Хост Qdrant для режима в процессе")
+    parser.add_argument("--fake-embeddings", action="store_true",
+                        help="Хеш-эмбеддинги вместо модели (замер без инференса)")
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--llm-port", type=int, default=8600)
+    parser.add_argument("--app-port", type=int, default=8501)
+    parser.add_argument("--workdir", default="bench_data")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+
+    pid = args.pid
+    base_url = args.target
+    if not base_url:
+        base_url = prepare_in_process(args)
+        pid = os.getpid()
+
+    users = [f"bench_user_{i}" for i in range(args.users)]
+    results = []
+    with httpx.Client(base_url=base_url, timeout=300) as client:
+        client.post("/db/init")
+        calls = build_calls(client, args, users)
+        for name in args.scenarios.split(","):
+            results.append(run_scenario(name, calls[name], args.requests, args.concurrency, pid))
+
+    report = {
+        "target": args.target or "in-process",
+        "qdrant": None if args.target else args.qdrant,
+        "fake_embeddings": args.fake_embeddings,
+        "llm_latency": args.llm_latency,
+        "llm_tokens_per_second": args.llm_tokens_per_second,
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Боевой запуск: gunicorn с uvicorn-воркерами за одним портом.
+
+    gunicorn -c gunicorn.conf.py main:app
+
+Приложение и модели эмбеддингов загружаются в мастер-процессе до fork (preload_app),
+воркеры делят страницы памяти с весами через copy-on-write.
+"""
+import os
+import shutil
+import tempfile
+
+from app.config import APP_PRELOAD, APP_WORKERS
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8500')}"
+workers = APP_WORKERS
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = APP_PRELOAD
+# Генерация большого теста может идти минуты
+timeout = int(os.getenv("WORKER_TIMEOUT", 300))
+graceful_timeout = 30
+keepalive = 5
+
+# Метрики Prometheus из всех воркеров: каталог задаётся до импорта prometheus_client
+_metrics_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "examiner_metrics")
+)
+shutil.rmtree(_metrics_dir, ignore_errors=True)
+os.makedirs(_metrics_dir, exist_ok=True)
+
+
+def when_ready(server):
+    if APP_PRELOAD:
+        from app.services.warmup_service import preload_before_fork
+
+        preload_before_fork()
+    server.log.info(f"Воркеров: {APP_WORKERS}, предзагрузка: {APP_PRELOAD}")
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
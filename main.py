@@ -1,12 +1,80 @@
-from fastapi import FastAPI
-from app.routers import tests_router, db_router, teacher_router
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from app.config import WARMUP_ENABLED
+from app.routers import tests_router, db_router, teacher_router, metrics_router, health_router, history_router
+from app.services.admission_service import AdmissionRejected
+from app.services.health_service import prober
+from app.services.warmup_service import readiness, start_warm_up
+from app.utils.logging_utils import new_request_id, request_id_var, setup_logging
+from app.utils.metrics import REQUEST_LATENCY, record_error
+
+setup_logging()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Импорт приложения ничего не загружает; модель и соединения прогреваются здесь, в каждом воркере"""
+    if WARMUP_ENABLED:
+        start_warm_up()
+    else:
+        readiness.disable()
+    prober.start()
+    yield
+    prober.stop()
+
+
+app = FastAPI(title="Exam Test Generator API", lifespan=lifespan)
+
+
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    """ID запроса для логов и гистограмма времени ответа по эндпоинтам"""
+    request_id = new_request_id(request.headers.get("X-Request-ID"))
+    token = request_id_var.set(request_id)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        # Шаблон пути (/db/search), а не фактический URL - чтобы не раздувать число серий
+        route = request.scope.get("route")
+        endpoint = getattr(route, "path", "unmatched")
+        REQUEST_LATENCY.labels(request.method, endpoint, str(status)).observe(time.perf_counter() - started)
+        if status >= 500:
+            record_error("request")
+        request_id_var.reset(token)
+
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request: Request, exc: AdmissionRejected):
+    """Перегрузка модели - 429 с подсказкой, когда повторить"""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc), "reason": exc.reason},
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))}
+    )
 
-app = FastAPI(title="Exam Test Generator API")
 
 app.include_router(db_router.router, prefix="/db", tags=["database"])
 app.include_router(teacher_router.router, prefix="/teacher", tags=["teacher"])
 app.include_router(tests_router.router, prefix="", tags=["tests"])
+app.include_router(history_router.router, prefix="/history", tags=["history"])
+app.include_router(metrics_router.router, prefix="", tags=["metrics"])
+app.include_router(health_router.router, prefix="", tags=["health"])
 
 if __name__ == "__main__":
+    import os
+    from app.config import APP_RELOAD, APP_WORKERS
+
+    if APP_WORKERS > 1 or not APP_RELOAD:
+        # Боевой режим: несколько воркеров за одним портом, настройки в gunicorn.conf.py
+        os.execvp("gunicorn", ["gunicorn", "-c", "gunicorn.conf.py", "main:app"])
+
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8500, reload=True)
@@ -0,0 +1,52 @@
+import hashlib
+import os
+import tempfile
+import uuid
+
+import numpy as np
+import pytest
+
+# app.config читает окружение при импорте: тесты без Qdrant-сервера, модели и рабочей папки разработчика
+os.environ.setdefault("QDRANT_HOST", ":memory:")
+os.environ.setdefault("STATE_DIR", tempfile.mkdtemp(prefix="examiner_tests_"))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("WARMUP_ENABLED", "false")
+os.environ.setdefault("HEALTH_PROBE_INTERVAL", "0")
+
+
+class HashEmbeddings:
+    """Детерминированные эмбеддинги из хешей слов: близость растёт с числом общих слов"""
+
+    name = "hash"
+    loaded = True
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+        self.calls = 0
+
+    def load(self):
+        return self
+
+    def encode(self, texts):
+        self.calls += 1
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                digest = hashlib.blake2b(word.encode("utf-8"), digest_size=4).digest()
+                vectors[row, int.from_bytes(digest, "little") % self.dimension] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.clip(norms, 1e-12, None)
+
+
+@pytest.fixture
+def db_service():
+    """UserDBService на встроенном Qdrant со своими коллекциями и хеш-эмбеддингами"""
+    from app.services.user_db_service import UserDBService
+
+    suffix = uuid.uuid4().hex[:8]
+    service = UserDBService(collection_name=f"files_{suffix}", chunk_collection=f"chunks_{suffix}")
+    service.embedding_backend = HashEmbeddings()
+    assert service.init_collection()["success"]
+    yield service
+    for name in (service.collection_name, service.chunk_collection):
+        service.client.delete_collection(name)
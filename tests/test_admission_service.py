@@ -0,0 +1,135 @@
+import threading
+import time
+
+import pytest
+
+from app.services.admission_service import AdmissionController, AdmissionRejected, SingleFlight, TokenBucket
+
+
+def test_bucket_without_rate_never_waits():
+    bucket = TokenBucket(0, 1)
+    assert bucket.reserve() == 0.0 and bucket.wait_time() == 0.0
+
+
+def test_bucket_burst_then_waits_for_refill():
+    bucket = TokenBucket(rate=10, burst=3)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    # Четвёртый токен в долг: ждать 1/rate
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.02)
+    assert bucket.wait_time() == pytest.approx(0.2, abs=0.02)
+
+
+def test_bucket_refund_returns_token():
+    bucket = TokenBucket(rate=1, burst=1)
+    bucket.reserve()
+    bucket.refund()
+    assert bucket.reserve() == 0.0
+
+
+def test_bucket_pause_blocks_everyone():
+    bucket = TokenBucket(rate=100, burst=10)
+    bucket.pause(0.5)
+    assert bucket.wait_time() >= 0.49
+    assert bucket.reserve() >= 0.49
+
+
+def test_admission_caps_concurrency():
+    controller = AdmissionController(rate_per_minute=0, max_concurrency=2, user_concurrency=0,
+                                     queue_size=10, queue_timeout=5)
+    peak = 0
+    lock = threading.Lock()
+
+    def call():
+        nonlocal peak
+        with controller.admit():
+            with lock:
+                peak = max(peak, controller.active)
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=call) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak == 2
+    assert controller.stats() == {"active": 0, "waiting": 0, "users": 0}
+
+
+def test_admission_caps_per_user_and_rejects_after_deadline():
+    controller = AdmissionController(rate_per_minute=0, max_concurrency=10, user_concurrency=1,
+                                     queue_size=10, queue_timeout=0.1)
+    with controller.admit("alice"):
+        # Другой пользователь проходит, второй запрос того же - ждёт и получает отказ по сроку
+        with controller.admit("bob"):
+            pass
+        with pytest.raises(AdmissionRejected) as error:
+            with controller.admit("alice"):
+                pass
+    assert error.value.reason == "deadline"
+    with controller.admit("alice"):
+        pass
+
+
+def test_admission_rejects_when_queue_is_full():
+    controller = AdmissionController(rate_per_minute=0, max_concurrency=1, user_concurrency=0,
+                                     queue_size=0, queue_timeout=1)
+    with controller.admit():
+        with pytest.raises(AdmissionRejected) as error:
+            with controller.admit():
+                pass
+    assert error.value.reason == "queue_full"
+
+
+def test_admission_rejects_upfront_when_rate_limit_cannot_be_met():
+    controller = AdmissionController(rate_per_minute=60, burst=1, max_concurrency=0, user_concurrency=0,
+                                     queue_size=10, queue_timeout=0.2)
+    with controller.admit():
+        pass
+    started = time.monotonic()
+    with pytest.raises(AdmissionRejected) as error:
+        with controller.admit():
+            pass
+    assert error.value.reason == "rate_limit"
+    assert error.value.retry_after == pytest.approx(1.0, abs=0.1)
+    assert time.monotonic() - started < 0.1
+
+
+def test_single_flight_runs_concurrent_calls_once():
+    flight = SingleFlight("test")
+    calls = 0
+    started = threading.Event()
+    release = threading.Event()
+
+    def compute():
+        nonlocal calls
+        calls += 1
+        started.set()
+        release.wait(1)
+        return "result"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("key", compute)))
+    leader.start()
+    started.wait(1)
+    followers = [threading.Thread(target=lambda: results.append(flight.do("key", compute))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join()
+
+    assert calls == 1 and results == ["result"] * 4
+    # После завершения ключ свободен - следующий вызов выполняется заново
+    assert flight.do("key", lambda: "again") == "again"
+
+
+def test_single_flight_shares_exceptions_and_forgets_key():
+    flight = SingleFlight("test")
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        flight.do("key", fail)
+    assert flight.do("key", lambda: 1) == 1
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from app.services.answer_cache import SemanticAnswerCache, context_fingerprint
+
+BASE = np.array([1.0, 0.0, 0.0])
+
+
+def rotated(similarity: float) -> np.ndarray:
+    """Вектор с заданным косинусом к BASE"""
+    return np.array([similarity, np.sqrt(1 - similarity ** 2), 0.0])
+
+
+def make_cache(**kwargs) -> SemanticAnswerCache:
+    options = {"max_entries": 10, "ttl": 60, "threshold": 0.9, "enabled": True, **kwargs}
+    return SemanticAnswerCache(**options)
+
+
+def test_fingerprint_ignores_passage_order_but_not_content():
+    first = {"title": "a.txt", "text": "матрица"}
+    second = {"title": "b.txt", "text": "ранг", "score": 0.5}
+    assert context_fingerprint([first, second], "m") == context_fingerprint([second, first], "m")
+    assert context_fingerprint([first], "m") != context_fingerprint([first, second], "m")
+    assert context_fingerprint([first], "m") != context_fingerprint([{**first, "text": "ранг"}], "m")
+    assert context_fingerprint([first], "m") != context_fingerprint([first], "other")
+
+
+@pytest.mark.parametrize("similarity, hit", [(1.0, True), (0.95, True), (0.85, False)])
+def test_lookup_respects_threshold(similarity, hit):
+    cache = make_cache()
+    cache.store("ctx", "вопрос", BASE * 3, "ответ", ["f1"])
+    found = cache.lookup("ctx", rotated(similarity))
+    assert (found is not None) == hit
+    if hit:
+        assert found[0].answer == "ответ" and found[1] == pytest.approx(similarity, abs=1e-5)
+
+
+def test_lookup_picks_closest_answer_within_same_context():
+    cache = make_cache()
+    cache.store("ctx", "далёкий", rotated(0.92), "далёкий", [])
+    cache.store("ctx", "близкий", rotated(0.99), "близкий", [])
+    cache.store("other", "точный", BASE, "чужой контекст", [])
+    assert cache.lookup("ctx", BASE)[0].answer == "близкий"
+    assert cache.lookup("missing", BASE) is None
+
+
+def test_expired_answers_are_dropped():
+    cache = make_cache(ttl=10)
+    cache.store("ctx", "вопрос", BASE, "ответ", [])
+    next(iter(cache._entries.values())).created_at -= 11
+    assert cache.lookup("ctx", BASE) is None
+    assert len(cache) == 0 and cache._buckets == {}
+
+
+def test_least_recently_used_answer_is_evicted():
+    cache = make_cache(max_entries=2)
+    cache.store("a", "q", BASE, "a", [])
+    cache.store("b", "q", BASE, "b", [])
+    assert cache.lookup("a", BASE) is not None
+    cache.store("c", "q", BASE, "c", [])
+    assert len(cache) == 2
+    assert cache.lookup("b", BASE) is None
+    assert cache.lookup("a", BASE) is not None and cache.lookup("c", BASE) is not None
+
+
+def test_invalidate_drops_answers_that_used_the_file():
+    cache = make_cache()
+    cache.store("ctx1", "q", BASE, "a1", ["f1", "f2"])
+    cache.store("ctx2", "q", BASE, "a2", ["f2"])
+    cache.store("ctx3", "q", BASE, "a3", ["f3"])
+    assert cache.invalidate("f2") == 2
+    assert cache.invalidate("f2") == 0
+    assert cache.lookup("ctx1", BASE) is None and cache.lookup("ctx3", BASE) is not None
+
+
+def test_disabled_cache_and_empty_answers_are_not_stored():
+    disabled = make_cache(enabled=False)
+    disabled.store("ctx", "q", BASE, "ответ", [])
+    assert len(disabled) == 0 and disabled.lookup("ctx", BASE) is None
+
+    cache = make_cache()
+    cache.store("ctx", "q", BASE, "", [])
+    assert len(cache) == 0
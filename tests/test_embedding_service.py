@@ -0,0 +1,66 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from app.services.embedding_service import OnnxEmbeddingBackend
+
+
+def write_pooling_config(model_dir, **modes):
+    config_dir = model_dir / "1_Pooling"
+    config_dir.mkdir(parents=True)
+    (config_dir / "config.json").write_text(json.dumps({"word_embedding_dimension": 4, **modes}))
+
+
+@pytest.mark.parametrize("modes, expected", [
+    ({"pooling_mode_cls_token": True, "pooling_mode_mean_tokens": False}, "cls"),
+    ({"pooling_mode_cls_token": False, "pooling_mode_mean_tokens": True}, "mean"),
+    ({"pooling_mode_max_tokens": True}, "mean"),
+])
+def test_model_pooling_from_sentence_transformers_config(tmp_path, modes, expected):
+    model_dir = tmp_path / "model"
+    write_pooling_config(model_dir, **modes)
+    backend = OnnxEmbeddingBackend(str(model_dir), model_dir=str(tmp_path / "onnx"))
+    assert backend._model_pooling() == expected
+
+
+def test_auto_pooling_prefers_value_saved_at_export(tmp_path):
+    model_dir = tmp_path / "model"
+    write_pooling_config(model_dir, pooling_mode_mean_tokens=True)
+    backend = OnnxEmbeddingBackend(str(model_dir), model_dir=str(tmp_path / "onnx"), pooling="auto")
+    os.makedirs(backend.model_dir)
+    with open(backend.pooling_path, "w") as f:
+        json.dump({"pooling": "cls"}, f)
+
+    backend._resolve_pooling()
+    assert backend.pooling == "cls"
+
+
+def test_auto_pooling_without_export_reads_model_config(tmp_path):
+    model_dir = tmp_path / "model"
+    write_pooling_config(model_dir, pooling_mode_cls_token=True)
+    backend = OnnxEmbeddingBackend(str(model_dir), model_dir=str(tmp_path / "onnx"), pooling="auto")
+    backend._resolve_pooling()
+    assert backend.pooling == "cls"
+
+
+def test_explicit_pooling_is_not_overridden(tmp_path):
+    model_dir = tmp_path / "model"
+    write_pooling_config(model_dir, pooling_mode_cls_token=True)
+    backend = OnnxEmbeddingBackend(str(model_dir), model_dir=str(tmp_path / "onnx"), pooling="mean")
+    backend._resolve_pooling()
+    assert backend.pooling == "mean"
+
+
+def test_mean_pooling_ignores_padding(tmp_path):
+    backend = OnnxEmbeddingBackend("model", model_dir=str(tmp_path), pooling="mean")
+    hidden = np.array([[[1.0, 0.0], [3.0, 0.0], [100.0, 100.0]]], dtype=np.float32)
+    mask = np.array([[1, 1, 0]])
+    np.testing.assert_allclose(backend._pool(hidden, mask), [[1.0, 0.0]])
+
+
+def test_cls_pooling_takes_first_token_normalized(tmp_path):
+    backend = OnnxEmbeddingBackend("model", model_dir=str(tmp_path), pooling="cls")
+    hidden = np.array([[[3.0, 4.0], [100.0, 0.0]]], dtype=np.float32)
+    np.testing.assert_allclose(backend._pool(hidden, np.array([[1, 1]])), [[0.6, 0.8]], rtol=1e-6)
@@ -0,0 +1,72 @@
+from app.services.grading_service import NO_TOPIC, grade_reported, grade_submission, wrong_questions
+
+TEST = [
+    {"question": "2 + 2?", "topic": "Арифметика", "answers": [{"3": 0}, {"4": 1}, {"5": 0}]},
+    {"question": "Производная x^2?", "topic": "Анализ", "answers": [{"2x": 1}, {"x": 0}]},
+    {"question": "Столица?", "answers": [{"Москва": 1}, {"Казань": 0}]},
+]
+
+
+def test_grades_by_question_and_answer_index():
+    grading = grade_submission(TEST, {"details": [
+        {"questionIndex": 2, "answerIndex": 0},
+        {"questionIndex": 0, "answerIndex": 1},
+        {"questionIndex": 1, "answerIndex": 1},
+    ]})
+    assert [q["is_correct"] for q in grading["questions"]] == [True, False, True]
+    assert grading["score"] == 2 and grading["total"] == 3 and grading["percentage"] == 67
+    assert grading["questions"][1]["selected_answer"] == "x"
+    assert grading["questions"][1]["correct_answer"] == "2x"
+
+
+def test_selected_text_is_compared_with_whitespace_normalized():
+    grading = grade_submission(TEST, {"details": [
+        {"questionIndex": 0, "selectedAnswer": " 4 "},
+        {"questionIndex": 1, "selectedAnswer": "2x"},
+        {"questionIndex": 2, "selectedAnswer": "москва"},
+    ]})
+    # Регистр значим: ответы сравниваются как написаны (формулы, обозначения)
+    assert [q["is_correct"] for q in grading["questions"]] == [True, True, False]
+
+
+def test_positional_details_from_old_test_page():
+    grading = grade_submission(TEST, {"details": [{"answerIndex": 1}, {"answerIndex": 0}, {"answerIndex": 1}]})
+    assert [q["is_correct"] for q in grading["questions"]] == [True, True, False]
+
+
+def test_unanswered_and_out_of_range_answers_are_wrong():
+    grading = grade_submission(TEST, {"details": [
+        {"questionIndex": 0, "answerIndex": 99},
+        {"questionIndex": 1},
+    ]})
+    assert [q["answered"] for q in grading["questions"]] == [False, False, False]
+    assert grading["score"] == 0
+    assert len(wrong_questions(grading)) == 3
+
+
+def test_per_topic_statistics():
+    grading = grade_submission(TEST, {"details": [
+        {"questionIndex": 0, "answerIndex": 1},
+        {"questionIndex": 1, "answerIndex": 1},
+        {"questionIndex": 2, "answerIndex": 0},
+    ]})
+    assert grading["per_topic"] == {
+        "Арифметика": {"correct": 1, "total": 1, "percentage": 100},
+        "Анализ": {"correct": 0, "total": 1, "percentage": 0},
+        NO_TOPIC: {"correct": 1, "total": 1, "percentage": 100},
+    }
+
+
+def test_malformed_submission_grades_as_unanswered():
+    grading = grade_submission(TEST, "not a dict")
+    assert grading["score"] == 0 and grading["total"] == 3
+
+
+def test_reported_grading_trusts_page_marks():
+    grading = grade_reported({"details": [
+        {"question": "Q1", "isCorrect": True, "answered": True, "selectedAnswer": "a"},
+        {"question": "Q2", "isCorrect": False, "answered": False},
+        "мусор",
+    ]})
+    assert grading["score"] == 1 and grading["total"] == 2
+    assert grading["per_topic"][NO_TOPIC]["percentage"] == 50
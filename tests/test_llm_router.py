@@ -0,0 +1,176 @@
+import socket
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import llm_router as llm_router_module
+from app.services.llm_router import COMPLETE, FIRST_TOKEN, LLMBackend, LLMRouter, RoutingPolicy
+from app.services.model_service import _Attempt, _attempt_var, _bind_connection
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(llm_router_module, "time", SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(llm_router_module, "LLM_UNHEALTHY_COOLDOWN", 30)
+    monkeypatch.setattr(llm_router_module, "LLM_ERROR_THRESHOLD", 0.5)
+    return clock
+
+
+def backend(name: str, window: int = 10) -> LLMBackend:
+    return LLMBackend(name, f"http://{name}", "model", api_key_env=None, window=window)
+
+
+def fail(target: LLMBackend, times: int = 5):
+    for _ in range(times):
+        target.record(False)
+
+
+def test_backend_becomes_unhealthy_by_error_rate(clock):
+    target = backend("a")
+    target.record(True, seconds=1.0)
+    assert target.healthy
+    fail(target, 2)
+    assert not target.healthy and target.error_rate == pytest.approx(2 / 3)
+
+
+def test_half_open_gives_one_trial_after_cooldown(clock):
+    target = backend("a")
+    fail(target)
+    assert not target.try_trial()
+
+    clock.now += 31
+    assert target.try_trial()
+    # Пока пробный запрос без ответа - второй не выдаётся
+    assert not target.try_trial()
+
+
+def test_successful_trial_closes_the_breaker(clock):
+    target = backend("a")
+    fail(target)
+    clock.now += 31
+    assert target.try_trial()
+    target.record(True, seconds=0.5)
+    assert target.healthy and target.error_rate == 0.0
+
+
+def test_failed_trial_restarts_the_cooldown(clock):
+    target = backend("a")
+    fail(target)
+    clock.now += 31
+    assert target.try_trial()
+    target.record(False)
+    assert not target.healthy
+    clock.now += 10
+    assert not target.try_trial()
+    clock.now += 21
+    assert target.try_trial()
+
+
+def test_lost_trial_is_reissued_after_another_cooldown(clock):
+    target = backend("a")
+    fail(target)
+    clock.now += 31
+    assert target.try_trial()
+    clock.now += 31
+    assert target.try_trial()
+
+
+def test_candidates_order_healthy_by_median_then_unhealthy(clock):
+    fast, slow, broken = backend("fast"), backend("slow"), backend("broken")
+    for _ in range(3):
+        fast.record(True, seconds=0.5)
+        slow.record(True, seconds=2.0)
+    fail(broken)
+    router = LLMRouter([slow, broken, fast])
+    assert [b.name for b in router.candidates("tests")] == ["fast", "slow", "broken"]
+
+    # После паузы нездоровый получает пробный запрос наравне со здоровыми (без замеров - первым),
+    # а следующий запрос, пока проба без ответа, снова ставит его последним
+    broken._latency[COMPLETE].clear()
+    clock.now += 31
+    assert router.candidates("tests")[0].name == "broken"
+    assert router.candidates("tests")[-1].name == "broken"
+
+
+def test_candidates_respect_policy_backends(clock):
+    router = LLMRouter([backend("a"), backend("b")], {"teacher": RoutingPolicy(backends=["b", "missing"])})
+    assert [b.name for b in router.candidates("teacher")] == ["b"]
+    assert len(router.candidates("tests")) == 2
+
+
+def test_first_token_ranking_falls_back_to_complete_latency(clock):
+    a, b = backend("a"), backend("b")
+    a.record(True, kind=COMPLETE, seconds=5.0)
+    b.record(True, kind=COMPLETE, seconds=1.0)
+    assert [x.name for x in LLMRouter([a, b]).candidates("tests", kind=FIRST_TOKEN)] == ["b", "a"]
+
+
+def test_hedge_delay_needs_samples_and_policy(clock, monkeypatch):
+    monkeypatch.setattr(llm_router_module, "LLM_HEDGE_MIN_SAMPLES", 5)
+    target = backend("a", window=50)
+    router = LLMRouter([target], {"tests": RoutingPolicy(hedge=True, hedge_percentile=90),
+                                  "analysis": RoutingPolicy(hedge=False)})
+    for seconds in (1, 1, 1, 1):
+        target.record(True, seconds=seconds)
+    assert router.hedge_delay("tests", target) is None
+    for seconds in range(1, 11):
+        target.record(True, seconds=seconds)
+    assert router.hedge_delay("tests", target) == pytest.approx(target.percentile(90))
+    assert router.hedge_delay("analysis", target) is None
+
+
+class FakeSocket:
+    def __init__(self):
+        self.shutdowns = []
+
+    def shutdown(self, how):
+        self.shutdowns.append(how)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.sock = FakeSocket()
+
+
+def bind(attempt, connection):
+    token = _attempt_var.set(attempt)
+    try:
+        _bind_connection(connection)
+    finally:
+        _attempt_var.reset(token)
+
+
+def test_cancel_shuts_down_the_bound_socket():
+    attempt, connection = _Attempt(), FakeConnection()
+    bind(attempt, connection)
+    attempt.cancel()
+    assert attempt.cancelled.is_set()
+    assert connection.sock.shutdowns == [socket.SHUT_RDWR]
+
+
+def test_cancel_after_finish_leaves_pooled_connection_alone():
+    attempt, connection = _Attempt(), FakeConnection()
+    bind(attempt, connection)
+    attempt.finish()
+    attempt.cancel()
+    assert connection.sock.shutdowns == []
+
+
+def test_cancel_does_not_touch_connection_reused_by_another_attempt():
+    first, second, connection = _Attempt(), _Attempt(), FakeConnection()
+    bind(first, connection)
+    # Соединение вернулось в пул и досталось другой попытке
+    bind(second, connection)
+    first.cancel()
+    assert connection.sock.shutdowns == []
+    second.cancel()
+    assert connection.sock.shutdowns == [socket.SHUT_RDWR]
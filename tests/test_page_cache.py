@@ -0,0 +1,76 @@
+import gzip
+
+import pytest
+
+from app.services import page_cache as page_cache_module
+from app.services.page_cache import CachedPage, PageCache
+
+BODY = ("<html>" + "тест " * 2000 + "</html>").encode("utf-8")
+
+
+def make_page(**bodies) -> CachedPage:
+    return CachedPage(version=1, media_type="text/html", etag='W/"x"', last_modified="",
+                      bodies={"identity": b"plain", **bodies})
+
+
+@pytest.mark.parametrize("accept, expected", [
+    ("", None),
+    ("gzip", "gzip"),
+    ("gzip, br", "br"),
+    ("br;q=0, gzip", "gzip"),
+    ("br;q=0.0, gzip;q=0", None),
+    ("BR ; Q=0.5", "br"),
+    ("br;q=abc, gzip", "gzip"),
+    ("deflate", None),
+    ("*", None),
+])
+def test_body_negotiates_encoding(accept, expected):
+    page = make_page(gzip=b"gz", br=b"br")
+    body, encoding = page.body(accept)
+    assert encoding == expected
+    assert body == {"gzip": b"gz", "br": b"br", None: b"plain"}[expected]
+
+
+def test_body_without_compressed_variant_falls_back_to_identity():
+    assert make_page().body("br, gzip") == (b"plain", None)
+
+
+def test_render_once_per_version_and_rerender_on_change():
+    cache = PageCache(max_entries=4)
+    renders = []
+
+    def render():
+        renders.append(1)
+        return BODY
+
+    first = cache.get("html", "t1", version=1, modified_at=0, media_type="text/html", render=render)
+    again = cache.get("html", "t1", version=1, modified_at=0, media_type="text/html", render=render)
+    assert again is first and len(renders) == 1
+    assert gzip.decompress(first.bodies["gzip"]) == BODY
+
+    changed = cache.get("html", "t1", version=2, modified_at=0, media_type="text/html", render=lambda: BODY + b"!")
+    assert changed.version == 2 and changed.etag != first.etag
+
+
+def test_small_pages_are_not_compressed(monkeypatch):
+    monkeypatch.setattr(page_cache_module, "PAGE_CACHE_MIN_COMPRESS", 1000)
+    page = PageCache().get("json", "t1", version=1, modified_at=0, media_type="application/json",
+                           render=lambda: b"[]")
+    assert set(page.bodies) == {"identity"}
+
+
+def test_lru_eviction_and_invalidate():
+    cache = PageCache(max_entries=2)
+    for test_id in ("a", "b"):
+        cache.get("html", test_id, 1, 0, "text/html", lambda: b"x")
+    cache.get("html", "a", 1, 0, "text/html", lambda: b"x")
+    cache.get("html", "c", 1, 0, "text/html", lambda: b"x")
+    assert len(cache) == 2
+    assert ("html", "b") not in cache._entries
+
+    cache = PageCache(max_entries=4)
+    for kind in ("html", "json"):
+        cache.get(kind, "a", 1, 0, "text/html", lambda: b"x")
+    cache.get("html", "b", 1, 0, "text/html", lambda: b"x")
+    cache.invalidate("a")
+    assert list(cache._entries) == [("html", "b")]
@@ -0,0 +1,67 @@
+from app.services.prompt_service import TRUNCATED_MARK, PromptBuilder, TokenCounter
+
+
+class CharCounter(TokenCounter):
+    """Оценка по символам без загрузки токенизатора: детерминированные бюджеты в тестах"""
+
+    def _get_encoding(self):
+        return None
+
+
+def make_builder(**kwargs) -> PromptBuilder:
+    return PromptBuilder(counter=CharCounter(), **kwargs)
+
+
+def passage(title: str, text: str, score: float):
+    return {"title": title, "text": text, "score": score}
+
+
+def titles(context: str):
+    return [line[len("--- Файл: "):-len(" ---")] for line in context.splitlines() if line.startswith("--- Файл: ")]
+
+
+def test_passages_ordered_by_score():
+    builder = make_builder(file_token_limit=10_000)
+    context = builder.fit_context([passage("b", "второй", 0.2), passage("a", "первый", 0.9)], max_tokens=1000)
+    assert titles(context) == ["a", "b"]
+
+
+def test_oversized_top_passage_does_not_crowd_out_smaller_ones():
+    builder = make_builder(file_token_limit=100_000)
+    passages = [
+        passage("big", "слово " * 3000, 0.9),
+        passage("small1", "малый один " * 20, 0.8),
+        passage("small2", "малый два " * 20, 0.7),
+    ]
+    context = builder.fit_context(passages, max_tokens=600)
+
+    # Маленькие фрагменты целиком, большой обрезан в остаток бюджета и стоит на своём месте по релевантности
+    assert titles(context) == ["big", "small1", "small2"]
+    assert "малый один " * 20 in context and "малый два " * 20 in context
+    assert TRUNCATED_MARK in context
+    assert builder.counter.count(context) <= 600
+
+
+def test_no_truncated_tail_when_remaining_budget_is_too_small():
+    builder = make_builder(file_token_limit=100_000)
+    small = passage("small", "малый " * 150, 0.5)
+    budget = builder.counter.count(f"\n--- Файл: small ---\n{small['text']}\n") + 10
+    context = builder.fit_context([passage("big", "слово " * 3000, 0.9), small], max_tokens=budget)
+    assert titles(context) == ["small"]
+    assert TRUNCATED_MARK not in context
+
+
+def test_file_token_limit_truncates_each_passage():
+    builder = make_builder(file_token_limit=20)
+    context = builder.fit_context([passage("a", "длинный текст " * 100, 1.0)], max_tokens=10_000)
+    assert context.count(TRUNCATED_MARK) == 1
+    assert builder.counter.count(context) < 60
+
+
+def test_context_budget_reserves_instructions_and_output():
+    builder = make_builder(budget_tokens=1000, context_window=100_000)
+    instructions = "инструкция " * 30
+    assert builder.context_budget(instructions, output_tokens=200) == 1000 - builder.counter.count(instructions)
+    # Окно модели меньше бюджета: ограничивает окно минус ожидаемый ответ
+    small_window = make_builder(budget_tokens=1000, context_window=500)
+    assert small_window.context_budget("", output_tokens=200) == 300
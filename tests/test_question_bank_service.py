@@ -0,0 +1,98 @@
+import random
+import uuid
+from collections import Counter
+
+import pytest
+from qdrant_client.models import PointStruct
+
+from app.services import question_bank_service
+from app.services.question_bank_service import QuestionBankService, _spread_order
+
+
+def question(text: str):
+    return {"question": text, "answers": [{"да": 1}, {"нет": 0}]}
+
+
+@pytest.fixture
+def bank(db_service):
+    service = QuestionBankService(db_service, collection_name=f"bank_{uuid.uuid4().hex[:8]}")
+    assert service.init_collection()["success"]
+    yield service
+    service.client.delete_collection(service.collection_name)
+
+
+def put_questions(bank, user_id: str, file_id: str, texts):
+    vectors = bank.db_service.embedding_backend.encode(texts)
+    bank.client.upsert(collection_name=bank.collection_name, points=[
+        PointStruct(id=str(uuid.uuid4()), vector=vector.tolist(),
+                    payload={"user_id": user_id, "file_id": file_id, "question": question(text)})
+        for text, vector in zip(texts, vectors)
+    ])
+
+
+@pytest.mark.parametrize("count", [0, 1, 2, 7, 16, 100])
+def test_spread_order_is_a_permutation(count):
+    assert sorted(_spread_order(count)) == list(range(count))
+
+
+def test_spread_order_prefix_covers_the_whole_range():
+    ranks = _spread_order(100)
+    first = sorted(index for index, rank in enumerate(ranks) if rank < 8)
+    assert first[0] == 0 and first[-1] >= 75
+    # Первые восемь не толпятся: между соседями не меньше 1/16 длины
+    assert min(b - a for a, b in zip(first, first[1:])) >= 6
+
+
+def test_sample_draws_distinct_questions_of_the_user(bank):
+    put_questions(bank, "u", "f1", [f"матрица ранг вопрос {i}" for i in range(10)])
+    put_questions(bank, "other", "f9", [f"матрица ранг чужой {i}" for i in range(10)])
+
+    sampled = bank.sample("u", "матрица ранг", count=5)
+    texts = [q["question"] for q in sampled]
+    assert len(texts) == len(set(texts)) == 5
+    assert all("чужой" not in text for text in texts)
+
+
+def test_sample_filters_by_file_and_drops_duplicates_across_files(bank):
+    put_questions(bank, "u", "f1", ["матрица ранг общий", "матрица ранг первый"])
+    put_questions(bank, "u", "f2", ["Матрица, ранг: общий", "матрица ранг второй"])
+    put_questions(bank, "u", "f3", ["матрица ранг третий"])
+
+    sampled = bank.sample("u", "матрица ранг", count=10, file_ids=["f1", "f2"])
+    texts = sorted(q["question"] for q in sampled)
+    assert len(texts) == 3
+    assert "матрица ранг третий" not in texts
+
+
+def test_sample_prefers_closer_questions(bank, monkeypatch):
+    monkeypatch.setattr(question_bank_service, "QUESTION_BANK_MIN_SCORE", 0.0)
+    put_questions(bank, "u", "f1", ["предел функции непрерывность", "предел функции", "ранг матрицы определитель"])
+    random.seed(0)
+    picks = Counter(bank.sample("u", "предел функции", count=1)[0]["question"] for _ in range(300))
+    assert picks["предел функции"] > picks["предел функции непрерывность"] > picks["ранг матрицы определитель"]
+
+
+def test_sample_without_collection_is_empty(db_service):
+    missing = QuestionBankService(db_service, collection_name=f"missing_{uuid.uuid4().hex[:8]}")
+    assert missing.sample("u", "запрос", count=3) == []
+
+
+def test_build_for_file_uses_all_chunks(bank, monkeypatch):
+    text = "".join(f"Раздел {i}. " + f"Содержание раздела {i} про матрицы. " * 40 + "\n\n" for i in range(40))
+    file_id = bank.db_service.add_file("u", text.encode(), "big.txt")
+    seen = {}
+
+    def generate_test(query, passages, count):
+        seen["passages"] = passages
+        return [question(f"Вопрос {i}?") for i in range(count)]
+
+    monkeypatch.setattr(question_bank_service, "generate_test", generate_test)
+    monkeypatch.setattr(question_bank_service, "QUESTION_BANK_SIZE", 4)
+
+    assert bank.build_for_file("u", file_id) == 4
+    passages = seen["passages"]
+    # Весь текст, а не превью из первых 5000 символов
+    assert len(passages) > 1 and "Раздел 39." in "".join(p["text"] for p in passages)
+    best = max(passages, key=lambda p: p["score"])
+    assert best["title"] == f"big.txt (фрагмент 1 из {len(passages)})"
+    assert bank.job_status("u", file_id)["status"] == "done"
@@ -0,0 +1,86 @@
+import json
+
+from app.services.question_parser import QuestionStreamParser, normalize_question_text, parse_questions
+
+
+def question(text: str, correct: int = 0, topic: str = "Алгебра"):
+    return {
+        "question": text,
+        "topic": topic,
+        "answers": [{f"вариант {i}": int(i == correct)} for i in range(3)],
+    }
+
+
+def test_parses_wrapped_structured_output():
+    text = json.dumps({"questions": [
+        {"question": "Что такое ранг?", "topic": "Алгебра",
+         "answers": [{"text": "Число строк", "correct": False}, {"text": "Максимум независимых строк", "correct": True}]}
+    ]}, ensure_ascii=False)
+    assert parse_questions(text) == [{
+        "question": "Что такое ранг?",
+        "topic": "Алгебра",
+        "answers": [{"Число строк": 0}, {"Максимум независимых строк": 1}],
+    }]
+
+
+def test_stream_split_at_any_position_gives_same_questions():
+    text = "Вот тест:\n```json\n" + json.dumps([question("Первый?"), question("Второй?", 1)], ensure_ascii=False) + "\n```"
+    for size in (1, 2, 7, 50):
+        parser = QuestionStreamParser()
+        found = []
+        for start in range(0, len(text), size):
+            found.extend(parser.feed(text[start:start + size]))
+        assert [q["question"] for q in found] == ["Первый?", "Второй?"]
+        assert not parser.incomplete
+
+
+def test_braces_and_quotes_inside_strings_do_not_break_balancing():
+    tricky = question('Что вернёт f("{x}") при x = "}"?')
+    tricky["answers"][0] = {'строку "{"': 1}
+    parser = QuestionStreamParser()
+    parser.feed(json.dumps([tricky, question("Следующий?")], ensure_ascii=False))
+    assert [q["question"] for q in parser.questions] == [tricky["question"], "Следующий?"]
+
+
+def test_truncated_stream_keeps_complete_questions():
+    text = json.dumps([question("Целый?"), question("Оборванный?")], ensure_ascii=False)
+    parser = QuestionStreamParser()
+    parser.feed(text[:text.index("Оборванный") + 5])
+    assert [q["question"] for q in parser.questions] == ["Целый?"]
+    assert parser.incomplete
+
+
+def test_invalid_questions_are_rejected_and_counted():
+    no_correct = question("Без правильного?")
+    no_correct["answers"] = [{"a": 0}, {"b": 0}]
+    two_correct = question("Два правильных?")
+    two_correct["answers"] = [{"a": 1}, {"b": 1}]
+    parser = QuestionStreamParser()
+    parser.feed(json.dumps([no_correct, two_correct, question("Нормальный?")], ensure_ascii=False))
+    assert [q["question"] for q in parser.questions] == ["Нормальный?"]
+    assert parser.rejected == 2
+
+
+def test_trailing_commas_are_tolerated():
+    parser = QuestionStreamParser()
+    parser.feed('{"question": "Запятая?", "answers": [{"a": 1}, {"b": 0},],}')
+    assert [q["question"] for q in parser.questions] == ["Запятая?"]
+
+
+def test_duplicates_are_dropped_across_responses():
+    parser = QuestionStreamParser()
+    parser.feed(json.dumps([question("Что такое предел?")], ensure_ascii=False))
+    parser.reset_stream()
+    found = parser.feed(json.dumps([question("что такое   ПРЕДЕЛ"), question("Новый?")], ensure_ascii=False))
+    assert [q["question"] for q in found] == ["Новый?"]
+    assert len(parser.questions) == 2
+
+
+def test_add_reports_duplicates():
+    parser = QuestionStreamParser()
+    assert parser.add(question("Вопрос один?"))
+    assert not parser.add(question("вопрос, один"))
+
+
+def test_normalize_question_text():
+    assert normalize_question_text("  Что такое, ранг?! ") == "что такое ранг"
@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+
+from app.services.rerank_service import CrossEncoderReranker
+
+
+class FakeCrossEncoder:
+    """Оценка пары - длина текста; delay - время на батч"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.batches = 0
+
+    def predict(self, pairs, **kwargs):
+        self.batches += 1
+        time.sleep(self.delay)
+        return [float(len(text)) for _, text in pairs]
+
+
+def candidates(*texts):
+    return [{"text": text} for text in texts]
+
+
+def make_reranker(model=None, **kwargs) -> CrossEncoderReranker:
+    reranker = CrossEncoderReranker(enabled=True, **kwargs)
+    reranker._model = model
+    return reranker
+
+
+def texts(ranked):
+    return [candidate["text"] for candidate in ranked]
+
+
+def test_reorders_by_cross_encoder_score():
+    reranker = make_reranker(FakeCrossEncoder(), budget_ms=1000)
+    ranked = reranker.rerank("запрос", candidates("a", "ccc", "bb"))
+    assert texts(ranked) == ["ccc", "bb", "a"]
+    assert [candidate["rerank_score"] for candidate in ranked] == [3.0, 2.0, 1.0]
+    assert reranker.outcomes == {"ok": 1}
+
+
+def test_only_head_is_scored_tail_keeps_vector_order():
+    reranker = make_reranker(FakeCrossEncoder(), budget_ms=1000, max_candidates=2)
+    ranked = reranker.rerank("запрос", candidates("a", "bb", "zzzz", "y"))
+    assert texts(ranked) == ["bb", "a", "zzzz", "y"]
+
+
+def test_disabled_or_trivial_input_is_returned_as_is():
+    original = candidates("a", "bb")
+    assert CrossEncoderReranker(enabled=False).rerank("q", original) is original
+    reranker = make_reranker(FakeCrossEncoder())
+    assert reranker.rerank("", original) is original
+    assert reranker.rerank("q", original[:1]) == original[:1]
+
+
+def test_budget_exceeded_falls_back_and_is_counted():
+    model = FakeCrossEncoder(delay=0.2)
+    reranker = make_reranker(model, budget_ms=50, batch_size=1)
+    original = candidates("a", "ccc", "bb")
+    started = time.monotonic()
+    assert texts(reranker.rerank("q", original)) == ["a", "ccc", "bb"]
+    assert time.monotonic() - started < 0.15
+    assert reranker.outcomes == {"timeout": 1}
+    # Оставшиеся батчи после срока не считаются
+    time.sleep(0.3)
+    assert model.batches == 1
+
+
+def test_model_error_falls_back_and_is_counted():
+    class Broken:
+        def predict(self, *args, **kwargs):
+            raise RuntimeError("boom")
+
+    reranker = make_reranker(Broken(), budget_ms=1000)
+    assert texts(reranker.rerank("q", candidates("a", "bb"))) == ["a", "bb"]
+    assert reranker.outcomes == {"error": 1}
+
+
+def test_cold_model_loads_in_background_without_waiting():
+    loaded = threading.Event()
+    reranker = make_reranker(None, budget_ms=1000)
+
+    def load():
+        if reranker._model is None:
+            time.sleep(0.2)
+            reranker._model = FakeCrossEncoder()
+            loaded.set()
+        return reranker._model
+
+    reranker.load = load
+    started = time.monotonic()
+    assert texts(reranker.rerank("q", candidates("a", "bb"))) == ["a", "bb"]
+    assert texts(reranker.rerank("q", candidates("a", "bb"))) == ["a", "bb"]
+    assert time.monotonic() - started < 0.1
+    assert reranker.outcomes == {"cold": 2}
+
+    assert loaded.wait(1)
+    assert texts(reranker.rerank("q", candidates("a", "bb"))) == ["bb", "a"]
+
+
+def test_failed_background_load_is_retried():
+    reranker = make_reranker(None)
+    attempts = []
+
+    def load():
+        attempts.append(1)
+        raise RuntimeError("нет модели")
+
+    reranker.load = load
+    reranker.rerank("q", candidates("a", "bb"))
+    reranker._loading.exception(timeout=1)
+    reranker.rerank("q", candidates("a", "bb"))
+    reranker._loading.exception(timeout=1)
+    assert len(attempts) == 2 and not reranker.loaded
+
+
+@pytest.mark.parametrize("rerank", [False, True])
+def test_search_files_rerank_uses_file_text(db_service, monkeypatch, rerank):
+    from app.services import user_db_service
+
+    reranker = make_reranker(FakeCrossEncoder(), budget_ms=1000, max_candidates=10)
+    monkeypatch.setattr(user_db_service, "reranker", reranker)
+    db_service.add_file("u", "матрица ранг".encode(), "short.txt")
+    db_service.add_file("u", ("матрица ранг " * 20).encode(), "long.txt")
+
+    found = db_service.search_files("u", "матрица ранг", limit=2, rerank=rerank)
+    if rerank:
+        assert [hit["payload"]["filename"] for hit in found] == ["long.txt", "short.txt"]
+        assert all("rerank_score" in hit for hit in found)
+    else:
+        assert all("rerank_score" not in hit for hit in found)
@@ -0,0 +1,144 @@
+import json
+import multiprocessing
+import os
+import zlib
+
+import pytest
+
+from app.services import state_store as state_store_module
+from app.services.history_service import HistoryService
+from app.services.serialization import ZSTD_MAGIC, pack, unpack
+from app.services.state_store import HISTORY, RESULTS, TEST_BODIES, TESTS, FileStateStore
+
+VALUE = {"вопрос": "Что такое ранг?", "варианты": [1, 2.5, None, True], "вложенный": {"a": []}}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FileStateStore(str(tmp_path), fmt="compact")
+
+
+def test_pack_compact_is_zstd_and_roundtrips():
+    data = pack(VALUE, "compact")
+    assert data[:4] == ZSTD_MAGIC
+    assert unpack(data) == VALUE
+
+
+@pytest.mark.parametrize("data", [
+    pack(VALUE, "json"),
+    zlib.compress(json.dumps(VALUE).encode("utf-8")),
+    json.dumps(VALUE, ensure_ascii=False),
+])
+def test_unpack_reads_every_format(data):
+    assert unpack(data) == VALUE
+
+
+@pytest.mark.parametrize("data", [ZSTD_MAGIC + b"garbage", b"x\x9cgarbage", b"{not json"])
+def test_unpack_rejects_corrupted_data(data):
+    with pytest.raises(ValueError):
+        unpack(data)
+
+
+def test_file_names_follow_the_format(tmp_path):
+    compact = FileStateStore(str(tmp_path), fmt="compact")
+    compact.put(TESTS, "user@mail", VALUE)
+    assert os.listdir(tmp_path) == ["generated_tests_user@mail.zst"]
+
+    plain = FileStateStore(str(tmp_path), fmt="json")
+    assert plain.get(TESTS, "user@mail") == VALUE
+    plain.put(TESTS, "user@mail", VALUE)
+    # Запись в новом формате убирает файл прежнего
+    assert os.listdir(tmp_path) == ["generated_tests_user@mail.json"]
+    with open(tmp_path / "generated_tests_user@mail.json", encoding="utf-8") as f:
+        assert json.load(f) == VALUE
+    assert compact.get(TESTS, "user@mail") == VALUE
+
+
+def test_corrupted_record_reads_as_missing(store, tmp_path):
+    (tmp_path / "last_result_u.zst").write_bytes(ZSTD_MAGIC + b"garbage")
+    assert store.get(RESULTS, "u") is None
+
+
+def test_keys_and_namespaces(store):
+    store.put(HISTORY, "a/b", [1])
+    store.put(HISTORY, "c", [2])
+    store.put(RESULTS, "a/b", {})
+    with store._exclusive(HISTORY, "locked-only"):
+        pass
+    assert store.keys(HISTORY) == ["a/b", "c"]
+    assert store.keys(RESULTS) == ["a/b"]
+    assert store.keys(TEST_BODIES) == []
+
+
+def test_delete_removes_record_and_its_lock(store, tmp_path):
+    store.incr(HISTORY, "u")
+    assert sorted(os.listdir(tmp_path / "history")) == ["u.lock", "u.zst"]
+    store.delete(HISTORY, "u")
+    assert os.listdir(tmp_path / "history") == []
+    assert store.get(HISTORY, "u") is None and store.version(HISTORY, "u") is None
+
+
+def test_prune_locks_keeps_locks_of_live_records(store, tmp_path):
+    store.incr(HISTORY, "live")
+    with store._exclusive(HISTORY, "gone"):
+        pass
+    assert store.prune_locks(HISTORY) == 1
+    assert sorted(os.listdir(tmp_path / "history")) == ["live.lock", "live.zst"]
+
+
+def test_update_skips_write_when_fn_returns_none(store):
+    assert store.update(RESULTS, "u", lambda current: None) is None
+    assert store.keys(RESULTS) == []
+    store.put(RESULTS, "u", {"score": 1})
+    version = store.version(RESULTS, "u")
+    assert store.update(RESULTS, "u", lambda current: None) == {"score": 1}
+    assert store.version(RESULTS, "u") == version
+
+
+def test_version_changes_after_delete_and_rewrite(store):
+    store.put(TESTS, "u", VALUE)
+    before = store.version(TESTS, "u")
+    store.delete(TESTS, "u")
+    store.put(TESTS, "u", VALUE)
+    assert store.version(TESTS, "u")[0] != before[0]
+
+
+def _increment(root: str, times: int):
+    store = FileStateStore(root, fmt="compact")
+    for i in range(times):
+        store.incr(HISTORY, "counter")
+        if i % 10 == 0:
+            store.delete(HISTORY, f"churn-{os.getpid()}")
+
+
+@pytest.mark.skipif(state_store_module.fcntl is None, reason="нужна блокировка flock")
+def test_incr_is_atomic_across_processes(store):
+    processes = [multiprocessing.Process(target=_increment, args=(store.root, 100)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+    assert all(process.exitcode == 0 for process in processes)
+    assert store.get(HISTORY, "counter") == 400
+
+
+def test_history_compaction_applies_retention_and_drops_orphans(store, monkeypatch):
+    monkeypatch.setattr(state_store_module, "_store", store)
+    history = HistoryService(max_per_user=3, keep_full=1, retention_days=0, enabled=True)
+    grading = {"score": 1, "total": 2, "percentage": 50.0, "per_topic": {}}
+    for i in range(5):
+        history.record_submission("u", f"s{i}", [{"question": f"вопрос {i}"}], [0], grading, "разбор", "done")
+
+    entries = history.entries("u")
+    assert [entry["submission_id"] for entry in entries] == ["s2", "s3", "s4"]
+    assert [bool(entry.get("compacted")) for entry in entries] == [True, True, False]
+    assert "answers" not in entries[0] and entries[-1]["analysis"] == "разбор"
+
+    # Тела без ссылок удаляются только после льготного срока
+    assert history.compact()["test_bodies_deleted"] == 0
+    monkeypatch.setattr("app.services.history_service.BODY_GRACE_SECONDS", -1)
+    stats = history.compact()
+    assert stats["users"] == 1 and stats["entries"] == 3
+    # Сжатые попытки хранят только итоги - остаётся тело последней полной
+    assert store.keys(TEST_BODIES) == [entries[-1]["test_hash"]]
+    assert stats["test_bodies_deleted"] == 4
@@ -0,0 +1,89 @@
+import pytest
+
+from app.services import test_generation_service
+from app.services.test_generation_service import _partition_passages, generate_questions_fanout, generate_test
+
+
+def passage(title: str, score: float, text: str = "текст"):
+    return {"title": title, "score": score, "text": text}
+
+
+def question(text: str):
+    return {"question": text, "answers": [{"да": 1}, {"нет": 0}]}
+
+
+def test_partition_round_robin_by_relevance():
+    passages = [passage(name, score) for name, score in [("c", 0.1), ("a", 0.9), ("d", 0.05), ("b", 0.5)]]
+    partitions = _partition_passages(passages, 2)
+    assert [[p["title"] for p in part] for part in partitions] == [["a", "c"], ["b", "d"]]
+
+
+def test_partition_splits_text_when_fewer_files_than_parts():
+    partitions = _partition_passages([passage("file", 1.0, "0123456789" * 3)], 3)
+    assert len(partitions) == 3
+    assert "".join(part[0]["text"] for part in partitions) == "0123456789" * 3
+    assert [part[0]["title"] for part in partitions] == ["file (часть 1)", "file (часть 2)", "file (часть 3)"]
+
+
+def test_partition_without_context_gives_empty_parts():
+    assert _partition_passages([], 3) == [[], [], []]
+
+
+@pytest.fixture
+def fake_parts(monkeypatch):
+    """Части генерируются без модели: каждая возвращает part_count вопросов со своим префиксом"""
+    calls = []
+
+    def generate_part(query, passages, count, focus):
+        index = len(calls)
+        calls.append({"passages": passages, "count": count, "focus": focus})
+        return [question(f"часть {index} вопрос {i}") for i in range(count)]
+
+    monkeypatch.setattr(test_generation_service, "_generate_part", generate_part)
+    monkeypatch.setattr(test_generation_service, "TEST_FANOUT_CONCURRENCY", 1)
+    return calls
+
+
+def test_fanout_spreads_count_over_parts(fake_parts, monkeypatch):
+    monkeypatch.setattr(test_generation_service, "TEST_FANOUT_QUESTIONS_PER_CALL", 8)
+    passages = [passage(str(i), 1.0 - i / 10) for i in range(5)]
+    questions = generate_questions_fanout("тема", passages, 20)
+
+    assert len(questions) == 20
+    assert sorted(call["count"] for call in fake_parts) == [6, 7, 7]
+    assert all(call["focus"] is None for call in fake_parts)
+
+
+def test_fanout_without_context_gives_each_part_a_focus(fake_parts, monkeypatch):
+    monkeypatch.setattr(test_generation_service, "TEST_FANOUT_QUESTIONS_PER_CALL", 5)
+    generate_questions_fanout("тема", [], 10)
+    assert [call["count"] for call in fake_parts] == [5, 5]
+    assert all("часть" in call["focus"] for call in fake_parts)
+
+
+def test_fanout_tops_up_when_parts_return_too_few(monkeypatch):
+    monkeypatch.setattr(test_generation_service, "TEST_FANOUT_QUESTIONS_PER_CALL", 5)
+    monkeypatch.setattr(test_generation_service, "_generate_part", lambda *args: [question("одинаковый")])
+    topped_up = {}
+
+    def generate_questions(query, passages, count, parser):
+        topped_up["already"] = len(parser.questions)
+        return [question(f"дозапрос {i}") for i in range(count)]
+
+    monkeypatch.setattr(test_generation_service, "generate_questions", generate_questions)
+    assert len(generate_questions_fanout("тема", [], 10)) == 10
+    # Одинаковые вопросы частей слились в один
+    assert topped_up["already"] == 1
+
+
+@pytest.mark.parametrize("mode, count, expected", [
+    ("auto", 5, "single"),
+    ("auto", None, "single"),
+    ("auto", 100, "fanout"),
+    ("fanout", None, "fanout"),
+    ("single", 100, "single"),
+])
+def test_generate_test_mode(monkeypatch, mode, count, expected):
+    monkeypatch.setattr(test_generation_service, "generate_questions_fanout", lambda *args: "fanout")
+    monkeypatch.setattr(test_generation_service, "generate_questions", lambda *args, **kwargs: "single")
+    assert generate_test("тема", [], count=count, mode=mode) == expected
@@ -0,0 +1,127 @@
+import uuid
+
+import numpy as np
+import pytest
+
+from app.services.chunker import chunk_ids, split_chunks
+from app.services.user_db_service import UserDBService
+from tests.conftest import HashEmbeddings
+
+
+def lecture(sections: int, start: int = 0) -> str:
+    return "".join(
+        f"Лекция {i}. " + "\n".join(f"Строка {j} лекции {i} про матрицы и ранги." for j in range(40)) + "\n\n"
+        for i in range(start, start + sections)
+    )
+
+
+def chunk_count(service: UserDBService, file_id: str) -> int:
+    return len(service.get_file_chunks("u", file_id))
+
+
+def test_chunk_boundaries_survive_an_edit_in_the_middle():
+    text = lecture(20)
+    lines = text.splitlines()
+    edited = "\n".join(lines[:300] + ["Вставленная строка про определитель."] + lines[300:])
+    before = {chunk.hash for chunk in split_chunks(text)}
+    after = {chunk.hash for chunk in split_chunks(edited)}
+    assert len(before) > 10
+    # Правка одной строки меняет один-два фрагмента, а не сдвигает все последующие
+    assert len(after - before) <= 2
+
+
+def test_chunk_ids_number_repeated_text():
+    ids = chunk_ids("file", ["h1", "h2", "h1"])
+    assert len(set(ids)) == 3
+    assert ids == chunk_ids("file", ["h1", "h2", "h1"])
+    assert ids[0] != chunk_ids("other", ["h1"])[0]
+
+
+def test_first_upload_embeds_every_chunk_in_one_batch(db_service):
+    result = db_service.upsert_file("u", lecture(10).encode(), "lecture.txt")
+    assert not result["replaced"] and result["changed"]
+    assert result["chunks"]["reused"] == 0 and result["chunks"]["embedded"] == chunk_count(db_service, result["file_id"])
+    # Один батч фрагментов и один эмбеддинг файла целиком
+    assert db_service.embedding_backend.calls == 2
+
+
+def test_identical_reupload_only_refreshes_metadata(db_service):
+    first = db_service.upsert_file("u", lecture(10).encode(), "lecture.txt")
+    calls = db_service.embedding_backend.calls
+    again = db_service.upsert_file("u", lecture(10).encode(), "lecture.txt", {"course": "алгебра"})
+    assert again["file_id"] == first["file_id"] and again["replaced"] and not again["changed"]
+    assert db_service.embedding_backend.calls == calls
+    assert db_service.get_file_by_id("u", first["file_id"])["payload"]["course"] == "алгебра"
+
+
+def test_replace_embeds_only_changed_chunks(db_service):
+    first = db_service.upsert_file("u", lecture(10).encode(), "lecture.txt")
+    total = first["chunks"]["embedded"]
+    changed = db_service.upsert_file("u", (lecture(9) + lecture(2, start=50)).encode(), "lecture.txt")
+
+    assert changed["file_id"] == first["file_id"] and changed["replaced"] and changed["changed"]
+    stats = changed["chunks"]
+    assert stats["reused"] >= total - 4
+    assert 0 < stats["embedded"] <= 6 and 0 < stats["deleted"] <= 4
+    assert chunk_count(db_service, first["file_id"]) == stats["reused"] + stats["embedded"]
+    texts = "".join(chunk["text"] for chunk in db_service.get_file_chunks("u", first["file_id"]))
+    assert "Лекция 50." in texts and "Лекция 9." not in texts
+
+
+def test_replace_drops_older_duplicates_with_their_chunks(db_service):
+    first = db_service.add_file("u", lecture(3).encode(), "lecture.txt")
+    second = db_service.add_file("u", lecture(4).encode(), "lecture.txt")
+    assert first != second
+
+    result = db_service.upsert_file("u", lecture(5).encode(), "lecture.txt")
+    assert result["file_id"] == second and result["removed_duplicates"] == [first]
+    assert db_service.get_file_by_id("u", first) is None
+    hits = db_service.search_chunks("u", "матрицы и ранги", limit=100)
+    assert {hit["payload"]["file_id"] for hit in hits} == {second}
+
+
+def test_file_vector_is_embedding_of_head_and_tail(db_service):
+    text = lecture(30)
+    file_id = db_service.add_file("u", text.encode(), "lecture.txt")
+    stored = db_service.client.retrieve(db_service.collection_name, ids=[file_id], with_vectors=True)[0].vector
+    np.testing.assert_allclose(stored, db_service._file_vector(text), atol=1e-6)
+
+
+def test_delete_file_removes_its_chunks(db_service):
+    file_id = db_service.add_file("u", lecture(3).encode(), "lecture.txt")
+    assert db_service.delete_file("u", file_id)
+    assert db_service.search_chunks("u", "матрицы", limit=10) == []
+
+
+def test_chunk_collection_is_created_on_first_use(db_service):
+    # Развёртывание, где основная коллекция уже была, а коллекции фрагментов ещё нет
+    suffix = uuid.uuid4().hex[:8]
+    service = UserDBService(collection_name=db_service.collection_name, chunk_collection=f"late_chunks_{suffix}")
+    service.embedding_backend = HashEmbeddings()
+    assert not service.client.collection_exists(service.chunk_collection)
+    try:
+        assert service.search_chunks("u", "матрицы") == []
+        assert service.client.collection_exists(service.chunk_collection)
+        service._delete_chunks(["missing"])
+    finally:
+        service.client.delete_collection(service.chunk_collection)
+
+
+def test_delete_chunks_tolerates_missing_collection(db_service):
+    service = UserDBService(collection_name=db_service.collection_name, chunk_collection="never_created")
+    service._delete_chunks(["file"])
+
+
+@pytest.mark.parametrize("group_size, expected_per_file", [(1, 1), (2, 2)])
+def test_search_batch_collects_limit_distinct_files_when_one_file_dominates(db_service, group_size, expected_per_file):
+    db_service.add_file("u", ("Глава. " + "матрица ранг определитель. " * 30 + "\n\n").encode() * 200, "big.txt")
+    for k in range(6):
+        db_service.add_file("u", f"файл {k} матрица ранг прочее слово".encode(), f"small{k}.txt")
+
+    results = db_service.search_batch("u", ["матрица ранг определитель", ""], limit=5, chunks=True,
+                                      group_by="file_id", group_size=group_size)
+    assert len(results[0]) == 5 and results[1] == []
+    per_file = {}
+    for hit in results[0]:
+        per_file[hit["payload"]["file_id"]] = per_file.get(hit["payload"]["file_id"], 0) + 1
+    assert max(per_file.values()) <= expected_per_file